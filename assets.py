@@ -0,0 +1,177 @@
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from flask import Response, abort, current_app, request
+
+from columnar import accepted_encodings
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+# Static files and HTML pages, served from memory. At startup every file
+# under ASSET_DIRS is read, content-hashed and compressed once with gzip
+# (and brotli when installed). Pages get their /static/... references
+# rewritten to fingerprinted URLs like /static/js/kanban.3f9a0c51d2e7.js.
+# Those URLs never change content, so browsers keep them for a year without
+# asking again. Pages and unfingerprinted URLs are revalidated on every load
+# (a 304 when unchanged), so a deploy is picked up at once. Only the listed
+# directories and pages are served: nothing else in the project directory
+# (databases, CSV files, sources) is reachable.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSET_DIRS = ('static/js', 'static/styles')
+ASSET_EXTENSIONS = {'.js', '.css', '.svg', '.png', '.ico', '.woff2'}
+PAGES = ('index_db.html', 'kanban.html', 'dashboard.html', 'dbmanager.html')
+
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.svg', '.html'}
+MIN_COMPRESS_BYTES = 512
+FINGERPRINT_CHARS = 12
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+_FINGERPRINTED = re.compile(rf'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{{{FINGERPRINT_CHARS}}})(?P<ext>\.[^./]+)$')
+_REFERENCE = re.compile(r'''(?P<prefix>\b(?:src|href)=["'])/(?P<path>static/[^"'?#]+)''')
+
+
+def _entry(body, path):
+    # The body with its ETag and precompressed variants, smallest first
+    ext = os.path.splitext(path)[1]
+    entry = {
+        'body': body,
+        'mimetype': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+        'etag': hashlib.blake2b(body, digest_size=16).hexdigest(),
+        'encoded': {},
+    }
+    if ext in COMPRESSIBLE_EXTENSIONS and len(body) >= MIN_COMPRESS_BYTES:
+        variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, quality=11)
+        for coding, data in sorted(variants.items(), key=lambda item: len(item[1])):
+            if len(data) < len(body):
+                entry['encoded'][coding] = data
+    return entry
+
+
+class AssetStore:
+    def __init__(self, root=ROOT, dirs=ASSET_DIRS, pages=PAGES):
+        self.root = root
+        self.dirs = dirs
+        self.page_names = pages
+        self.assets = {}  # 'js/kanban.js' -> entry
+        self.pages = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _files(self):
+        # (relative path, mtime) of every file that is served
+        files = []
+        for directory in self.dirs:
+            for dirpath, _, names in os.walk(os.path.join(self.root, directory)):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    if os.path.splitext(name)[1] in ASSET_EXTENSIONS:
+                        files.append((os.path.relpath(path, self.root), os.path.getmtime(path)))
+        for name in self.page_names:
+            path = os.path.join(self.root, name)
+            if os.path.exists(path):
+                files.append((name, os.path.getmtime(path)))
+        return sorted(files)
+
+    def load(self):
+        with self._lock:
+            files = self._files()
+            assets, pages = {}, {}
+            for path, _ in files:
+                with open(os.path.join(self.root, path), 'rb') as f:
+                    body = f.read()
+                if path in self.page_names:
+                    pages[path] = body
+                else:
+                    # Served under /static/<name>, keyed without the prefix
+                    assets[path.split(os.sep, 1)[1].replace(os.sep, '/')] = _entry(body, path)
+            self.assets = assets
+            self.pages = {name: _entry(self._rewrite(body), name) for name, body in pages.items()}
+            self._stamp = files
+
+    def refresh(self):
+        # Reload when a file was added, removed or modified (development)
+        if self._files() != self._stamp:
+            self.load()
+
+    def url(self, name):
+        # The fingerprinted URL for a static file, e.g. 'js/kanban.js'
+        entry = self.assets.get(name)
+        if entry is None:
+            return f'/static/{name}'
+        stem, ext = os.path.splitext(name)
+        return f"/static/{stem}.{entry['etag'][:FINGERPRINT_CHARS]}{ext}"
+
+    def _rewrite(self, body):
+        def replace(match):
+            return match.group('prefix') + self.url(match.group('path')[len('static/'):])
+        return _REFERENCE.sub(replace, body.decode()).encode()
+
+    def find(self, filename):
+        # (entry, immutable) for a request path under /static/, or (None, False)
+        entry = self.assets.get(filename)
+        match = _FINGERPRINTED.match(filename)
+        if entry is None and match:
+            entry = self.assets.get(match.group('stem') + match.group('ext'))
+            if entry is not None and entry['etag'].startswith(match.group('digest')):
+                return entry, True
+        # A plain name, or a fingerprint from an older deploy: current content,
+        # revalidated on every use
+        return entry, False
+
+
+asset_store = AssetStore()
+
+
+def _send(entry, cache_control):
+    accepted = accepted_encodings()
+    coding = next((coding for coding in entry['encoded'] if coding in accepted), None)
+    body = entry['encoded'][coding] if coding else entry['body']
+    response = Response(body, mimetype=entry['mimetype'])
+    response.headers['Cache-Control'] = cache_control
+    response.set_etag(f"{entry['etag']}-{coding}" if coding else entry['etag'])
+    if entry['encoded']:
+        response.vary.add('Accept-Encoding')
+    if coding:
+        response.content_encoding = coding
+    return response.make_conditional(request)
+
+
+def asset_response(filename):
+    if current_app.debug:
+        asset_store.refresh()
+    entry, immutable = asset_store.find(filename)
+    if entry is None:
+        abort(404)
+    return _send(entry, IMMUTABLE if immutable else REVALIDATE)
+
+
+def page_response(name):
+    if current_app.debug:
+        asset_store.refresh()
+    entry = asset_store.pages.get(name)
+    if entry is None:
+        abort(404)
+    return _send(entry, REVALIDATE)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List the served static files with their fingerprinted URLs.')
+    parser.parse_args()
+
+    asset_store.load()
+    print(f"brotli: {'yes' if brotli is not None else 'not installed'}")
+    for name, entry in sorted(asset_store.assets.items()) + sorted(asset_store.pages.items()):
+        sizes = ', '.join(f"{coding} {len(data)}" for coding, data in entry['encoded'].items())
+        url = asset_store.url(name) if name in asset_store.assets else f'/{name}'
+        print(f"{url:<45} {len(entry['body']):>8}  {sizes}")
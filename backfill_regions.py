@@ -0,0 +1,100 @@
+import argparse
+import re
+import time
+
+from db import connect
+from geo import PointGrid
+
+# targets.region is the join key into zip_data. Fill it with the ZIP in the
+# address when zip_data knows that ZIP, otherwise with the ZIP whose centroid
+# is nearest to the target's coordinates. Only empty regions are filled (and,
+# on request, regions that already hold a ZIP): a region someone typed in,
+# like a market name ("DFW", "Long Island"), is never replaced.
+ADDRESS_ZIP = re.compile(r'\b(\d{5})(?:-\d{4})?\b')
+ZIP_REGION = re.compile(r'\d{5}')
+NEAREST_MAX_MI = 50.0
+
+
+def parse_zip(address):
+    # Last 5-digit group wins: street numbers come first, the ZIP last
+    matches = ADDRESS_ZIP.findall(address or '')
+    return matches[-1] if matches else None
+
+
+def load_zip_index(conn):
+    rows = conn.execute('''
+        SELECT zip_code, latitude, longitude FROM zip_data
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''').fetchall()
+    known = {row[0] for row in conn.execute('SELECT zip_code FROM zip_data')}
+    grid = PointGrid(((row[1], row[2]) for row in rows), cell_miles=10)
+    return known, [row[0] for row in rows], grid
+
+
+def resolve_region(address, latitude, longitude, known, codes, grid):
+    # (zip_code, source) with source 'address' or 'nearest'; (None, None) if neither works
+    zip_code = parse_zip(address)
+    if zip_code in known:
+        return zip_code, 'address'
+    if latitude is not None and longitude is not None and len(grid):
+        nearest = grid.nearest(latitude, longitude, NEAREST_MAX_MI)
+        if nearest:
+            return codes[nearest[0]], 'nearest'
+    return None, None
+
+
+def backfill_regions(conn, organizations=None, only_missing=True, dry_run=False):
+    # Resolve regions for all (or the given) targets in one pass and write the
+    # changed ones back with executemany; the caller commits. Targets with an
+    # empty region are filled; without only_missing, regions that are a ZIP
+    # code are re-resolved too. Any other region is left alone.
+    known, codes, grid = load_zip_index(conn)
+    rows = conn.execute('SELECT organization, address, region, latitude, longitude FROM targets').fetchall()
+    if organizations is not None:
+        wanted = set(organizations)
+        rows = [row for row in rows if row[0] in wanted]
+
+    stats = {'checked': 0, 'address': 0, 'nearest': 0, 'unresolved': 0, 'updated': 0}
+    updates = []
+    for organization, address, region, latitude, longitude in rows:
+        if region is not None and region.strip():
+            if only_missing or not ZIP_REGION.fullmatch(region.strip()):
+                continue
+        stats['checked'] += 1
+        zip_code, source = resolve_region(address, latitude, longitude, known, codes, grid)
+        if zip_code is None:
+            stats['unresolved'] += 1
+            continue
+        stats[source] += 1
+        if zip_code != region:
+            updates.append((zip_code, organization))
+
+    if updates and not dry_run:
+        conn.executemany('UPDATE targets SET region = ? WHERE organization = ?', updates)
+    stats['updated'] = len(updates)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fill targets.region with ZIP codes from the address or the nearest ZIP centroid.'
+    )
+    parser.add_argument('--all', action='store_true',
+                        help='also re-resolve regions that already hold a ZIP code (other regions are kept)')
+    parser.add_argument('--dry-run', action='store_true', help='report without writing')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        started = time.perf_counter()
+        stats = backfill_regions(conn, only_missing=not args.all, dry_run=args.dry_run)
+        conn.commit()
+    finally:
+        conn.close()
+    print(
+        f"Checked {stats['checked']} targets in {time.perf_counter() - started:.2f}s: "
+        f"{stats['address']} from address, {stats['nearest']} from nearest ZIP, "
+        f"{stats['unresolved']} unresolved, {stats['updated']} updated"
+        + (' (dry run)' if args.dry_run else '')
+    )
@@ -0,0 +1,444 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from db import DB_PATH, PRAGMAS
+
+# Backups are taken with the SQLite online backup API and stored as
+# zlib-compressed chunks of CHUNK_PAGES pages, named by their SHA-256. Each
+# backup is just a list of chunk hashes in manifest.json, so unchanged pages
+# are shared between backups and a repeated backup costs almost nothing.
+BACKUP_DIR = os.environ.get('TARGETS_BACKUP_DIR', 'data/backups')
+CHUNK_DIR = 'chunks'
+MANIFEST_FILE = 'manifest.json'
+CHUNK_PAGES = 16
+BACKUP_STEP_PAGES = int(os.environ.get('BACKUP_STEP_PAGES', 256))
+BACKUP_STEP_SLEEP = float(os.environ.get('BACKUP_STEP_SLEEP', 0.005))
+
+# What a database must have before it may replace the live one
+REQUIRED_COLUMNS = {
+    'targets': {'organization', 'address', 'region', 'latitude', 'longitude', 'status', 'last_updated'},
+    'notes': {'id', 'target_id', 'content', 'timestamp'},
+    'zip_data': {'zip_code', 'grade', 'latitude', 'longitude'},
+    'activity_log': {'organization', 'old_status', 'new_status', 'timestamp'},
+}
+
+MANIFEST_LOCK_FILE = '.manifest.lock'
+RESTORE_LOCK_FILE = '.restore.lock'
+LOCK_POLL_INTERVAL = 0.05
+
+
+class _StoreLock:
+    # Serializes changes to the store. Server workers are separate processes,
+    # so a thread lock is not enough: the holder also takes an flock on a
+    # file in BACKUP_DIR. Re-entrant within a thread. The flock is polled
+    # rather than waited for, so under gevent workers a waiting request
+    # sleeps cooperatively instead of stopping the worker's event loop.
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self, blocking=True):
+        # False when blocking is off and another thread or process holds it
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        if self._depth == 0:
+            try:
+                locked = self._lock_file(blocking)
+            except BaseException:
+                self._lock.release()
+                raise
+            if not locked:
+                self._lock.release()
+                return False
+        self._depth += 1
+        return True
+
+    def _lock_file(self, blocking):
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        f = open(_path(self.name), 'a')
+        try:
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self._file = f
+                    return True
+                except BlockingIOError:
+                    if not blocking:
+                        f.close()
+                        return False
+                    time.sleep(LOCK_POLL_INTERVAL)
+        except BaseException:
+            f.close()
+            raise
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._file.close()  # releases the flock
+            self._file = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _run_blocking(func, *args):
+    # Slow file and SQLite work (snapshots, hashing, validation, the swap).
+    # Under gevent workers it runs on gevent's thread pool, so the worker
+    # keeps serving its other connections, open /api/events streams
+    # included; otherwise it simply runs here.
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is None or not monkey.is_module_patched('threading'):
+        return func(*args)
+    from gevent import get_hub
+    return get_hub().threadpool.apply(func, args)
+
+
+# Held around every manifest read-modify-write and around garbage
+# collection, so chunks are never collected while a backup is being stored
+_lock = _StoreLock(MANIFEST_LOCK_FILE)
+# One restore at a time across all workers: hold it from writing the
+# candidate file through the swap
+restore_lock = _StoreLock(RESTORE_LOCK_FILE)
+
+
+def _path(*parts):
+    return os.path.join(BACKUP_DIR, *parts)
+
+
+def remove_file(path):
+    # A database file plus any -wal/-shm left by opening it
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _legacy_timestamp(name, path):
+    # Older backups carry their time in the name: targets_20250109_123624.db
+    match = re.search(r'(\d{8}_\d{6})', name)
+    if match:
+        try:
+            return datetime.strptime(match.group(1), '%Y%m%d_%H%M%S')
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(path))
+
+
+def _chunk_path(digest):
+    return _path(CHUNK_DIR, digest[:2], digest + '.z')
+
+
+def _atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def load_manifest():
+    try:
+        with open(_path(MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'backups': []}
+
+
+def _save_manifest(manifest):
+    _atomic_write(_path(MANIFEST_FILE), json.dumps(manifest, indent=1).encode('utf-8'))
+
+
+def _page_size(path):
+    with open(path, 'rb') as f:
+        header = f.read(18)
+    if len(header) < 18 or not header.startswith(b'SQLite format 3\x00'):
+        raise ValueError('Not a SQLite database file')
+    size = int.from_bytes(header[16:18], 'big')
+    return 65536 if size == 1 else size
+
+
+def _store_chunks(path):
+    # Split a database file into page-aligned chunks and store the new ones
+    chunk_size = _page_size(path) * CHUNK_PAGES
+    file_hash = hashlib.sha256()
+    chunks = []
+    stored = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            file_hash.update(chunk)
+            digest = hashlib.sha256(chunk).hexdigest()
+            chunk_path = _chunk_path(digest)
+            if not os.path.exists(chunk_path):
+                data = zlib.compress(chunk, 6)
+                _atomic_write(chunk_path, data)
+                stored += len(data)
+            chunks.append(digest)
+    return {
+        'size': os.path.getsize(path),
+        'sha256': file_hash.hexdigest(),
+        'stored_bytes': stored,
+        'chunks': chunks,
+    }
+
+
+def _unique_name(manifest, filename):
+    names = {entry['filename'] for entry in manifest['backups']}
+    base, ext = os.path.splitext(filename)
+    candidate, n = filename, 1
+    while candidate in names:
+        candidate = f'{base}_{n}{ext}'
+        n += 1
+    return candidate
+
+
+def add_file(path, filename, created=None):
+    # Store a database file as a backup named `filename`; the file is left as is
+    with _lock:
+        manifest = _load()
+        entry = _run_blocking(_store_chunks, path)
+        entry.update({
+            'filename': _unique_name(manifest, filename),
+            'timestamp': (created or datetime.now()).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        manifest['backups'].append(entry)
+        _save_manifest(manifest)
+        return entry
+
+
+def snapshot(dest_path, db_path=None):
+    # Consistent copy of the live database, a few pages per step so writers
+    # and readers keep getting their turn
+    src = sqlite3.connect(f"file:{db_path or DB_PATH}?mode=ro", uri=True)
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.execute(f"PRAGMA busy_timeout = {PRAGMAS['busy_timeout']}")
+        src.backup(dst, pages=BACKUP_STEP_PAGES, sleep=BACKUP_STEP_SLEEP)
+    finally:
+        dst.close()
+        src.close()
+
+
+def temp_file(prefix):
+    # A new, uniquely named empty file in BACKUP_DIR; remove it with remove_file
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=BACKUP_DIR, prefix=prefix, suffix='.tmp')
+    os.close(fd)
+    return path
+
+
+def create_backup(prefix='targets', db_path=None):
+    tmp = temp_file('backup_')
+    try:
+        _run_blocking(snapshot, tmp, db_path)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return add_file(tmp, f'{prefix}_{timestamp}.db')
+    finally:
+        remove_file(tmp)
+
+
+def get_backup(filename):
+    for entry in _load()['backups']:
+        if entry['filename'] == filename:
+            return entry
+    return None
+
+
+def iter_backup(entry):
+    for digest in entry['chunks']:
+        with open(_chunk_path(digest), 'rb') as f:
+            yield zlib.decompress(f.read())
+
+
+def materialize(entry, dest_path):
+    # Reassemble a backup into a plain database file and verify its checksum
+    _run_blocking(_materialize, entry, dest_path)
+
+
+def _materialize(entry, dest_path):
+    file_hash = hashlib.sha256()
+    with open(dest_path, 'wb') as out:
+        for chunk in iter_backup(entry):
+            file_hash.update(chunk)
+            out.write(chunk)
+    if file_hash.hexdigest() != entry['sha256']:
+        raise ValueError(f"Backup {entry['filename']} failed its checksum")
+
+
+def validate_database(path):
+    # Integrity, schema and row counts of a candidate; raises ValueError
+    return _run_blocking(_validate_database, path)
+
+
+def _validate_database(path):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA integrity_check(20)')]
+        if problems != ['ok']:
+            raise ValueError('Integrity check failed: ' + '; '.join(problems))
+        counts = {}
+        for table, required in REQUIRED_COLUMNS.items():
+            columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if not columns:
+                raise ValueError(f'Missing table {table}')
+            missing = required - columns
+            if missing:
+                raise ValueError(f"Table {table} is missing columns: {', '.join(sorted(missing))}")
+            counts[table] = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        return counts
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f'Not a usable database: {e}') from e
+    finally:
+        conn.close()
+
+
+def restore_into(source_path, db_path=None):
+    # Copy a database file over the live one through the backup API: readers
+    # keep their snapshot until the copy commits, nobody sees a torn file
+    src = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+    dst = sqlite3.connect(db_path or DB_PATH)
+    try:
+        dst.execute(f"PRAGMA busy_timeout = {PRAGMAS['busy_timeout']}")
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def hot_swap(source_path, prepare=None, db_path=None):
+    # Restore pipeline. The candidate is copied next to the live database,
+    # validated there and handed to prepare(conn) to build derived tables, all
+    # without touching the live file. The switch is then a single backup-API
+    # transaction: requests already reading keep their WAL snapshot and drain
+    # on the old data, the next ones see the new file. A file rename is not
+    # used because live handles would pair the new file with the old -wal.
+    db_path = db_path or DB_PATH
+    with restore_lock:
+        staged = f'{db_path}.restore-{os.getpid()}'
+        remove_file(staged)
+        try:
+            _run_blocking(restore_into, source_path, staged)
+            counts = validate_database(staged)
+            if prepare:
+                _run_blocking(_prepare_staged, staged, prepare)
+            started = time.perf_counter()
+            _run_blocking(restore_into, staged, db_path)
+            print(f"Swapped in {source_path} in {(time.perf_counter() - started) * 1000:.0f}ms: {counts}")
+            return counts
+        finally:
+            remove_file(staged)
+
+
+def _prepare_staged(staged, prepare):
+    conn = sqlite3.connect(staged)
+    conn.row_factory = sqlite3.Row
+    try:
+        prepare(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def delete_backup(filename):
+    with _lock:
+        manifest = _load()
+        remaining = [entry for entry in manifest['backups'] if entry['filename'] != filename]
+        if len(remaining) == len(manifest['backups']):
+            return False
+        manifest['backups'] = remaining
+        _save_manifest(manifest)
+        _collect_garbage(manifest)
+        return True
+
+
+def _collect_garbage(manifest):
+    with _lock:
+        referenced = {digest for entry in manifest['backups'] for digest in entry['chunks']}
+        chunk_root = _path(CHUNK_DIR)
+        for root, _, files in os.walk(chunk_root):
+            for name in files:
+                if name.endswith('.z') and name[:-2] not in referenced:
+                    os.remove(os.path.join(root, name))
+
+
+def list_backups():
+    backups = [
+        {key: value for key, value in entry.items() if key != 'chunks'}
+        for entry in _load()['backups']
+    ]
+    return sorted(backups, key=lambda x: x['timestamp'], reverse=True)
+
+
+def _load():
+    with _lock:
+        return load_manifest()
+
+
+def import_legacy(directory=None):
+    # Copy plain .db backups from before the chunk store (data/backups/*.db)
+    # into it. The files themselves are left where they are; ones already in
+    # the manifest under the same name are skipped. Returns the names added.
+    directory = directory or BACKUP_DIR
+    added = []
+    with _lock:
+        manifest = load_manifest()
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not name.endswith('.db') or not os.path.isfile(path):
+                continue
+            if any(entry['filename'] == name for entry in manifest['backups']):
+                continue
+            try:
+                created = _legacy_timestamp(name, path)
+                entry = _store_chunks(path)
+                entry.update({'filename': name, 'timestamp': created.strftime('%Y-%m-%d %H:%M:%S')})
+                check = temp_file('import_')
+                try:
+                    materialize(entry, check)
+                finally:
+                    remove_file(check)
+                manifest['backups'].append(entry)
+                _save_manifest(manifest)
+                added.append(name)
+            except (OSError, ValueError) as e:
+                print(f"Could not import legacy backup {name}: {e}")
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Back up the live database into the chunk store.')
+    parser.add_argument('--import-legacy', action='store_true',
+                        help='instead, add the plain .db files in the backup directory to the store '
+                             '(the files are kept)')
+    args = parser.parse_args()
+
+    if args.import_legacy:
+        for name in import_legacy():
+            print(f"Imported legacy backup {name}")
+        raise SystemExit(0)
+
+    started = time.perf_counter()
+    entry = create_backup()
+    print(
+        f"Created {entry['filename']}: {entry['size']} bytes, "
+        f"{entry['stored_bytes']} new bytes stored in {time.perf_counter() - started:.2f}s"
+    )
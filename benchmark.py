@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Endpoint micro-benchmarks at several data scales. For every scale a
+# synthetic database is generated (generate_data.py) and a child process
+# drives each route through the Flask test client, measuring:
+#   cold_ms  first request, with an empty response cache
+#   p50_ms / p95_ms  over --repeat further requests
+#   bytes    response body size
+#   peak_kb  peak Python memory allocated while serving one cold request
+# A child per scale keeps DB_PATH and module state independent.
+SCALES = {
+    'small': {'targets': 1000, 'zips': 6000},
+    'medium': {'targets': 10000, 'zips': 20000},
+    'large': {'targets': 50000, 'zips': 42000},
+}
+
+FIRST_ORG = 'Synthetic Org 000000'
+
+# (name, method, path, json body); '{org}' in paths and bodies becomes FIRST_ORG.
+# Left out: /api/events (an endless stream), the backup/restore/upload routes
+# (they write files and swap the database) and note deletion (single-shot).
+ROUTES = [
+    ('page /', 'GET', '/', None),
+    ('page kanban', 'GET', '/kanban.html', None),
+    ('page dashboard', 'GET', '/dashboard', None),
+    ('page dbmanager', 'GET', '/dbmanager', None),
+    ('static kanban.js', 'GET', '/static/js/kanban.js', None),
+    ('targets', 'GET', '/api/targets', None),
+    ('targets bbox', 'GET', '/api/targets?bbox=-74.3,40.5,-73.7,40.9&zoom=13', None),
+    ('targets columnar', 'GET', '/api/targets?format=columnar', None),
+    ('targets changes', 'GET', '/api/targets/changes', None),
+    ('changes columnar', 'GET', '/api/targets/changes?format=columnar', None),
+    ('map clusters z5', 'GET', '/api/map_clusters?bbox=-125,24,-66,50&zoom=5', None),
+    ('kanban data', 'GET', '/api/kanban_data', None),
+    ('zips', 'GET', '/api/zips', None),
+    ('zips columnar', 'GET', '/api/zips?format=columnar', None),
+    ('clusters abc_10mi', 'GET', '/api/clusters/abc_10mi', None),
+    ('nearby 10mi', 'GET', '/api/nearby?lat=40.71&lng=-74.01&radius_mi=10', None),
+    ('search', 'GET', '/api/search?q=main%20st', None),
+    ('search prefix', 'GET', '/api/search?q=synth&type=targets&limit=50', None),
+    ('geocode', 'GET', '/api/geocode?zips=10001,60601,75201', None),
+    ('notes', 'GET', '/api/notes/{org}', None),
+    ('activity log', 'GET', '/api/activity_log', None),
+    ('activity log page', 'GET', '/api/activity_log?limit=200&before_id=1000', None),
+    ('activity log org', 'GET', '/api/activity_log?organization={org}', None),
+    ('activity log status', 'GET', '/api/activity_log?status=in-discussion', None),
+    ('dashboard summary', 'GET', '/api/dashboard/summary', None),
+    ('dashboard status', 'GET', '/api/dashboard/status/not-contacted', None),
+    ('dashboard pipeline', 'GET', '/api/dashboard/pipeline?since=2000-01-01', None),
+    ('export csv', 'GET', '/api/export/targets', None),
+    ('export ndjson gz', 'GET', '/api/export/targets?format=ndjson&gzip=1', None),
+    ('db schema', 'GET', '/api/db/schema', None),
+    ('db backups', 'GET', '/api/db/backups', None),
+    ('metrics', 'GET', '/metrics', None),
+    ('db query', 'POST', '/api/db/query', {'query': 'SELECT * FROM targets', 'page_size': 200}),
+    ('update status', 'POST', '/api/update_status', {'organization': '{org}', 'status': 'in-discussion'}),
+    ('update status batch', 'POST', '/api/update_status/batch',
+     {'updates': [{'organization': '{org}', 'status': 'initial-contact'},
+                  {'organization': 'Synthetic Org 000001', 'status': 'in-discussion'}]}),
+    ('add note', 'POST', '/api/notes', {'target_id': '{org}', 'content': 'benchmark note'}),
+    ('zip clusters dry run', 'POST', '/api/db/zip_clusters', {'dry_run': True}),
+]
+
+
+def _format(value, org):
+    if isinstance(value, str):
+        return value.replace('{org}', org)
+    if isinstance(value, dict):
+        return {key: _format(item, org) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_format(item, org) for item in value]
+    return value
+
+
+def _request(client, method, path, body):
+    response = client.open(path, method=method, json=body)
+    data = response.get_data()  # drains streamed responses too
+    return response.status_code, len(data)
+
+
+def run_routes(repeat, only=None):
+    # Child side: the database is already in TARGETS_DB
+    import serve_map_data
+    from response_cache import response_cache
+
+    client = serve_map_data.app.test_client()
+    results = []
+    for name, method, path, body in ROUTES:
+        if only and name not in only:
+            continue
+        path = _format(path, FIRST_ORG)
+        body = _format(body, FIRST_ORG)
+
+        response_cache.clear()
+        tracemalloc.start()
+        started = time.perf_counter()
+        status, size = _request(client, method, path, body)
+        cold = (time.perf_counter() - started) * 1000
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            _request(client, method, path, body)
+            times.append((time.perf_counter() - started) * 1000)
+        times.sort()
+        results.append({
+            'route': name,
+            'status': status,
+            'bytes': size,
+            'cold_ms': round(cold, 2),
+            'p50_ms': round(statistics.median(times), 2) if times else None,
+            'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 2) if times else None,
+            'peak_kb': round(peak / 1024),
+        })
+    return results
+
+
+def run_scale(scale, counts, repeat, only, workdir, seed):
+    db_path = os.path.join(workdir, f'bench_{scale}.db')
+    if not os.path.exists(db_path):
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, 'generate_data.py', db_path, '--targets', str(counts['targets']),
+             '--zips', str(counts['zips']), '--seed', str(seed)],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        print(f"Generated {scale} database in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    env = dict(os.environ, TARGETS_DB=db_path, TARGETS_BACKUP_DIR=os.path.join(workdir, 'backups'))
+    cmd = [sys.executable, 'benchmark.py', '--child', '--repeat', str(repeat)]
+    for name in only or []:
+        cmd += ['--route', name]
+    output = subprocess.run(cmd, env=env, check=True, capture_output=True, text=True).stdout
+    # The server prints while it works; the results are the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_table(scale, counts, results):
+    print(f"\n{scale}: {counts['targets']} targets, {counts['zips']} ZIPs")
+    print(f"{'route':<22} {'status':>6} {'bytes':>11} {'cold ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'peak KB':>8}")
+    for r in results:
+        print(f"{r['route']:<22} {r['status']:>6} {r['bytes']:>11,} {r['cold_ms']:>9} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['peak_kb']:>8,}")
+
+
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='Benchmark every API route at several data scales.')
+    parser.add_argument('--scale', action='append', choices=sorted(SCALES),
+                        help='scale to run (repeatable, default: small and medium)')
+    parser.add_argument('--targets', type=int, help='custom scale: number of targets')
+    parser.add_argument('--zips', type=int, default=6000, help='custom scale: number of ZIPs')
+    parser.add_argument('--repeat', type=int, default=20, help='warm requests per route (default: 20)')
+    parser.add_argument('--route', action='append', help='only this route (repeatable)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help='keep generated databases here and reuse them')
+    parser.add_argument('--json', metavar='FILE', help='also write the results as JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_routes(args.repeat, args.route)))
+        sys.exit(0)
+
+    if args.targets:
+        scales = {'custom': {'targets': args.targets, 'zips': args.zips}}
+    else:
+        scales = {name: SCALES[name] for name in (args.scale or ['small', 'medium'])}
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='targets_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    report = {}
+    for scale, counts in scales.items():
+        results = run_scale(scale, counts, args.repeat, args.route, workdir, args.seed)
+        report[scale] = {'counts': counts, 'results': results}
+        print_table(scale, counts, results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
@@ -0,0 +1,153 @@
+from columnar import encode_columns
+from db import get_data_version
+
+# One row per organization holding the sequence number of its latest change.
+# Each change deletes and re-inserts the row under a fresh seq, so the table stays as large as
+# the set of organizations ever seen, and `seq > ?` is a primary-key range scan.
+
+
+def _targets_in_zips(*zip_codes):
+    # Trigger body: a fresh 'upsert' change for each target in these ZIPs
+    targets = f"SELECT organization FROM targets WHERE region IN ({', '.join(zip_codes)})"
+    return f'''
+        DELETE FROM target_changes WHERE organization IN ({targets});
+        INSERT INTO target_changes (organization, op) SELECT organization, 'upsert' FROM ({targets});
+    '''
+
+
+CHANGES_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS target_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        organization TEXT NOT NULL UNIQUE,
+        op TEXT NOT NULL,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # Explicit DELETE + INSERT rather than INSERT OR REPLACE: an outer
+    # statement's conflict clause (e.g. an import's upsert) overrides the
+    # trigger's own OR REPLACE.
+    'DROP TRIGGER IF EXISTS target_changes_insert',
+    'DROP TRIGGER IF EXISTS target_changes_update',
+    'DROP TRIGGER IF EXISTS target_changes_delete',
+    '''
+    CREATE TRIGGER IF NOT EXISTS target_changes_on_insert AFTER INSERT ON targets
+    BEGIN
+        DELETE FROM target_changes WHERE organization = new.organization;
+        INSERT INTO target_changes (organization, op) VALUES (new.organization, 'upsert');
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS target_changes_on_update AFTER UPDATE ON targets
+    BEGIN
+        DELETE FROM target_changes WHERE organization IN (old.organization, new.organization);
+        INSERT INTO target_changes (organization, op)
+        SELECT old.organization, 'delete' WHERE old.organization != new.organization;
+        INSERT INTO target_changes (organization, op) VALUES (new.organization, 'upsert');
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS target_changes_on_delete AFTER DELETE ON targets
+    BEGIN
+        DELETE FROM target_changes WHERE organization = old.organization;
+        INSERT INTO target_changes (organization, op) VALUES (old.organization, 'delete');
+    END
+    ''',
+    # Delta rows carry zip_data.grade, so a ZIP gaining, losing or changing
+    # its grade is a change to every target in it
+    f'''
+    CREATE TRIGGER IF NOT EXISTS target_changes_on_zip_insert AFTER INSERT ON zip_data
+    WHEN new.grade IS NOT NULL
+    BEGIN {_targets_in_zips('new.zip_code')} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS target_changes_on_zip_update AFTER UPDATE OF grade, zip_code ON zip_data
+    WHEN old.grade IS NOT new.grade OR old.zip_code IS NOT new.zip_code
+    BEGIN {_targets_in_zips('old.zip_code', 'new.zip_code')} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS target_changes_on_zip_delete AFTER DELETE ON zip_data
+    WHEN old.grade IS NOT NULL
+    BEGIN {_targets_in_zips('old.zip_code')} END
+    ''',
+]
+
+CHANGES_PAGE_SIZE = 5000
+
+
+def ensure_changes_table(conn):
+    for statement in CHANGES_SCHEMA:
+        conn.execute(statement)
+    # Seed existing targets once so a first sync from 0 sees every row
+    conn.execute('''
+        INSERT INTO target_changes (organization, op)
+        SELECT organization, 'upsert' FROM targets
+        WHERE NOT EXISTS (SELECT 1 FROM target_changes)
+    ''')
+
+
+def current_epoch(conn):
+    version = get_data_version(conn)
+    return version.split('-')[0] if version else ''
+
+
+def parse_since(since, epoch):
+    # Sync tokens look like "<epoch>:<seq>". A token from another database
+    # file (before a restore) or a malformed one means the client must reload.
+    # "latest" asks for the current head without any rows.
+    if not since:
+        return 0, True
+    if since == 'latest':
+        return None, False
+    token_epoch, _, seq = since.partition(':')
+    if token_epoch != epoch or not seq.isdigit():
+        return 0, True
+    return int(seq), False
+
+
+def get_changes(conn, columns, since, limit=CHANGES_PAGE_SIZE, join='', columnar=False):
+    epoch = current_epoch(conn)
+    seq, reset = parse_since(since, epoch)
+    if seq is None:
+        # Just the head of the feed, for clients that loaded data elsewhere
+        seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM target_changes').fetchone()[0]
+        return {'version': f'{epoch}:{seq}', 'reset': False, 'has_more': False, 'upserts': [], 'deletes': []}
+
+    rows = conn.execute(f'''
+        SELECT c.seq AS change_seq, c.op AS change_op, c.organization AS change_organization,
+               {columns}
+        FROM target_changes c
+        LEFT JOIN targets t ON t.organization = c.organization
+        {join}
+        WHERE c.seq > ?
+        ORDER BY c.seq
+        LIMIT ?
+    ''', (seq, limit + 1)).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    upserts = []
+    deletes = []
+    for row in rows:
+        if row['change_op'] == 'delete' or row['organization'] is None:
+            if not reset:
+                deletes.append(row['change_organization'])
+        else:
+            upserts.append(row)
+        seq = row['change_seq']
+
+    # The first three columns are the change bookkeeping
+    names = rows[0].keys()[3:] if rows else []
+    if columnar:
+        upserts = encode_columns(names, [tuple(row)[3:] for row in upserts])
+    else:
+        upserts = [dict(zip(names, tuple(row)[3:])) for row in upserts]
+
+    return {
+        'version': f'{epoch}:{seq}',
+        'reset': reset,
+        'has_more': has_more,
+        'upserts': upserts,
+        'deletes': deletes,
+    }
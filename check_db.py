@@ -1,6 +1,8 @@
 import sqlite3
 import os
 
+from search import match_expression
+
 def check_database():
     db_path = os.path.join(os.path.dirname(__file__), 'data', 'targets.db')
     print(f"Checking database at: {db_path}")
@@ -26,9 +28,19 @@ def check_database():
     for row in rows:
         print(row)
     
-    # Check for Westlake specifically
+    # Check for Westlake specifically, through the full-text index when the
+    # server has built it (LIKE '%...%' scans the whole table)
     print("\nSearching for Westlake:")
-    cursor.execute("SELECT * FROM targets WHERE organization LIKE '%Westlake%'")
+    has_index = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'targets_fts'"
+    ).fetchone()
+    if has_index:
+        cursor.execute('''
+            SELECT t.* FROM targets_fts f JOIN targets t ON t.rowid = f.rowid
+            WHERE targets_fts MATCH ? ORDER BY f.rank
+        ''', (match_expression('Westlake'),))
+    else:
+        cursor.execute("SELECT * FROM targets WHERE organization LIKE '%Westlake%'")
     westlake_rows = cursor.fetchall()
     for row in westlake_rows:
         print(row)
@@ -0,0 +1,110 @@
+import argparse
+import os
+import sys
+
+# Asserts that the API's hot queries are answered from their indexes: runs
+# EXPLAIN QUERY PLAN for each and fails if an expected index is missing from
+# the plan or a listed table is scanned in full. Meant for CI:
+#   python check_query_plans.py --db data/targets.db
+
+
+def plan_checks():
+    # (name, sql, params, indexes the plan must mention, tables/aliases it must not scan)
+    from export_targets import export_query
+    from search import NOTES_SEARCH_QUERY, TARGETS_SEARCH_QUERY
+    import serve_map_data as server
+
+    region_export_sql, region_export_params = export_query(regions=['10001'])
+    status_export_sql, status_export_params = export_query(statuses=['In Discussion', 'Qualified'])
+    activity_sql, activity_params = server.activity_log_query()
+    activity_page_sql, activity_page_params = server.activity_log_query(before=('2024-01-01 00:00:00', 100))
+    activity_org_sql, activity_org_params = server.activity_log_query(
+        organization='x', before=('2024-01-01 00:00:00', 100))
+    activity_status_sql, activity_status_params = server.activity_log_query(
+        status='In Discussion', before=('2024-01-01 00:00:00', 100))
+    return [
+        ('notes for a target', server.NOTES_QUERY, ('x',),
+         ['idx_notes_target_timestamp'], ['notes']),
+        ('activity log', activity_sql, activity_params,
+         ['idx_activity_log_timestamp'], ['activity_log']),
+        ('activity log page', activity_page_sql, activity_page_params,
+         ['idx_activity_log_timestamp'], ['activity_log']),
+        ('activity log for an organization', activity_org_sql, activity_org_params,
+         ['idx_activity_log_organization'], ['activity_log']),
+        ('activity log by new status', activity_status_sql, activity_status_params,
+         ['idx_activity_log_new_status_key'], ['activity_log']),
+        ('dashboard status details', server.STATUS_DETAILS_QUERY, ('not-contacted',),
+         ['idx_targets_status_key', 'sqlite_autoindex_zip_data_1'], ['t', 'z']),
+        ('export by region', region_export_sql, region_export_params,
+         ['idx_targets_region'], ['t', 'z']),
+        ('export by status', status_export_sql, status_export_params,
+         ['idx_targets_status_key'], ['t', 'z']),
+        ('target lookup for status update',
+         'SELECT status, latitude, longitude FROM targets WHERE organization = ?', ('x',),
+         ['sqlite_autoindex_targets_1'], ['targets']),
+        ('target lookup for batch status update',
+         'SELECT organization, status FROM targets WHERE organization IN (?, ?, ?)',
+         ('x', 'y', 'z'), ['sqlite_autoindex_targets_1'], ['targets']),
+        ('targets in viewport',
+         f'''SELECT {server.TARGET_COLUMNS} FROM targets_rtree r
+             JOIN targets t ON t.rowid = r.id
+             LEFT JOIN zip_data z ON t.region = z.zip_code
+             WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ?''',
+         (40, 41, -75, -73), ['VIRTUAL TABLE INDEX', 'sqlite_autoindex_zip_data_1'], ['t', 'z']),
+        ('search targets', TARGETS_SEARCH_QUERY, ('"west"*', 20),
+         ['VIRTUAL TABLE INDEX'], ['t']),
+        ('search notes', NOTES_SEARCH_QUERY, ('"call"*', 20),
+         ['VIRTUAL TABLE INDEX'], ['n']),
+        ('map clusters',
+         'SELECT * FROM cluster_grid WHERE zoom = ? AND cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?',
+         (5, 0, 10, 0, 10), ['PRIMARY KEY'], ['cluster_grid']),
+    ]
+
+
+def full_scans(plan, names):
+    # Plan lines like "SCAN t" or "SCAN notes" that use no index
+    scans = []
+    for detail in plan:
+        words = detail.split()
+        if len(words) >= 2 and words[0] == 'SCAN' and words[1] in names and 'USING' not in words:
+            scans.append(detail)
+    return scans
+
+
+def check_plans(conn):
+    failures = []
+    for name, sql, params, expected, no_scan in plan_checks():
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+        text = ' | '.join(plan)
+        missing = [index for index in expected if index not in text]
+        scans = full_scans(plan, no_scan)
+        status = 'ok' if not missing and not scans else 'FAIL'
+        print(f"[{status}] {name}: {text}")
+        if missing:
+            failures.append(f"{name}: plan does not use {', '.join(missing)}")
+        if scans:
+            failures.append(f"{name}: full scan ({'; '.join(scans)})")
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that API queries use their indexes.')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    args = parser.parse_args()
+    if args.db:
+        os.environ['TARGETS_DB'] = args.db
+
+    # Importing the server brings the database to the latest schema first
+    import serve_map_data  # noqa: F401
+    from db import get_read_connection
+
+    conn = get_read_connection()
+    try:
+        failures = check_plans(conn)
+    finally:
+        conn.close()
+
+    for failure in failures:
+        print(failure)
+    print('All query plans use their indexes' if not failures else f'{len(failures)} query plan checks failed')
+    sys.exit(1 if failures else 0)
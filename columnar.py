@@ -0,0 +1,89 @@
+import gzip
+import json
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+# Compact wire format for the big row lists (/api/targets, /api/zips and the
+# change feed's upserts). Instead of one object per row, repeating every key
+# name, the payload holds one array per column:
+#   {"format": "columnar", "count": 2,
+#    "columns": {"organization": ["A", "B"], "status": [0, 0]},
+#    "dictionaries": {"status": ["not-contacted"]}}
+# Low-cardinality text columns (statuses, grades, cluster labels) are
+# dictionary-encoded: their arrays hold indexes into "dictionaries". Clients
+# ask for it with ?format=columnar or an Accept header naming
+# COLUMNAR_MIMETYPE; static/js/columnar.js decodes it.
+COLUMNAR_MIMETYPE = 'application/vnd.targets.columnar+json'
+DICTIONARY_COLUMNS = frozenset(
+    ['status', 'grade', 'zip_grade']
+    + [f'cluster_{kind}_{radius}mi' for kind in ('a', 'ab', 'abc', 'bc') for radius in (5, 10)]
+)
+
+# Bodies smaller than this go out uncompressed
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+# For cached_response: the body differs by these request headers
+VARY_HEADERS = ('Accept', 'Accept-Encoding')
+
+
+def wants_columnar():
+    return (request.args.get('format') == 'columnar'
+            or COLUMNAR_MIMETYPE in request.headers.get('Accept', ''))
+
+
+def encode_columns(names, rows, dictionary_columns=DICTIONARY_COLUMNS):
+    # `rows` are sequences (sqlite3.Row or tuples) in the order of `names`
+    rows = list(rows)
+    columns = {}
+    dictionaries = {}
+    values_by_column = zip(*rows) if rows else [() for _ in names]
+    for name, values in zip(names, values_by_column):
+        if name in dictionary_columns:
+            index = {}
+            columns[name] = [index.setdefault(value, len(index)) for value in values]
+            dictionaries[name] = list(index)
+        else:
+            columns[name] = list(values)
+    return {'format': 'columnar', 'count': len(rows), 'columns': columns, 'dictionaries': dictionaries}
+
+
+def encode_rows(rows):
+    # sqlite3.Row results as plain row objects or columns, as negotiated
+    if wants_columnar():
+        return encode_columns(rows[0].keys() if rows else [], rows)
+    return [dict(row) for row in rows]
+
+
+def accepted_encodings():
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            accepted.add(coding.lower())
+    return accepted
+
+
+def payload_response(payload):
+    # Compact JSON in either format, brotli- or gzip-compressed when the
+    # client accepts it
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    mimetype = COLUMNAR_MIMETYPE if wants_columnar() else 'application/json'
+    response = Response(body, mimetype=mimetype)
+    response.vary.update(VARY_HEADERS)
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+    accepted = accepted_encodings()
+    if brotli is not None and 'br' in accepted:
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        response.content_encoding = 'br'
+    elif 'gzip' in accepted:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0))
+        response.content_encoding = 'gzip'
+    return response
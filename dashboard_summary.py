@@ -0,0 +1,207 @@
+import argparse
+
+from db import connect
+
+# Running totals behind /api/dashboard/summary, per normalized status_key. Triggers on targets and
+# zip_data keep them exact for every writer (the API, imports, CLI scripts),
+# so the dashboard reads a handful of rows instead of grouping the whole
+# targets table on each refresh. rebuild_summary() recomputes them from
+# scratch; check_summary() reports any drift.
+SUMMARY_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS status_summary (
+        status TEXT PRIMARY KEY,
+        count INTEGER NOT NULL,
+        population_sum NUMERIC NOT NULL,
+        population_count INTEGER NOT NULL,
+        income_sum NUMERIC NOT NULL,
+        income_count INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS grade_summary (
+        grade TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Statement templates for one target entering (+1) or leaving (-1) the totals
+_STATUS_ADD = '''
+    INSERT INTO status_summary VALUES (
+        {row}.status_key, 1,
+        COALESCE({row}.population, 0) + 0, {row}.population IS NOT NULL,
+        COALESCE({row}.median_income, 0) + 0, {row}.median_income IS NOT NULL
+    )
+    ON CONFLICT(status) DO UPDATE SET
+        count = count + 1,
+        population_sum = population_sum + excluded.population_sum,
+        population_count = population_count + excluded.population_count,
+        income_sum = income_sum + excluded.income_sum,
+        income_count = income_count + excluded.income_count;
+'''
+_STATUS_REMOVE = '''
+    UPDATE status_summary SET
+        count = count - 1,
+        population_sum = population_sum - (COALESCE({row}.population, 0) + 0),
+        population_count = population_count - ({row}.population IS NOT NULL),
+        income_sum = income_sum - (COALESCE({row}.median_income, 0) + 0),
+        income_count = income_count - ({row}.median_income IS NOT NULL)
+    WHERE status = {row}.status_key;
+    DELETE FROM status_summary WHERE count <= 0;
+'''
+_GRADE_ADD = '''
+    INSERT INTO grade_summary
+    SELECT grade, {count} FROM zip_data WHERE zip_code = {region} AND grade IS NOT NULL
+    ON CONFLICT(grade) DO UPDATE SET count = count + excluded.count;
+'''
+_GRADE_REMOVE = '''
+    UPDATE grade_summary SET count = count - {count}
+    WHERE grade = (SELECT grade FROM zip_data WHERE zip_code = {region});
+    DELETE FROM grade_summary WHERE count <= 0;
+'''
+
+
+def _targets_for(zip_code):
+    return f'(SELECT COUNT(*) FROM targets WHERE region = {zip_code})'
+
+
+def _zip_grade_add(row):
+    # A ZIP (with its grade) appearing: all its targets gain that grade
+    return f'''
+    INSERT INTO grade_summary
+    SELECT {row}.grade, {_targets_for(f'{row}.zip_code')}
+    WHERE {row}.grade IS NOT NULL AND {_targets_for(f'{row}.zip_code')} > 0
+    ON CONFLICT(grade) DO UPDATE SET count = count + excluded.count;
+    '''
+
+
+def _zip_grade_remove(row):
+    return f'''
+    UPDATE grade_summary SET count = count - {_targets_for(f'{row}.zip_code')}
+    WHERE grade = {row}.grade;
+    DELETE FROM grade_summary WHERE count <= 0;
+    '''
+
+
+SUMMARY_TRIGGERS = {
+    'summary_targets_insert': ('AFTER INSERT ON targets',
+                               _STATUS_ADD.format(row='new')
+                               + _GRADE_ADD.format(count=1, region='new.region')),
+    'summary_targets_delete': ('AFTER DELETE ON targets',
+                               _STATUS_REMOVE.format(row='old')
+                               + _GRADE_REMOVE.format(count=1, region='old.region')),
+    'summary_targets_update': ('AFTER UPDATE OF status, population, median_income ON targets',
+                               _STATUS_REMOVE.format(row='old') + _STATUS_ADD.format(row='new')),
+    'summary_targets_region': ('AFTER UPDATE OF region ON targets',
+                               _GRADE_REMOVE.format(count=1, region='old.region')
+                               + _GRADE_ADD.format(count=1, region='new.region')),
+    'summary_zip_insert': ('AFTER INSERT ON zip_data', _zip_grade_add('new')),
+    'summary_zip_delete': ('AFTER DELETE ON zip_data', _zip_grade_remove('old')),
+    'summary_zip_update': ('AFTER UPDATE OF grade, zip_code ON zip_data',
+                           _zip_grade_remove('old') + _zip_grade_add('new')),
+}
+
+
+def ensure_dashboard_summary(conn):
+    # Migration 3 drops the targets triggers, which makes this rebuild once
+    built = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'summary_targets_update'"
+    ).fetchone() is not None
+    for statement in SUMMARY_SCHEMA:
+        conn.execute(statement)
+    for name, (event, body) in SUMMARY_TRIGGERS.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+    # The triggers keep the totals exact from here on
+    if not built:
+        rebuild_summary(conn)
+
+
+def compute_summary(conn):
+    # The full GROUP BY version, for rebuilds and consistency checks
+    statuses = {
+        row[0]: tuple(row[1:])
+        for row in conn.execute('''
+            SELECT status_key, COUNT(*),
+                   COALESCE(SUM(population), 0), COUNT(population),
+                   COALESCE(SUM(median_income), 0), COUNT(median_income)
+            FROM targets
+            GROUP BY status_key
+        ''')
+    }
+    grades = {
+        row[0]: row[1]
+        for row in conn.execute('''
+            SELECT z.grade, COUNT(*)
+            FROM targets t
+            JOIN zip_data z ON t.region = z.zip_code
+            WHERE z.grade IS NOT NULL
+            GROUP BY z.grade
+        ''')
+    }
+    return statuses, grades
+
+
+def read_summary(conn):
+    statuses = {
+        row[0]: tuple(row[1:])
+        for row in conn.execute('SELECT * FROM status_summary')
+    }
+    grades = {row[0]: row[1] for row in conn.execute('SELECT grade, count FROM grade_summary')}
+    return statuses, grades
+
+
+def rebuild_summary(conn):
+    statuses, grades = compute_summary(conn)
+    conn.execute('DELETE FROM status_summary')
+    conn.execute('DELETE FROM grade_summary')
+    conn.executemany('INSERT INTO status_summary VALUES (?, ?, ?, ?, ?, ?)',
+                     [(status,) + values for status, values in statuses.items()])
+    conn.executemany('INSERT INTO grade_summary VALUES (?, ?)', list(grades.items()))
+
+
+def check_summary(conn):
+    # Differences between the stored totals and a full recount, as strings
+    stored = read_summary(conn)
+    computed = compute_summary(conn)
+    problems = []
+    for label, have, want in zip(('status', 'grade'), stored, computed):
+        for key in sorted(set(have) | set(want), key=str):
+            if have.get(key) != want.get(key):
+                problems.append(f'{label} {key}: stored {have.get(key)}, actual {want.get(key)}')
+    return problems
+
+
+def summary_response(conn):
+    # The /api/dashboard/summary payload
+    statuses, grades = read_summary(conn)
+    status_summary = {}
+    for status, (count, population_sum, population_count, income_sum, income_count) in statuses.items():
+        status_summary[status] = {
+            'count': count,
+            'total_population': population_sum if population_count else None,
+            'avg_income': income_sum / income_count if income_count else None,
+        }
+    return {'status_summary': status_summary, 'grade_summary': grades}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild or check the dashboard summary tables.')
+    parser.add_argument('--check', action='store_true', help='only compare the stored totals with a recount')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        if args.check:
+            problems = check_summary(conn)
+            for problem in problems:
+                print(problem)
+            print('Dashboard summary is consistent' if not problems else f'{len(problems)} differences found')
+            raise SystemExit(1 if problems else 0)
+        ensure_dashboard_summary(conn)
+        rebuild_summary(conn)
+        conn.commit()
+        print('Dashboard summary rebuilt')
+    finally:
+        conn.close()
@@ -0,0 +1,317 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+DB_PATH = os.environ.get('TARGETS_DB', 'data/targets.db')
+
+# Pragmas applied to every pooled connection. journal_mode=WAL is persistent in
+# the database file, the rest are per-connection.
+PRAGMAS = {
+    'synchronous': os.environ.get('TARGETS_DB_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('TARGETS_DB_CACHE_KB', 20000)) * -1,
+    'mmap_size': int(os.environ.get('TARGETS_DB_MMAP_BYTES', 256 * 1024 * 1024)),
+    'busy_timeout': int(os.environ.get('TARGETS_DB_BUSY_TIMEOUT_MS', 5000)),
+    'temp_store': 'MEMORY',
+}
+
+READ_POOL_SIZE = int(os.environ.get('TARGETS_DB_READ_POOL', 8))
+WRITE_POOL_SIZE = int(os.environ.get('TARGETS_DB_WRITE_POOL', 2))
+
+
+# Optional statement timing for pooled connections: an object with
+# statement(sql, seconds) and rows(sql, count, seconds) methods, installed by
+# metrics.py. Without one, connections hand out plain sqlite3 cursors.
+_statement_observer = None
+
+
+def set_statement_observer(observer):
+    global _statement_observer
+    _statement_observer = observer
+
+
+class MeteredCursor:
+    # A sqlite3.Cursor that reports execute and fetch times to the observer.
+    # Iteration fetches in batches so only SQLite's own work is timed.
+    FETCH_BATCH = 256
+
+    def __init__(self, cursor, observer):
+        self._cursor = cursor
+        self._observer = observer
+        self._sql = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _run(self, method, sql, parameters):
+        started = time.perf_counter()
+        method(sql, parameters)
+        self._observer.statement(sql, time.perf_counter() - started)
+        self._sql = sql
+        return self
+
+    def execute(self, sql, parameters=()):
+        return self._run(self._cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(self._cursor.executemany, sql, seq_of_parameters)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        count = (result is not None) if method == self._cursor.fetchone else len(result)
+        self._observer.rows(self._sql, count, time.perf_counter() - started)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(self._cursor.fetchmany, self._cursor.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.FETCH_BATCH)
+            if not rows:
+                return
+            yield from rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class PooledConnection:
+    # Wraps a sqlite3.Connection so existing `conn.close()` calls hand the
+    # connection back to its pool instead of tearing it down.
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self):
+        cursor = self._conn.cursor()
+        observer = _statement_observer
+        return MeteredCursor(cursor, observer) if observer is not None else cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class ConnectionPool:
+    def __init__(self, path, readonly=False, size=4):
+        self.path = path
+        self.readonly = readonly
+        self.size = size
+        self.retired = False
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in PRAGMAS.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        if self.readonly:
+            conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        # Handles still checked out when the pool is retired finish their
+        # request on the old snapshot and are closed on the way back
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if self.retired:
+                conn.close()
+            else:
+                self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+    def close_all(self):
+        self.retired = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_wal_checked = set()
+# Pools belong to the process that opened them. A forked worker must not use
+# or close its parent's SQLite handles (closing one can take the parent's
+# locks with it), so it parks them here untouched and opens its own.
+_pools_pid = os.getpid()
+_inherited_pools = []
+
+
+def enable_wal(path=None):
+    path = path or DB_PATH
+    conn = sqlite3.connect(path)
+    try:
+        mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+        if mode.lower() != 'wal':
+            print(f"Warning: could not enable WAL on {path} (journal_mode={mode})")
+        return mode
+    finally:
+        conn.close()
+
+
+def connect(path=None):
+    # Standalone read-write connection with the pool's pragmas, for CLI scripts
+    path = path or DB_PATH
+    enable_wal(path)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def _forget_inherited_pools():
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _inherited_pools.extend(_pools.values())
+            _pools.clear()
+            _wal_checked.clear()
+            _pools_pid = os.getpid()
+
+
+def _get_pool(readonly):
+    if _pools_pid != os.getpid():
+        _forget_inherited_pools()
+    key = (DB_PATH, readonly)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                if DB_PATH not in _wal_checked:
+                    enable_wal(DB_PATH)
+                    _wal_checked.add(DB_PATH)
+                size = READ_POOL_SIZE if readonly else WRITE_POOL_SIZE
+                pool = _pools[key] = ConnectionPool(DB_PATH, readonly=readonly, size=size)
+    return pool
+
+
+def get_read_connection():
+    return _get_pool(readonly=True).acquire()
+
+
+def get_write_connection():
+    return _get_pool(readonly=False).acquire()
+
+
+def checkpoint(path=None):
+    # Fold the WAL back into the main database file
+    conn = sqlite3.connect(path or DB_PATH)
+    try:
+        conn.execute(f"PRAGMA busy_timeout = {PRAGMAS['busy_timeout']}")
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+
+
+def reset_pools():
+    # Drop every pooled connection, e.g. before fork() or when the file is
+    # replaced. Read-only handles cannot checkpoint, so close them first and
+    # finish with an explicit checkpoint so no WAL content is left behind.
+    if _pools_pid != os.getpid():
+        _forget_inherited_pools()
+    with _pools_lock:
+        for (path, readonly), pool in sorted(_pools.items(), key=lambda item: not item[0][1]):
+            pool.close_all()
+        paths = {path for path, _ in _pools}
+        _pools.clear()
+        _wal_checked.clear()
+    for path in paths:
+        if os.path.exists(path):
+            checkpoint(path)
+
+
+# A single-row counter bumped by triggers whenever data behind the read APIs
+# changes, from any process. `epoch` is renewed when the file is swapped
+# (restore/upload) so versions from different database files never collide.
+VERSIONED_TABLES = ['targets', 'notes', 'zip_data']
+
+
+def ensure_data_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            epoch TEXT NOT NULL,
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute(
+        'INSERT OR IGNORE INTO data_version (id, epoch, version) VALUES (1, ?, 0)',
+        (uuid.uuid4().hex[:12],)
+    )
+    for table in VERSIONED_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+
+def renew_data_epoch(conn):
+    conn.execute('UPDATE data_version SET epoch = ? WHERE id = 1', (uuid.uuid4().hex[:12],))
+
+
+def get_data_version(conn=None):
+    own = conn is None
+    if own:
+        conn = get_read_connection()
+    try:
+        row = conn.execute('SELECT epoch, version FROM data_version WHERE id = 1').fetchone()
+        return f'{row[0]}-{row[1]}' if row else None
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        if own:
+            conn.close()
@@ -0,0 +1,131 @@
+import os
+import re
+import sqlite3
+import time
+
+from db import DB_PATH
+
+# Limits for ad hoc queries from the DB manager
+QUERY_TIMEOUT = float(os.environ.get('DB_QUERY_TIMEOUT', 5.0))
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+PROGRESS_STEPS = 10000  # VM instructions between deadline checks
+
+ALLOWED_STATEMENTS = ('select', 'with', 'values', 'explain')
+LEADING_COMMENTS = re.compile(r'^(\s+|--[^\n]*\n?|/\*.*?\*/)*', re.DOTALL)
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _connect_readonly(timeout):
+    # A private connection per query: it is read-only at the file level, and
+    # nothing the query does (PRAGMAs, temp tables) leaks into the shared pools
+    conn = sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True)
+    conn.execute('PRAGMA query_only = 1')
+    deadline = time.monotonic() + timeout
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+    return conn
+
+
+def _check_statement(query):
+    body = LEADING_COMMENTS.sub('', query)
+    keyword = body.split(None, 1)[0].lower() if body else ''
+    if keyword not in ALLOWED_STATEMENTS:
+        raise QueryError('Only SELECT, WITH, VALUES and EXPLAIN queries are allowed in the web interface')
+    return body.rstrip().rstrip(';')
+
+
+def _int_param(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise QueryError(f'{name} must be an integer') from None
+
+
+def _subquery(query):
+    # On lines of its own, so a trailing -- comment cannot swallow the ")"
+    return f'(\n{query}\n)'
+
+
+def _key_is_unique(conn, query, key):
+    # Keyset paging skips rows whose key ties with the last one shown, and
+    # rows with a NULL key. COUNT(DISTINCT) ignores NULLs, so this is true
+    # only for a key that is unique and never NULL in the result.
+    columns = [description[0] for description in conn.execute(f'SELECT * FROM {_subquery(query)} LIMIT 0').description]
+    if key not in columns:
+        raise QueryError(f'Key column {key} is not in the result')
+    row = conn.execute(f'SELECT COUNT(*) = COUNT(DISTINCT "{key}") FROM {_subquery(query)}').fetchone()
+    return bool(row[0])
+
+
+def explain_plan(conn, query):
+    try:
+        rows = conn.execute(f'EXPLAIN QUERY PLAN {query}').fetchall()
+    except sqlite3.Error:
+        return []
+    return [{'id': row[0], 'parent': row[1], 'detail': row[3]} for row in rows]
+
+
+def run_query(query, page_size=DEFAULT_PAGE_SIZE, offset=0, key=None, after=None, timeout=QUERY_TIMEOUT):
+    # One page of results. With `key` (a result column that is unique and
+    # never NULL) pages are fetched by keyset (`key > after`); a first page
+    # (no `after`) with any other key falls back to offset paging.
+    query = _check_statement(query)
+    page_size = max(1, min(_int_param(page_size, 'page_size'), MAX_PAGE_SIZE))
+    offset = max(0, _int_param(offset, 'offset'))
+    if key and not re.fullmatch(r'\w+', key):
+        raise QueryError('Invalid key column')
+
+    conn = _connect_readonly(timeout)
+    try:
+        is_explain = query.lower().startswith('explain')
+        started = time.perf_counter()
+        try:
+            # The uniqueness check reads the whole result, so it runs on the
+            # first page only; the `next` it returns carries the key on to
+            # later pages, which then cost only the rows they return
+            if key and not is_explain and after is None and not _key_is_unique(conn, query, key):
+                key = None
+            if is_explain:
+                sql, params = query, []
+            elif key:
+                sql = f'SELECT * FROM {_subquery(query)} WHERE ? IS NULL OR "{key}" > ? ORDER BY "{key}" LIMIT ?'
+                params = [after, after, page_size + 1]
+            else:
+                sql = f'SELECT * FROM {_subquery(query)} LIMIT ? OFFSET ?'
+                params = [page_size + 1, offset]
+            cursor = conn.execute(sql, params)
+            rows = cursor.fetchmany(page_size + 1)
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                raise QueryError(f'Query exceeded the {timeout:g}s time limit') from e
+            # Mistakes in the submitted SQL are the caller's, not the server's
+            raise QueryError(str(e)) from e
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        columns = [description[0] for description in cursor.description or []]
+        has_more = len(rows) > page_size
+        rows = [list(row) for row in rows[:page_size]]
+
+        next_page = None
+        if has_more:
+            if key:
+                key_index = columns.index(key) if key in columns else None
+                if key_index is None:
+                    raise QueryError(f'Key column {key} is not in the result')
+                next_page = {'key': key, 'after': rows[-1][key_index]}
+            elif not is_explain:
+                next_page = {'offset': offset + page_size}
+
+        return {
+            'columns': columns,
+            'rows': rows,
+            'has_more': has_more,
+            'next': next_page,
+            'elapsed_ms': round(elapsed_ms, 2),
+            'plan': [] if is_explain else explain_plan(conn, query),
+        }
+    finally:
+        conn.close()
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+from collections import deque
+
+from db import get_read_connection
+
+# Change events are written to the database in the same transaction as the
+# change itself, so every worker process (and the CLI scripts) sees them. Each
+# process runs one poller thread that reads new rows and wakes all subscribers
+# through a single Condition: subscribers never touch the database themselves.
+EVENTS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+EVENTS_RETAINED = 10000
+POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 1.0))
+HEARTBEAT_INTERVAL = 15.0
+BUFFER_SIZE = 1000
+
+
+def ensure_events_table(conn):
+    conn.execute(EVENTS_SCHEMA)
+
+
+def publish(conn, event_type, payload):
+    # Call inside the writer's transaction, then broker.wake() after commit
+    cursor = conn.execute(
+        'INSERT INTO events (type, payload) VALUES (?, ?)',
+        (event_type, json.dumps(payload))
+    )
+    conn.execute('DELETE FROM events WHERE id <= ?', (cursor.lastrowid - EVENTS_RETAINED,))
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {event['payload']}\n\n"
+
+
+class EventBroker:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._recent = deque(maxlen=BUFFER_SIZE)
+        self._last_id = None
+        self._generation = 0
+        self._pid = None
+        self.subscribers = 0
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so each worker starts its own poller
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._recent.clear()
+            self._last_id = self._max_id()
+            threading.Thread(target=self._run, name='event-poller', daemon=True).start()
+
+    def _max_id(self):
+        conn = get_read_connection()
+        try:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        finally:
+            conn.close()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"Error polling events: {e}")
+
+    def _poll(self):
+        conn = get_read_connection()
+        try:
+            rows = conn.execute(
+                'SELECT id, type, payload FROM events WHERE id > ? ORDER BY id LIMIT ?',
+                (self._last_id, BUFFER_SIZE)
+            ).fetchall()
+            if not rows:
+                max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        finally:
+            conn.close()
+
+        with self._cond:
+            if rows:
+                self._recent.extend(dict(row) for row in rows)
+                self._last_id = rows[-1]['id']
+            elif max_id < self._last_id:
+                # The database file was swapped for one with an older log
+                self._recent.clear()
+                self._last_id = max_id
+                self._generation += 1
+            else:
+                return
+            self._cond.notify_all()
+
+    def _backlog(self, last_id):
+        conn = get_read_connection()
+        try:
+            rows = conn.execute(
+                'SELECT id, type, payload FROM events WHERE id > ? ORDER BY id LIMIT ?',
+                (last_id, BUFFER_SIZE)
+            ).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def subscribe(self, last_event_id=None):
+        # Generator of SSE frames; resumes after last_event_id when given
+        self._ensure_started()
+        with self._cond:
+            generation = self._generation
+            last_id = self._last_id
+            if last_event_id is not None and last_event_id <= last_id:
+                last_id = last_event_id
+            self.subscribers += 1
+
+        try:
+            if last_event_id is not None and last_event_id > last_id:
+                # Resuming from a log that no longer exists (restored file)
+                last_event_id = None
+                yield format_sse({'id': last_id, 'type': 'reset', 'payload': '{}'})
+            if last_event_id is not None:
+                for event in self._backlog(last_id):
+                    last_id = event['id']
+                    yield format_sse(event)
+
+            yield ': connected\n\n'
+            while True:
+                with self._cond:
+                    has_newer = self._recent and self._recent[-1]['id'] > last_id
+                    if generation == self._generation and not has_newer:
+                        self._cond.wait(HEARTBEAT_INTERVAL)
+                    if generation != self._generation:
+                        generation = self._generation
+                        last_id = self._last_id
+                        pending = [{'id': last_id, 'type': 'reset', 'payload': '{}'}]
+                    else:
+                        pending = [e for e in self._recent if e['id'] > last_id]
+                if not pending:
+                    yield ': keepalive\n\n'
+                    continue
+                for event in pending:
+                    last_id = event['id']
+                    yield format_sse(event)
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+
+broker = EventBroker()
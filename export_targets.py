@@ -1,34 +1,126 @@
-import sqlite3
+import argparse
 import csv
-from datetime import datetime
+import io
+import json
 import os
+import sqlite3
+import sys
+import zlib
+from datetime import datetime
 
-def export_targets():
-    # Connect to the database
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'targets.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Get current timestamp for filename
+from migrations import normalize_status
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_query(statuses=None, regions=None):
+    sql = '''
+        SELECT t.*, z.grade AS zip_grade
+        FROM targets t
+        LEFT JOIN zip_data z ON t.region = z.zip_code
+    '''
+    conditions = []
+    params = []
+    if statuses:
+        # Any spelling of a status selects all of its spellings
+        keys = list(dict.fromkeys(normalize_status(status) for status in statuses))
+        conditions.append(f"t.status_key IN ({','.join('?' for _ in keys)})")
+        params.extend(keys)
+    if regions:
+        conditions.append(f"t.region IN ({','.join('?' for _ in regions)})")
+        params.extend(regions)
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return sql + ' ORDER BY t.organization', params
+
+
+def iter_export_batches(conn, statuses=None, regions=None, batch_size=EXPORT_BATCH_SIZE):
+    # Yields the column names, then lists of row tuples, never the whole table
+    sql, params = export_query(statuses, regions)
+    cursor = conn.execute(sql, params)
+    yield [description[0] for description in cursor.description]
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield [tuple(row) for row in rows]
+
+
+def iter_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(batches))  # Write headers
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(batches):
+    columns = next(batches)
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(conn, fmt='csv', compress=False, statuses=None, regions=None):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    batches = iter_export_batches(conn, statuses, regions)
+    chunks = iter_csv(batches) if fmt == 'csv' else iter_ndjson(batches)
+    if compress:
+        return iter_gzip(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
+
+
+def export_filename(fmt='csv', compress=False):
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    output_file = f'targets_export_{timestamp}.csv'
-    
-    # Get all data from targets table
-    cursor.execute('SELECT * FROM targets')
-    rows = cursor.fetchall()
-    
-    # Get column names
-    cursor.execute('PRAGMA table_info(targets)')
-    columns = [col[1] for col in cursor.fetchall()]
-    
-    # Write to CSV
-    with open(output_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(columns)  # Write headers
-        writer.writerows(rows)    # Write data
-    
-    print(f'Data exported to {output_file}')
-    conn.close()
+    return f'targets_export_{timestamp}.{fmt}' + ('.gz' if compress else '')
+
+
+def export_targets(output_file=None, fmt='csv', compress=False, statuses=None, regions=None, db_path=None):
+    # Connect to the database
+    db_path = db_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'targets.db')
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+
+    output_file = output_file or export_filename(fmt, compress)
+    try:
+        out = sys.stdout.buffer if output_file == '-' else open(output_file, 'wb')
+        try:
+            for chunk in iter_export(conn, fmt, compress, statuses, regions):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+    finally:
+        conn.close()
+
+    if output_file != '-':
+        print(f'Data exported to {output_file}')
 
 if __name__ == '__main__':
-    export_targets()
+    parser = argparse.ArgumentParser(description='Export targets (with ZIP grades) as CSV or NDJSON.')
+    parser.add_argument('-o', '--output', help="output file, '-' for stdout (default: targets_export_<timestamp>.<format>)")
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--gzip', action='store_true', help='gzip-compress the output')
+    parser.add_argument('--status', action='append', help='only targets with this status (repeatable)')
+    parser.add_argument('--region', action='append', help='only targets in this region/ZIP (repeatable)')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    args = parser.parse_args()
+
+    export_targets(args.output, args.format, args.gzip, args.status, args.region, args.db)
@@ -0,0 +1,170 @@
+import argparse
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from db import connect
+from migrations import migrate
+from zip_clusters import run_clustering
+
+# Deterministic synthetic databases for load testing: the same arguments and
+# seed always produce the same rows. ZIP centroids are scattered around real
+# metro areas (plus a rural background), targets sit near ZIP centroids, and
+# the cluster columns are computed by the real clustering engine.
+METROS = [
+    ('New York', 'NY', 40.71, -74.01, 1.00), ('Los Angeles', 'CA', 34.05, -118.24, 0.80),
+    ('Chicago', 'IL', 41.88, -87.63, 0.55), ('Dallas', 'TX', 32.78, -96.80, 0.50),
+    ('Houston', 'TX', 29.76, -95.37, 0.48), ('Washington', 'DC', 38.91, -77.04, 0.45),
+    ('Philadelphia', 'PA', 39.95, -75.17, 0.40), ('Miami', 'FL', 25.76, -80.19, 0.40),
+    ('Atlanta', 'GA', 33.75, -84.39, 0.40), ('Boston', 'MA', 42.36, -71.06, 0.35),
+    ('Phoenix', 'AZ', 33.45, -112.07, 0.33), ('San Francisco', 'CA', 37.77, -122.42, 0.33),
+    ('Seattle', 'WA', 47.61, -122.33, 0.28), ('Minneapolis', 'MN', 44.98, -93.27, 0.25),
+    ('San Diego', 'CA', 32.72, -117.16, 0.23), ('Denver', 'CO', 39.74, -104.99, 0.21),
+    ('Austin', 'TX', 30.27, -97.74, 0.16), ('Charlotte', 'NC', 35.23, -80.84, 0.18),
+    ('Portland', 'OR', 45.52, -122.68, 0.17), ('St. Louis', 'MO', 38.63, -90.20, 0.19),
+]
+STATUSES = [
+    ('not-contacted', 50), ('initial-contact', 15), ('in-discussion', 10), ('low-priority', 10),
+    ('partnership-agreed', 5), ('partnership-active', 4), ('not-interested', 6),
+]
+GRADES = ['A', 'B', 'C', 'D', 'F']
+RURAL_SHARE = 0.25
+# Rough bounding box of the contiguous US
+US_BOUNDS = (24.5, 49.0, -124.5, -67.0)
+
+
+def _zip_rows(rng, count):
+    codes = rng.sample(range(1000, 99999), count)
+    weights = [metro[4] for metro in METROS]
+    rows = []
+    for code in codes:
+        if rng.random() < RURAL_SHARE:
+            lat = rng.uniform(US_BOUNDS[0], US_BOUNDS[1])
+            lng = rng.uniform(US_BOUNDS[2], US_BOUNDS[3])
+            scale = 0.4
+        else:
+            _, _, mlat, mlng, _ = rng.choices(METROS, weights)[0]
+            spread = abs(rng.gauss(0, 0.35))
+            angle = rng.uniform(0, 2 * math.pi)
+            lat = mlat + spread * math.sin(angle)
+            lng = mlng + spread * math.cos(angle) / math.cos(math.radians(mlat))
+            scale = 1.0 + 1.5 * math.exp(-spread * 3)
+        population = int(rng.lognormvariate(9.3, 0.9) * scale)
+        households = int(population / rng.uniform(2.2, 3.1))
+        income = round(rng.lognormvariate(11.1, 0.35) * (0.8 + 0.2 * scale), -2)
+        rows.append([f'{code:05d}', f'ZCTA5 {code:05d}', households, population, income,
+                     round(lat, 6), round(lng, 6)])
+
+    # Grades by income quintile, as the real grading does roughly
+    incomes = sorted(row[4] for row in rows)
+    cuts = [incomes[int(len(incomes) * q)] for q in (0.8, 0.6, 0.4, 0.2)]
+    for row in rows:
+        grade_index = next((i for i, cut in enumerate(cuts) if row[4] >= cut), 4)
+        row.append(GRADES[grade_index])
+    return rows
+
+
+def _target_rows(rng, zips, count):
+    statuses, weights = zip(*STATUSES)
+    now = datetime(2025, 1, 1)
+    rows = []
+    for i in range(count):
+        zip_code, _, households, population, income, lat, lng, _ = rng.choice(zips)
+        city, state = rng.choice(METROS)[:2]
+        rows.append((
+            f'Synthetic Org {i:06d}',
+            f'{rng.randint(1, 9999)} {rng.choice(["Main", "Oak", "Park", "Lake", "Hill"])} St {city}, {state} {zip_code}',
+            zip_code if rng.random() < 0.8 else '',
+            f'555-{rng.randint(0, 9999):04d}',
+            f'https://org{i}.example.com',
+            '',
+            f'{rng.choice([1, 3, 5, 7, 10])} mi',
+            population * rng.randint(3, 15),
+            households * rng.randint(3, 15),
+            int(income),
+            round(lat + rng.gauss(0, 0.02), 6),
+            round(lng + rng.gauss(0, 0.02), 6),
+            rng.choices(statuses, weights)[0],
+            (now - timedelta(minutes=rng.randint(0, 525600))).strftime('%Y-%m-%d %H:%M:%S'),
+        ))
+    return rows
+
+
+def _note_rows(rng, targets, count):
+    words = 'called emailed left voicemail meeting follow up pricing proposal contract site visit'.split()
+    start = datetime(2024, 1, 1)
+    return [
+        (rng.choice(targets)[0],
+         ' '.join(rng.choice(words) for _ in range(rng.randint(4, 30))),
+         (start + timedelta(minutes=rng.randint(0, 525600))).strftime('%Y-%m-%d %H:%M:%S'))
+        for _ in range(count)
+    ]
+
+
+def _activity_rows(rng, targets, count):
+    statuses = [status for status, _ in STATUSES]
+    start = datetime(2024, 1, 1)
+    times = sorted(rng.randint(0, 525600) for _ in range(count))
+    rows = []
+    for minute in times:
+        old, new = rng.sample(statuses, 2)
+        rows.append((rng.choice(targets)[0], old, new,
+                     (start + timedelta(minutes=minute)).strftime('%Y-%m-%d %H:%M:%S')))
+    return rows
+
+
+def generate(db_path, targets=1000, zips=6000, notes=None, activity=None, seed=42, clusters=True):
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} already exists")
+    notes = targets if notes is None else notes
+    activity = targets * 2 if activity is None else activity
+    rng = random.Random(seed)
+
+    conn = connect(db_path)
+    try:
+        migrate(conn, verbose=False)
+        zip_rows = _zip_rows(rng, zips)
+        conn.executemany('''
+            INSERT INTO zip_data (zip_code, geographic_area, households, total_pop, median_income,
+                                  latitude, longitude, grade)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', zip_rows)
+        target_rows = _target_rows(rng, zip_rows, targets)
+        conn.executemany(f'''
+            INSERT INTO targets (organization, address, region, phone, website, notes, drive_radius,
+                                 population, households, median_income, latitude, longitude,
+                                 status, last_updated)
+            VALUES ({','.join('?' * 14)})
+        ''', target_rows)
+        conn.executemany('INSERT INTO notes (target_id, content, timestamp) VALUES (?, ?, ?)',
+                         _note_rows(rng, target_rows, notes))
+        conn.executemany('''
+            INSERT INTO activity_log (organization, old_status, new_status, timestamp)
+            VALUES (?, ?, ?, ?)
+        ''', _activity_rows(rng, target_rows, activity))
+        if clusters:
+            run_clustering(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return {'targets': targets, 'zips': zips, 'notes': notes, 'activity': activity}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a deterministic synthetic targets database.')
+    parser.add_argument('output', help='path of the new database file')
+    parser.add_argument('--targets', type=int, default=1000)
+    parser.add_argument('--zips', type=int, default=6000, help='ZIP codes (about 42000 for the national set)')
+    parser.add_argument('--notes', type=int, help='default: one per target')
+    parser.add_argument('--activity', type=int, help='activity_log rows (default: two per target)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-clusters', action='store_true', help='leave the zip_data cluster columns empty')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(args.output, args.targets, args.zips, args.notes, args.activity,
+                      args.seed, clusters=not args.no_clusters)
+    print(f"Generated {args.output} in {time.perf_counter() - started:.1f}s: "
+          + ', '.join(f'{count} {name}' for name, count in counts.items()))
@@ -0,0 +1,120 @@
+import math
+
+# Great-circle helpers shared by the ZIP clustering, radius and region lookups.
+# Points are kept as unit vectors: the straight-line (chord) distance between
+# two of them is monotonic in the great-circle distance, so a radius in miles
+# becomes one squared-chord threshold and each candidate costs three
+# multiplications instead of a haversine. The grid buckets the vectors into
+# cubes, so a radius query only looks at the cells it can reach.
+EARTH_RADIUS_MI = 3958.8
+
+
+def to_unit(lat, lng):
+    phi, lam = math.radians(lat), math.radians(lng)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+def chord_for_miles(miles):
+    return 2.0 * math.sin(min(miles / EARTH_RADIUS_MI, math.pi) / 2.0)
+
+
+def miles_for_chord(chord):
+    return 2.0 * EARTH_RADIUS_MI * math.asin(min(chord / 2.0, 1.0))
+
+
+def haversine_mi(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    h = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MI * math.asin(math.sqrt(min(h, 1.0)))
+
+
+def _cell_center(key, cell):
+    return tuple((k + 0.5) * cell for k in key)
+
+
+class PointGrid:
+    # Uniform grid over unit vectors. `cell_miles` should be about the radius
+    # most queries use; larger radii just visit more cells.
+
+    def __init__(self, points, cell_miles=10.0):
+        # points: iterable of (lat, lng); their positions are the ids returned
+        self.cell = chord_for_miles(cell_miles)
+        self.vectors = [to_unit(lat, lng) for lat, lng in points]
+        self.cells = {}
+        cell = self.cell
+        for i, (x, y, z) in enumerate(self.vectors):
+            key = (math.floor(x / cell), math.floor(y / cell), math.floor(z / cell))
+            bucket = self.cells.get(key)
+            if bucket is None:
+                self.cells[key] = [i]
+            else:
+                bucket.append(i)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _candidates(self, vector, chord):
+        cell = self.cell
+        span = max(1, math.ceil(chord / cell))
+        cx, cy, cz = (math.floor(v / cell) for v in vector)
+        cells = self.cells
+        if (2 * span + 1) ** 3 > len(cells):
+            # Radius covers most of the grid: walking occupied cells is cheaper
+            for (kx, ky, kz), bucket in cells.items():
+                if abs(kx - cx) <= span and abs(ky - cy) <= span and abs(kz - cz) <= span:
+                    yield bucket
+            return
+        for dx in range(-span, span + 1):
+            for dy in range(-span, span + 1):
+                for dz in range(-span, span + 1):
+                    bucket = cells.get((cx + dx, cy + dy, cz + dz))
+                    if bucket:
+                        yield bucket
+
+    def within(self, lat, lng, radius_mi):
+        # [(id, miles)] of every point within radius_mi, nearest first
+        vector = to_unit(lat, lng)
+        x, y, z = vector
+        chord = chord_for_miles(radius_mi)
+        limit = chord * chord
+        vectors = self.vectors
+        found = []
+        for bucket in self._candidates(vector, chord):
+            for i in bucket:
+                px, py, pz = vectors[i]
+                d = (px - x) ** 2 + (py - y) ** 2 + (pz - z) ** 2
+                if d <= limit:
+                    found.append((d, i))
+        found.sort()
+        return [(i, miles_for_chord(math.sqrt(d))) for d, i in found]
+
+    def nearest(self, lat, lng, max_mi=500.0):
+        # (id, miles) of the closest point within max_mi, or None
+        radius = miles_for_chord(self.cell)
+        while True:
+            found = self.within(lat, lng, min(radius, max_mi))
+            if found or radius >= max_mi:
+                return found[0] if found else None
+            radius *= 2
+
+    def neighbor_lists(self, radius_mi):
+        # For every point, the ids of all points within radius_mi (itself
+        # included). One pass over the grid; the work is proportional to the
+        # number of close pairs, not to n².
+        chord = chord_for_miles(radius_mi)
+        limit = chord * chord
+        vectors = self.vectors
+        neighbors = [None] * len(vectors)
+        for key, bucket in self.cells.items():
+            nearby = [j for candidates in self._candidates(_cell_center(key, self.cell), chord)
+                      for j in candidates]
+            near_vectors = [(j,) + vectors[j] for j in nearby]
+            for i in bucket:
+                x, y, z = vectors[i]
+                neighbors[i] = [
+                    j for j, px, py, pz in near_vectors
+                    if (px - x) * (px - x) + (py - y) * (py - y) + (pz - z) * (pz - z) <= limit
+                ]
+        return neighbors
@@ -0,0 +1,329 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from db import connect, get_read_connection, get_write_connection
+
+# ZIP geocodes live in one indexed table instead of the flat files that used to
+# sit in data/. A lookup is a primary-key probe, fronted by a bounded LRU, so a
+# cold process never has to parse a JSON blob to answer one ZIP. Triggers copy
+# every zip_data coordinate change into the table, and every write to it
+# bumps its own row in geocode_cache_version, which is what tells each
+# worker's LRU to start over. Writes to targets or notes leave the LRU alone.
+GEOCODE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        zip_code TEXT PRIMARY KEY,
+        latitude REAL,
+        longitude REAL,
+        state TEXT,
+        county TEXT,
+        tract TEXT,
+        block TEXT,
+        source TEXT,
+        processed INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+'''
+
+GEOCODE_VERSION_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS geocode_cache_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+'''
+# The epoch changes when a restore swaps the database file, so the pair
+# identifies the table's contents across files too
+GEOCODE_VERSION_QUERY = '''
+    SELECT d.epoch, g.version FROM data_version d, geocode_cache_version g
+    WHERE d.id = 1 AND g.id = 1
+'''
+
+GEOCODE_FIELDS = ('latitude', 'longitude', 'state', 'county', 'tract', 'block', 'source', 'processed')
+GEOCODE_CACHE_ENTRIES = int(os.environ.get('GEOCODE_CACHE_ENTRIES', 50000))
+BULK_CHUNK = 500  # stay well under SQLite's bound-parameter limit
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+# zip_data is the authority for the ZIPs it has: its coordinates replace
+# whatever an older source put in the cache, the other columns are kept
+_SYNC_FROM_ZIP_DATA = '''
+    INSERT INTO geocode_cache (zip_code, latitude, longitude, source)
+    {select}
+    ON CONFLICT(zip_code) DO UPDATE SET
+        latitude = excluded.latitude,
+        longitude = excluded.longitude,
+        source = 'zip_data',
+        updated_at = CURRENT_TIMESTAMP
+    WHERE latitude IS NOT excluded.latitude OR longitude IS NOT excluded.longitude
+'''
+_SYNC_ROW = _SYNC_FROM_ZIP_DATA.format(
+    select="SELECT new.zip_code, new.latitude, new.longitude, 'zip_data' "
+           'WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL'
+)
+
+GEOCODE_TRIGGERS = {
+    'geocode_zip_data_insert': ('AFTER INSERT ON zip_data', _SYNC_ROW + ';'),
+    # A renamed ZIP or cleared coordinates drop the row zip_data put there
+    'geocode_zip_data_update': ('AFTER UPDATE OF zip_code, latitude, longitude ON zip_data', '''
+        DELETE FROM geocode_cache
+        WHERE zip_code = old.zip_code AND source = 'zip_data'
+          AND (old.zip_code IS NOT new.zip_code OR new.latitude IS NULL OR new.longitude IS NULL);
+    ''' + _SYNC_ROW + ';'),
+    'geocode_zip_data_delete': ('AFTER DELETE ON zip_data', '''
+        DELETE FROM geocode_cache WHERE zip_code = old.zip_code AND source = 'zip_data';
+    '''),
+}
+
+
+def ensure_geocode_cache(conn):
+    synced = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'geocode_zip_data_update'"
+    ).fetchone() is not None
+    conn.execute(GEOCODE_SCHEMA)
+    # Seed an empty table once from the old files and zip_data
+    if conn.execute('SELECT 1 FROM geocode_cache LIMIT 1').fetchone() is None:
+        migrate_files(conn)
+    for name, (event, body) in GEOCODE_TRIGGERS.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+    conn.execute(GEOCODE_VERSION_SCHEMA)
+    conn.execute('INSERT OR IGNORE INTO geocode_cache_version (id, version) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        name = f'geocode_cache_version_{event.lower()}'
+        # Earlier versions of these triggers bumped data_version instead
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)).fetchone()
+        if row is not None and 'geocode_cache_version' not in row[0].split('BEGIN', 1)[1]:
+            conn.execute(f'DROP TRIGGER {name}')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}
+            AFTER {event} ON geocode_cache
+            BEGIN
+                UPDATE geocode_cache_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+    # The triggers keep it in step from here on; catch up on earlier drift once
+    if not synced:
+        sync_from_zip_data(conn)
+
+
+def sync_from_zip_data(conn):
+    # Copy zip_data coordinates that differ from the cache; returns rows changed
+    before = conn.total_changes
+    conn.execute(_SYNC_FROM_ZIP_DATA.format(
+        select="SELECT zip_code, latitude, longitude, 'zip_data' FROM zip_data "
+               'WHERE latitude IS NOT NULL AND longitude IS NOT NULL'
+    ))
+    return conn.total_changes - before
+
+
+def _read_csv(path):
+    # zip,lat,lng files with a header row (and sometimes a BOM)
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) >= 3 and row[0].strip():
+                try:
+                    yield row[0].strip().zfill(5), float(row[1]), float(row[2])
+                except ValueError:
+                    continue
+
+
+def migrate_files(conn, data_dir=DATA_DIR):
+    # Import the legacy files; earlier sources win when they disagree, the
+    # CSVs first since they match zip_data. Returns rows added per source.
+    insert = '''
+        INSERT INTO geocode_cache (zip_code, latitude, longitude, state, county, tract, block, source)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(zip_code) DO NOTHING
+    '''
+    added = {}
+
+    def run(source, rows):
+        before = conn.total_changes
+        conn.executemany(insert, rows)
+        added[source] = conn.total_changes - before
+
+    for name in ('zip_lat_long.csv', 'zip_coords.csv'):
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            run(name, ((z, lat, lng, None, None, None, None, name) for z, lat, lng in _read_csv(path)))
+
+    path = os.path.join(data_dir, 'zip_geocode_cache.json')
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            cached = json.load(f)
+        run('zip_geocode_cache.json', (
+            (
+                z, entry.get('latitude'), entry.get('longitude'), entry.get('state') or None,
+                entry.get('county') or None, entry.get('tract') or None, entry.get('block') or None,
+                'zip_geocode_cache.json',
+            )
+            for z, entry in cached.items()
+        ))
+
+    run('zip_data', conn.execute('''
+        SELECT zip_code, latitude, longitude, NULL, NULL, NULL, NULL, 'zip_data'
+        FROM zip_data WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''').fetchall())
+
+    path = os.path.join(data_dir, 'processed_zips.json')
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            processed = [(z,) for z in json.load(f)]
+        conn.executemany(
+            "INSERT INTO geocode_cache (zip_code, source) VALUES (?, 'processed_zips.json') "
+            'ON CONFLICT(zip_code) DO NOTHING',
+            processed
+        )
+        conn.executemany('UPDATE geocode_cache SET processed = 1 WHERE zip_code = ?', processed)
+        added['processed_zips.json'] = len(processed)
+    return added
+
+
+_MISSING = object()
+
+
+def table_version(conn):
+    # 'epoch-version' of the geocode_cache contents, None before the schema exists
+    try:
+        row = conn.execute(GEOCODE_VERSION_QUERY).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return f'{row[0]}-{row[1]}' if row else None
+
+
+class GeocodeCache:
+    # Read-through LRU over the geocode_cache table. Entries are valid for one
+    # geocode_cache_version: any write to the table, from any process,
+    # empties it.
+    # Misses are not remembered, so a ZIP added later is found at once.
+
+    def __init__(self, max_entries=GEOCODE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        # Call with the lock held
+        if version != self._version or version is None:
+            self._entries.clear()
+            self._version = version
+
+    def _remember(self, zip_code, value):
+        self._entries[zip_code] = value
+        self._entries.move_to_end(zip_code)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, zip_code, conn=None):
+        return self.get_many([zip_code], conn).get(zip_code)
+
+    def get_many(self, zip_codes, conn=None):
+        # {zip_code: row dict} for the ZIPs that are known
+        own = conn is None
+        if own:
+            conn = get_read_connection()
+        try:
+            version = table_version(conn)
+            found = {}
+            wanted = []
+            with self._lock:
+                self._check_version(version)
+                for zip_code in dict.fromkeys(zip_codes):
+                    value = self._entries.get(zip_code, _MISSING)
+                    if value is _MISSING:
+                        wanted.append(zip_code)
+                        continue
+                    self._entries.move_to_end(zip_code)
+                    found[zip_code] = value
+            if not wanted:
+                return found
+
+            loaded = {}
+            for start in range(0, len(wanted), BULK_CHUNK):
+                chunk = wanted[start:start + BULK_CHUNK]
+                rows = conn.execute(
+                    f"SELECT zip_code, {', '.join(GEOCODE_FIELDS)} FROM geocode_cache "
+                    f"WHERE zip_code IN ({','.join('?' for _ in chunk)})",
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    loaded[row[0]] = dict(zip(GEOCODE_FIELDS, row[1:]))
+        finally:
+            if own:
+                conn.close()
+
+        with self._lock:
+            # Rows read under an older version may already be stale
+            if version == self._version:
+                for zip_code, value in loaded.items():
+                    self._remember(zip_code, value)
+        found.update(loaded)
+        return found
+
+    def put(self, zip_code, latitude, longitude, conn=None, **fields):
+        self.put_many([dict(fields, zip_code=zip_code, latitude=latitude, longitude=longitude)], conn)
+
+    def put_many(self, entries, conn=None):
+        # entries: dicts with zip_code plus any of GEOCODE_FIELDS; upserted in
+        # one executemany. Commits only when it opened the connection itself.
+        rows = []
+        for entry in entries:
+            values = {field: entry.get(field) for field in GEOCODE_FIELDS}
+            values['processed'] = int(bool(values['processed']))
+            rows.append((entry['zip_code'],) + tuple(values[field] for field in GEOCODE_FIELDS))
+        if not rows:
+            return 0
+
+        updates = ', '.join(f'{field} = excluded.{field}' for field in GEOCODE_FIELDS)
+        own = conn is None
+        if own:
+            conn = get_write_connection()
+        try:
+            conn.executemany(
+                f"INSERT INTO geocode_cache (zip_code, {', '.join(GEOCODE_FIELDS)}) "
+                f"VALUES ({','.join('?' for _ in range(len(GEOCODE_FIELDS) + 1))}) "
+                f'ON CONFLICT(zip_code) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP',
+                rows
+            )
+            if own:
+                conn.commit()
+        finally:
+            if own:
+                conn.close()
+        # The write bumped geocode_cache_version; the next lookup starts a
+        # fresh LRU, here and in every other worker
+        return len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+geocode_cache = GeocodeCache()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create the geocode_cache table and import the legacy data/ files.')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory holding the legacy files (default: data/)')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        conn.execute(GEOCODE_SCHEMA)
+        added = migrate_files(conn, args.data_dir)
+        conn.commit()
+        total = conn.execute('SELECT COUNT(*) FROM geocode_cache').fetchone()[0]
+    finally:
+        conn.close()
+    for source, count in added.items():
+        print(f"{source}: {count} rows")
+    print(f"geocode_cache now holds {total} ZIPs")
@@ -0,0 +1,150 @@
+import os
+
+# Production server for serve_map_data.py: gunicorn pre-forks worker
+# processes that each serve many connections at once. From the project
+# directory (gunicorn reads this file from there by default):
+#   gunicorn                      start, on TARGETS_BIND
+#   kill -HUP <master pid>        graceful reload: new workers start, old
+#                                 ones finish their requests and exit
+#   kill -TERM <master pid>       graceful stop, waiting up to
+#                                 TARGETS_GRACEFUL_TIMEOUT seconds
+# `python serve_map_data.py` stays the development server (reloader and
+# debugger on); never expose it.
+#
+# gevent workers by default: every open map or kanban page keeps an
+# /api/events stream open for as long as it is open. A thread per stream
+# (gthread) runs out after a handful of tabs per worker, and then nothing
+# else is answered. A greenlet per connection costs a few KB, so streams and
+# API calls share TARGETS_WORKER_CONNECTIONS per worker. SQLite calls do not
+# yield, so a request holds its worker while it is in the database; extra
+# workers, one per core, are what let queries run in parallel. SQLite lets many readers run
+# at once, but only one writer, and writes still queue on the database lock
+# (busy_timeout), blocking the waiting worker. TARGETS_WORKER_CLASS=gthread
+# brings back threads, sized with TARGETS_THREADS; the slow-request profiler
+# in metrics.py samples threads, so it only records profiles there.
+#
+# Each worker has its own connection pools, response cache, event poller and
+# metrics. /metrics therefore reports the worker that answered the scrape;
+# sum across workers, or run one worker, when exact totals matter. Cached
+# responses stay consistent across workers because they are keyed by the
+# data_version row in the database.
+#
+# Throughput, measured with load_test.py on a single CPU core (clients and
+# server share it). Database: 10k targets (generate_data.py --targets 10000
+# --zips 20000). Default read mix, 20 s per run, default settings (gevent
+# with one worker on this core; gthread with 3 workers x 8 threads):
+#   server                  clients  streams  req/s  mean ms  p50 ms  p95 ms
+#   dev server                    8        0   1015      7.9     7.6    14.4
+#   dev server                   64        0   1024     62.4    61.2    74.1
+#   dev server                   64       32    990     64.5    59.4   108.9
+#   gunicorn, gevent              8        0   1556      5.1     0.9    18.0
+#   gunicorn, gevent             64        0   1717     37.2     0.8   148.2
+#   gunicorn, gevent             64       32   1717     37.2     0.9   146.5
+#   gunicorn, gevent x 3         64        0   1601     39.9     2.0   206.3
+#   gunicorn, gthread             8        0   1589      5.0     4.2    11.0
+#   gunicorn, gthread            64        0   1526     41.9    41.7    71.4
+# At 64 clients the core is saturated and every server is queueing: the
+# mean is just clients / throughput. The /metrics histogram puts all of
+# gevent's request handling under 2.5 ms, so its p95 is not request cost
+# (nor the startup rebuild or backup locks, which no longer stall a
+# worker). A gevent worker is never preempted: it answers the connections
+# that are ready one after another, so most requests are answered at once
+# and the rest wait a whole round. Threads share the core evenly through the
+# GIL, which gives the flat p50/p95 of the dev server and gthread. Three
+# gevent workers on one core add a second level of time-slicing on top,
+# which is where the earlier 213 ms p95 came from. With more cores, one
+# gevent worker per core serves in parallel and the rounds get shorter.
+# gthread's tail is kinder, but each open /api/events stream holds one of
+# its threads: with 32 streams only 16 got a thread within 30 s, and with
+# one worker 8 streams stopped /api/dashboard/summary from answering at
+# all. gevent held all 32 at no cost to throughput.
+# Add one status update per eleven requests and it is a different picture:
+# each write invalidates the cached /api/targets and /api/kanban_data, and
+# both are rebuilt. With 16 clients:
+#   dev server              60 req/s, p50 185 ms, p95 776 ms
+#   gunicorn, gevent        84 req/s, p50 1.2 ms, p95 1.4 s
+#   gunicorn, gevent x 3    67 req/s, p50 7.2 ms, p95 1.5 s
+#   gunicorn, gthread       64 req/s, p50 45 ms, p95 1.2 s
+# A rebuild runs start to finish on the worker's loop, holding up every
+# other connection on it; more workers per core only add more copies of the
+# cache to rebuild. Reproduce with:
+#   python load_test.py --server dev --server gunicorn --db data/targets.db --clients 8 --clients 64 --streams 32
+
+# gevent needs the standard library patched before anything creates a lock,
+# thread or socket. With preload_app the master imports the app right after
+# reading this file, so patch here, first.
+worker_class = os.environ.get('TARGETS_WORKER_CLASS', 'gevent')
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+wsgi_app = 'serve_map_data:app'
+bind = os.environ.get('TARGETS_BIND', '127.0.0.1:5000')
+
+# A gevent worker never waits on a socket, so it keeps one core busy on its
+# own: one worker per core. More only time-slice the same cores, and since a
+# worker's ready connections stay queued while it is descheduled, that
+# lowers throughput and stretches the tail (see the table above). The usual
+# 2 x cores + 1 is for workers that block in their threads, so gthread
+# keeps it. A gevent worker waiting on SQLite's write lock serves nothing
+# meanwhile, so add one if long imports run against the live database.
+if worker_class == 'gevent':
+    default_workers = os.cpu_count()
+else:
+    default_workers = os.cpu_count() * 2 + 1
+workers = int(os.environ.get('TARGETS_WORKERS', default_workers))
+# Concurrent connections per gevent worker, open event streams included. A
+# browser tab holds one /api/events stream plus up to 6 keep-alive
+# connections, so 1000 covers about 140 tabs per worker; a greenlet costs a
+# few KB, so this bounds file descriptors rather than memory. Database work
+# is bounded separately by the connection pools (db.py). Connections beyond
+# this wait in the listen backlog until one closes.
+worker_connections = int(os.environ.get('TARGETS_WORKER_CONNECTIONS', 1000))
+threads = int(os.environ.get('TARGETS_THREADS', 8))
+# Idle seconds a keep-alive connection is held open between requests
+keepalive = int(os.environ.get('TARGETS_KEEPALIVE', 5))
+timeout = int(os.environ.get('TARGETS_WORKER_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('TARGETS_GRACEFUL_TIMEOUT', 30))
+# Recycle workers after this many requests (0: never), staggered by the jitter
+max_requests = int(os.environ.get('TARGETS_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('TARGETS_MAX_REQUESTS_JITTER', 0))
+
+# Load the app once in the master so migrations and derived tables are
+# prepared by a single process, not raced by every worker. HUP then restarts
+# workers from the loaded code. To deploy new code, set TARGETS_PRELOAD=0 so
+# HUP re-imports it, or restart the service.
+preload_app = os.environ.get('TARGETS_PRELOAD', '1') != '0'
+
+accesslog = os.environ.get('TARGETS_ACCESS_LOG') or None
+errorlog = '-'
+
+# TARGETS_DB_READ_POOL and TARGETS_DB_WRITE_POOL set the per-worker pool
+# sizes (see db.py). A gevent worker runs one query at a time, so the default
+# pool is plenty there; threaded workers get one read connection per thread.
+if worker_class == 'gthread':
+    os.environ.setdefault('TARGETS_DB_READ_POOL', str(threads))
+
+
+def pre_fork(server, worker):
+    # Runs in the master: close the handles left from preparing the schema
+    # so no SQLite connection crosses fork()
+    from db import reset_pools
+    reset_pools()
+
+
+def post_fork(server, worker):
+    import db
+    if worker_class == 'gthread':
+        capacity = f"{threads} threads"
+    else:
+        capacity = f"{worker_connections} connections"
+    server.log.info(
+        f"Worker {worker.pid}: {worker_class}, {capacity}, "
+        f"{db.READ_POOL_SIZE} read / {db.WRITE_POOL_SIZE} write connections on {db.DB_PATH}"
+    )
+
+
+def worker_exit(server, worker):
+    # Close this worker's connections and checkpoint the WAL on the way out
+    from db import reset_pools
+    reset_pools()
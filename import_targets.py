@@ -1,67 +1,121 @@
-import sqlite3
+import argparse
 import csv
-import sys
+import itertools
 import os
+import time
+from backfill_regions import backfill_regions
+from db import connect
+from migrations import migrate
+from spatial import ensure_cluster_grid, ensure_spatial_index
 
-def import_targets(csv_file):
+# Columns the kanban owns. By default an import leaves them alone on rows that
+# already exist, so re-importing a CSV does not undo everyone's drags.
+STATUS_COLUMNS = ('status', 'last_updated')
+
+
+def build_upsert_query(headers, keep_status=True):
+    placeholders = ','.join(['?' for _ in headers])
+    updated = [
+        col for col in headers
+        if col != 'organization' and not (keep_status and col in STATUS_COLUMNS)
+    ]
+    if updated:
+        conflict = 'DO UPDATE SET ' + ', '.join(f'{col} = excluded.{col}' for col in updated)
+    else:
+        conflict = 'DO NOTHING'
+    return (
+        f'INSERT INTO targets ({",".join(headers)}) VALUES ({placeholders}) '
+        f'ON CONFLICT(organization) {conflict}'
+    )
+
+
+def import_targets(csv_file, batch_size=5000, keep_status=True, skip_status=False, db_path=None,
+                   fill_regions=False):
     # Connect to the database
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'targets.db')
+    db_path = db_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'targets.db')
     print(f"Connecting to database at: {db_path}")
-    conn = sqlite3.connect(db_path)
+    conn = connect(db_path)
     cursor = conn.cursor()
-    
+
     try:
+        migrate(conn)
+
         # Read CSV file
         print(f"Reading CSV file: {csv_file}")
-        with open(csv_file, 'r', encoding='utf-8') as f:
+        with open(csv_file, 'r', encoding='utf-8-sig', newline='') as f:
             csv_reader = csv.reader(f)
             headers = next(csv_reader)  # Get headers
             print(f"CSV Headers: {headers}")
-            
-            # Get current table structure
-            cursor.execute('PRAGMA table_info(targets)')
+
+            # Get current table structure; generated columns (status_key) are
+            # computed by SQLite, so a CSV exported with them just skips them
+            cursor.execute('PRAGMA table_xinfo(targets)')
             table_info = cursor.fetchall()
-            table_columns = [col[1] for col in table_info]
+            table_columns = [col[1] for col in table_info if col[6] == 0]
+            generated = {col[1] for col in table_info if col[6] != 0}
             print(f"Database columns: {table_columns}")
-            
-            # Verify headers match database columns
-            if set(headers) != set(table_columns):
-                print("Warning: CSV headers don't match database columns!")
-                print(f"Missing in CSV: {set(table_columns) - set(headers)}")
-                print(f"Extra in CSV: {set(headers) - set(table_columns)}")
+
+            # Every CSV column must exist in the table; missing ones keep their defaults
+            extra = set(headers) - set(table_columns) - generated
+            if extra or 'organization' not in headers:
+                print(f"Extra in CSV: {extra}")
                 raise ValueError("CSV structure doesn't match database structure")
-            
-            # Clear existing data
-            print("Clearing existing data...")
-            cursor.execute('DELETE FROM targets')
-            
-            # Prepare insert statement with the correct number of placeholders
-            placeholders = ','.join(['?' for _ in headers])
-            insert_query = f'INSERT INTO targets ({",".join(headers)}) VALUES ({placeholders})'
-            print(f"Insert query: {insert_query}")
-            
-            # Insert new data
+            missing = set(table_columns) - set(headers)
+            if missing:
+                print(f"Missing in CSV (left unchanged): {missing}")
+
+            # Optionally drop the status columns from the CSV entirely
+            keep_indexes = [
+                i for i, col in enumerate(headers)
+                if not (skip_status and col in STATUS_COLUMNS) and col not in generated
+            ]
+            columns = [headers[i] for i in keep_indexes]
+
+            upsert_query = build_upsert_query(columns, keep_status=keep_status)
+            print(f"Upsert query: {upsert_query}")
+
+            # Stream the file in batches; each batch is its own transaction so
+            # the server's writers can interleave and the WAL stays small
             row_count = 0
-            for row in csv_reader:
-                cursor.execute(insert_query, row)
-                row_count += 1
-            
+            skipped = 0
+            started = time.perf_counter()
+            while True:
+                chunk = list(itertools.islice(csv_reader, batch_size))
+                if not chunk:
+                    break
+                batch = [[row[i] for i in keep_indexes] for row in chunk if len(row) == len(headers)]
+                skipped += len(chunk) - len(batch)
+                if batch:
+                    cursor.executemany(upsert_query, batch)
+                    conn.commit()
+                    row_count += len(batch)
+                    elapsed = time.perf_counter() - started
+                    print(f"  {row_count} rows ({row_count / elapsed:,.0f} rows/sec)")
+
+            # Give targets with an empty region a ZIP from the address or map position
+            if fill_regions:
+                stats = backfill_regions(conn)
+                print(f"Filled {stats['updated']} regions ({stats['address']} from address, "
+                      f"{stats['nearest']} from nearest ZIP, {stats['unresolved']} unresolved)")
+
+            # The map's spatial index and cluster grid, if this database has none
+            # yet; triggers keep existing ones in step with the rows just written
+            ensure_spatial_index(conn)
+            ensure_cluster_grid(conn)
+
             # Commit changes
             conn.commit()
-            print(f"Successfully imported {row_count} rows")
-            
+            elapsed = time.perf_counter() - started
+            rate = row_count / elapsed if elapsed else row_count
+            print(f"Successfully imported {row_count} rows in {elapsed:.1f}s ({rate:,.0f} rows/sec)")
+            if skipped:
+                print(f"Skipped {skipped} malformed rows")
+
             # Verify data
             cursor.execute('SELECT COUNT(*) FROM targets')
             final_count = cursor.fetchone()[0]
             print(f"Final row count in database: {final_count}")
-            
-            # Print a few sample rows
-            print("\nSample rows from database:")
-            cursor.execute('SELECT * FROM targets LIMIT 3')
-            sample_rows = cursor.fetchall()
-            for row in sample_rows:
-                print(row)
-            
+
     except Exception as e:
         print(f'Error importing data: {str(e)}')
         conn.rollback()
@@ -69,9 +123,27 @@ def import_targets(csv_file):
         conn.close()
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Usage: python import_targets.py <csv_file>')
-        print('Example: python import_targets.py targets_import.csv')
-        sys.exit(1)
-    
-    import_targets(sys.argv[1])
+    parser = argparse.ArgumentParser(
+        description='Upsert targets from a CSV file, streaming it in batches.',
+        epilog='Example: python import_targets.py targets_import.csv'
+    )
+    parser.add_argument('csv_file')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='rows per executemany/commit (default: 5000)')
+    parser.add_argument('--overwrite-status', action='store_true',
+                        help='replace status/last_updated of existing targets with the CSV values')
+    parser.add_argument('--skip-status', action='store_true',
+                        help='ignore the status/last_updated columns in the CSV entirely')
+    parser.add_argument('--fill-regions', action='store_true',
+                        help='fill empty targets.region values with ZIP codes after the import')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    args = parser.parse_args()
+
+    import_targets(
+        args.csv_file,
+        batch_size=args.batch_size,
+        keep_status=not args.overwrite_status,
+        skip_status=args.skip_status,
+        db_path=args.db,
+        fill_regions=args.fill_regions,
+    )
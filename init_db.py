@@ -1,14 +1,15 @@
-import sqlite3
+from db import connect
+from migrations import migrate, schema_version
 
 def init_db():
-    conn = sqlite3.connect('data/targets.db')
-    
-    with open('schema.sql') as f:
-        conn.executescript(f.read())
-    
-    conn.commit()
-    conn.close()
+    # Creates the database if needed and applies every pending migration
+    conn = connect('data/targets.db')
+    try:
+        migrate(conn)
+        return schema_version(conn)
+    finally:
+        conn.close()
 
 if __name__ == '__main__':
-    init_db()
-    print("Database initialized successfully")
+    version = init_db()
+    print(f"Database initialized successfully (schema version {version})")
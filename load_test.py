@@ -0,0 +1,262 @@
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+from benchmark import FIRST_ORG, ROUTES, _format
+
+# Concurrent load against a running server, for comparing the development
+# server with gunicorn (gunicorn.conf.py). Each client is a thread with its
+# own keep-alive connection that sends requests back to back, cycling
+# through a mix of routes. It reports throughput and the latency
+# percentiles. Either point it at a running server with --url, or let it
+# start one on port 5000 against --db and stop it afterwards:
+#   python load_test.py --server gunicorn --db data/targets.db --clients 64
+# The clients share the machine with the server. On a small box, read the
+# numbers as a comparison between servers, not as capacity. --streams keeps
+# that many /api/events streams open during each run, the way open map and
+# kanban tabs do; a server that ties a thread to each stream shows it here.
+
+# Route names from benchmark.ROUTES, weighted by repetition: map page loads
+# and panning, with a little search, dashboard and kanban traffic. Reads
+# only: every write invalidates the cached responses for all workers, so add
+# --route 'update status' to see that pattern.
+MIX = [
+    'page /', 'targets', 'map clusters z5', 'targets bbox', 'targets bbox',
+    'search prefix', 'notes', 'activity log', 'dashboard summary', 'kanban data',
+]
+
+SERVER_COMMANDS = {
+    'dev': [sys.executable, 'serve_map_data.py'],
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+}
+SERVER_URL = 'http://127.0.0.1:5000'
+
+
+def _requests(names):
+    routes = {name: (method, path, body) for name, method, path, body in ROUTES}
+    unknown = [name for name in names if name not in routes]
+    if unknown:
+        raise SystemExit(f"Unknown routes: {', '.join(unknown)}")
+    requests = []
+    for name in names:
+        method, path, body = routes[name]
+        body = _format(body, FIRST_ORG)
+        requests.append((name, method, quote(_format(path, FIRST_ORG), safe='/?=&,%'),
+                         json.dumps(body).encode() if body is not None else None))
+    return requests
+
+
+def _connect(url):
+    parts = urlsplit(url)
+    return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+
+
+def wait_for_server(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = _connect(url)
+            conn.request('GET', '/api/dashboard/summary')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Server at {url} did not come up within {timeout}s")
+
+
+def start_server(kind, db_path):
+    env = dict(os.environ, TARGETS_DB=os.path.abspath(db_path))
+    # A session of its own, so stopping it also stops the dev server's reloader child
+    process = subprocess.Popen(SERVER_COMMANDS[kind], env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_server(SERVER_URL)
+    return process
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=40)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def _stream(url, ready, opened, sockets):
+    # One open /api/events stream, read until close_streams() shuts its socket
+    conn = _connect(url)
+    try:
+        conn.connect()
+        sockets.append(conn.sock)
+        conn.request('GET', '/api/events', headers={'Accept': 'text/event-stream'})
+        response = conn.getresponse()
+        if response.status == 200:
+            opened.append(1)
+        ready.release()
+        while response.read1(4096):
+            pass
+    except (OSError, ValueError, http.client.HTTPException):
+        ready.release()
+    finally:
+        conn.close()
+
+
+def open_streams(url, count, timeout=30):
+    # Starts count event streams; returns (sockets, threads, streams opened)
+    ready = threading.Semaphore(0)
+    opened = []
+    sockets = []
+    threads = [threading.Thread(target=_stream, args=(url, ready, opened, sockets), daemon=True)
+               for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    for _ in threads:
+        if not ready.acquire(timeout=max(0, deadline - time.monotonic())):
+            break
+    return sockets, threads, len(opened)
+
+
+def close_streams(sockets, threads):
+    for sock in list(sockets):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    for thread in threads:
+        thread.join(timeout=5)
+
+
+def _client(url, requests, offset, deadline, results):
+    conn = None
+    i = offset
+    while time.monotonic() < deadline:
+        name, method, path, body = requests[i % len(requests)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = _connect(url)
+            headers = {'Accept-Encoding': 'gzip'}
+            if body is not None:
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 500
+        except (OSError, http.client.HTTPException):
+            if conn is not None:
+                conn.close()
+            conn = None
+            ok = False
+        results.append((name, (time.perf_counter() - started) * 1000, ok))
+    if conn is not None:
+        conn.close()
+
+
+def run_load(url, requests, clients, duration, warmup, streams=0):
+    sockets, stream_threads, opened = open_streams(url, streams) if streams else ([], [], 0)
+    try:
+        if warmup:
+            _client(url, requests, 0, time.monotonic() + warmup, [])
+        results = []
+        deadline = time.monotonic() + duration
+        threads = [
+            threading.Thread(target=_client, args=(url, requests, i, deadline, results))
+            for i in range(clients)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        close_streams(sockets, stream_threads)
+    summary = summarize(results, elapsed, clients)
+    summary['streams'] = opened
+    return summary
+
+
+def _percentile(times, fraction):
+    return round(times[min(len(times) - 1, int(len(times) * fraction))], 1) if times else None
+
+
+def summarize(results, elapsed, clients):
+    times = sorted(ms for _, ms, ok in results if ok)
+    by_route = {}
+    for name, ms, ok in results:
+        by_route.setdefault(name, []).append(ms)
+    return {
+        'clients': clients,
+        'requests': len(results),
+        'errors': sum(1 for _, _, ok in results if not ok),
+        'req_per_s': round(len(results) / elapsed, 1),
+        'mean_ms': round(statistics.mean(times), 1) if times else None,
+        'p50_ms': round(statistics.median(times), 1) if times else None,
+        'p95_ms': _percentile(times, 0.95),
+        'p99_ms': _percentile(times, 0.99),
+        'routes': {name: {'requests': len(values), 'p50_ms': round(statistics.median(values), 1),
+                          'p95_ms': _percentile(sorted(values), 0.95)}
+                   for name, values in sorted(by_route.items())},
+    }
+
+
+def print_summary(label, summary):
+    streams = f", {summary['streams']} event streams" if summary.get('streams') else ''
+    print(f"\n{label}: {summary['clients']} clients{streams}, {summary['requests']} requests, "
+          f"{summary['errors']} errors")
+    print(f"  {summary['req_per_s']} req/s  mean {summary['mean_ms']} ms  p50 {summary['p50_ms']} ms  "
+          f"p95 {summary['p95_ms']} ms  p99 {summary['p99_ms']} ms")
+    for name, route in summary['routes'].items():
+        print(f"  {name:<20} {route['requests']:>7}  p50 {route['p50_ms']:>8} ms  p95 {route['p95_ms']:>8} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive concurrent load against the map server.')
+    parser.add_argument('--url', help='server to load (default: start one with --server)')
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), action='append',
+                        help='start this server on port 5000 and load it (repeatable)')
+    parser.add_argument('--db', default='data/targets.db', help='database for --server (default: data/targets.db)')
+    parser.add_argument('--clients', type=int, action='append',
+                        help='concurrent clients (repeatable, default: 16)')
+    parser.add_argument('--streams', type=int, default=0,
+                        help='/api/events streams held open during each run (default: 0)')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per run (default: 20)')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of single-client warm-up (default: 2)')
+    parser.add_argument('--route', action='append', help='route name from benchmark.py (repeatable, default: a mix)')
+    parser.add_argument('--json', metavar='FILE', help='also write the results as JSON')
+    args = parser.parse_args()
+    if not args.url and not args.server:
+        parser.error('give --url or --server')
+
+    requests = _requests(args.route or MIX)
+    clients = args.clients or [16]
+    report = []
+    for kind in args.server or [None]:
+        process = start_server(kind, args.db) if kind else None
+        try:
+            for count in clients:
+                summary = run_load(SERVER_URL if kind else args.url, requests, count,
+                                   args.duration, args.warmup, args.streams)
+                summary['server'] = kind or args.url
+                print_summary(summary['server'], summary)
+                report.append(summary)
+        finally:
+            if process is not None:
+                stop_server(process)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,342 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from flask import g, has_request_context, request
+
+import db
+
+# In-process request and SQL metrics, rendered as Prometheus text at /metrics.
+# Every worker process keeps its own numbers; scrape each worker (or sum them
+# in Prometheus) when running several. Set TARGETS_METRICS=0 to turn it off.
+METRICS_ENABLED = os.environ.get('TARGETS_METRICS', '1').lower() not in ('0', 'false', 'no')
+
+# Requests slower than this many milliseconds keep a sampled stack profile
+# (0 = profiler off), sampled every PROFILE_INTERVAL_MS
+PROFILE_SLOW_MS = float(os.environ.get('TARGETS_PROFILE_SLOW_MS', 0))
+PROFILE_INTERVAL_MS = float(os.environ.get('TARGETS_PROFILE_INTERVAL_MS', 5))
+PROFILES_KEPT = 20
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# Distinct SQL texts get their own label up to this many; the rest (ad hoc
+# queries from the DB manager, mostly) share the label 'other'
+MAX_STATEMENT_LABELS = 200
+STATEMENT_LABEL_LENGTH = 80
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+
+
+class CounterMetric(Metric):
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_labels(self.labelnames, key)} {value}' for key, value in values]
+
+
+class GaugeMetric(CounterMetric):
+    type = 'gauge'
+
+
+class HistogramMetric(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts + [count]):
+                cumulative = count if bound == '+Inf' else cumulative + bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+REQUESTS = CounterMetric('http_requests_total', 'Requests by route, method and status.',
+                         ('route', 'method', 'status'))
+LATENCY = HistogramMetric('http_request_duration_seconds', 'Time from request start to the last byte produced.',
+                          ('route', 'method'))
+IN_FLIGHT = GaugeMetric('http_requests_in_flight', 'Requests being served.')
+RESPONSE_BYTES = HistogramMetric('http_response_bytes', 'Response body size.', ('route',), BYTES_BUCKETS)
+REQUEST_SQL_SECONDS = CounterMetric('http_request_sql_seconds_total', 'Time spent in SQLite per route.', ('route',))
+REQUEST_SQL_STATEMENTS = CounterMetric('http_request_sql_statements_total', 'SQL statements run per route.', ('route',))
+REQUEST_SQL_ROWS = HistogramMetric('http_request_sql_rows', 'Rows fetched from SQLite per request.',
+                                   ('route',), ROWS_BUCKETS)
+STATEMENT_SECONDS = HistogramMetric('sql_statement_duration_seconds',
+                                    'Time to execute a statement up to its first row.', ('statement',))
+STATEMENT_FETCH_SECONDS = CounterMetric('sql_statement_fetch_seconds_total',
+                                        'Time spent fetching result rows.', ('statement',))
+STATEMENT_ROWS = CounterMetric('sql_statement_rows_total', 'Result rows fetched.', ('statement',))
+SLOW_PROFILED = CounterMetric('http_slow_requests_profiled_total', 'Slow requests with a stored profile.', ('route',))
+
+ALL_METRICS = [
+    REQUESTS, LATENCY, IN_FLIGHT, RESPONSE_BYTES, REQUEST_SQL_SECONDS, REQUEST_SQL_STATEMENTS,
+    REQUEST_SQL_ROWS, STATEMENT_SECONDS, STATEMENT_FETCH_SECONDS, STATEMENT_ROWS, SLOW_PROFILED,
+]
+
+
+def render():
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class StatementObserver:
+    # Installed with db.set_statement_observer(); gets called by the metered
+    # cursors of pooled connections and charges the current request too
+
+    def __init__(self):
+        self._labels = {}
+        self._lock = threading.Lock()
+
+    def label(self, sql):
+        label = self._labels.get(sql)
+        if label is None:
+            label = re.sub(r'\s+', ' ', sql).strip()[:STATEMENT_LABEL_LENGTH]
+            with self._lock:
+                if len(self._labels) < MAX_STATEMENT_LABELS:
+                    self._labels[sql] = label
+                else:
+                    label = 'other'
+        return label
+
+    def statement(self, sql, seconds):
+        STATEMENT_SECONDS.observe((self.label(sql),), seconds)
+        stats = _request_stats()
+        if stats is not None:
+            stats['sql_seconds'] += seconds
+            stats['statements'] += 1
+
+    def rows(self, sql, count, seconds):
+        label = (self.label(sql),)
+        STATEMENT_ROWS.inc(label, count)
+        STATEMENT_FETCH_SECONDS.inc(label, seconds)
+        stats = _request_stats()
+        if stats is not None:
+            stats['sql_seconds'] += seconds
+            stats['rows'] += count
+
+
+def _request_stats():
+    if not has_request_context():
+        return None
+    return g.get('_metrics')
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+class StreamedBody:
+    # Streamed bodies have no length up front and usually outlive the request
+    # context: count them on the way out and finish the request when the
+    # server closes the body (also when it was never read to the end)
+
+    def __init__(self, body, stats):
+        self._body = body
+        self._stats = stats
+        self._size = 0
+        self._closed = False
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._size += len(chunk)
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            RESPONSE_BYTES.observe((self._stats['route'],), self._size)
+            _finish_request(self._stats)
+
+
+def _finish_request(stats, exc=None):
+    if stats.get('finished'):
+        return
+    stats['finished'] = True
+    seconds = time.perf_counter() - stats['started']
+    route = stats['route']
+    status = 500 if exc is not None else stats['status'] or 500
+    IN_FLIGHT.inc(amount=-1)
+    REQUESTS.inc((route, stats['method'], str(status)))
+    LATENCY.observe((route, stats['method']), seconds)
+    REQUEST_SQL_SECONDS.inc((route,), stats['sql_seconds'])
+    REQUEST_SQL_STATEMENTS.inc((route,), stats['statements'])
+    REQUEST_SQL_ROWS.observe((route,), stats['rows'])
+    if profiler is not None:
+        profiler.stop(stats, seconds)
+
+
+class SlowRequestProfiler:
+    # Samples the stacks of in-flight requests from a background thread and
+    # keeps the collapsed stacks ("outer;inner;leaf count", the flame graph
+    # input format) of those that end up slower than PROFILE_SLOW_MS
+
+    def __init__(self, slow_ms, interval_ms, kept=PROFILES_KEPT):
+        self.slow_ms = slow_ms
+        self.interval = interval_ms / 1000
+        self.profiles = deque(maxlen=kept)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        # One sampler per process; threads do not survive fork()
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._active = {}
+            threading.Thread(target=self._run, name='slow-request-profiler', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in active.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame, depth=64):
+        names = []
+        while frame is not None and len(names) < depth:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def start(self):
+        self._ensure_started()
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def stop(self, stats, seconds):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if samples is None or seconds * 1000 < self.slow_ms:
+            return
+        self.profiles.append({
+            'route': stats['route'],
+            'method': stats['method'],
+            'path': stats['path'],
+            'duration_ms': round(seconds * 1000, 1),
+            'samples': sum(samples.values()),
+            'stacks': [f'{stack} {count}' for stack, count in samples.most_common(50)],
+        })
+        SLOW_PROFILED.inc((stats['route'],))
+        print(f"Slow request profiled: {stats['method']} {stats['path']} took {seconds * 1000:.0f} ms")
+
+
+profiler = SlowRequestProfiler(PROFILE_SLOW_MS, PROFILE_INTERVAL_MS) if PROFILE_SLOW_MS > 0 else None
+
+
+def init_app(app):
+    if not METRICS_ENABLED:
+        return
+    db.set_statement_observer(StatementObserver())
+
+    @app.before_request
+    def start_request_metrics():
+        g._metrics = {
+            'started': time.perf_counter(), 'route': _route(), 'method': request.method,
+            'path': request.full_path.rstrip('?'), 'status': None, 'streamed': False,
+            'sql_seconds': 0.0, 'statements': 0, 'rows': 0,
+        }
+        IN_FLIGHT.inc(amount=1)
+        if profiler is not None:
+            profiler.start()
+
+    @app.after_request
+    def record_response_metrics(response):
+        stats = _request_stats()
+        if stats is None:
+            return response
+        stats['status'] = response.status_code
+        if response.is_streamed:
+            stats['streamed'] = True
+            response.response = StreamedBody(response.response, stats)
+        else:
+            RESPONSE_BYTES.observe((stats['route'],), response.content_length or 0)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        stats = _request_stats()
+        if stats is None:
+            return
+        if stats['streamed']:
+            # Finished by StreamedBody.close(). The generator may still run
+            # SQL in this context (stream_with_context), so the stats stay on
+            # g; an error in it ends the stream early and counts as a 500
+            if exc is not None and not isinstance(exc, GeneratorExit):
+                stats['status'] = 500
+            return
+        g.pop('_metrics', None)
+        _finish_request(stats, exc)
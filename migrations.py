@@ -0,0 +1,184 @@
+import argparse
+import sqlite3
+
+from db import connect
+
+# Versioned schema changes, tracked in PRAGMA user_version. Each migration
+# runs in its own write transaction together with the version bump, so a
+# database is always at exactly one version, and concurrent workers starting
+# at once apply each step only once. Append new steps; never edit old ones.
+
+# 'Not Contacted', 'not contacted ' and NULL all mean the same column on the
+# kanban board; status_key is that normalized, never-null form
+def status_key_sql(column):
+    return (
+        f"CASE WHEN trim(COALESCE({column}, '')) = '' THEN 'not-contacted' "
+        f"ELSE lower(replace(trim({column}), ' ', '-')) END"
+    )
+
+
+STATUS_KEY_SQL = status_key_sql('status')
+
+
+def normalize_status(status):
+    # Python twin of STATUS_KEY_SQL
+    status = (status or '').strip()
+    return status.lower().replace(' ', '-') if status else 'not-contacted'
+
+
+def _baseline(conn):
+    # The tables that used to come with data/targets.db and schema.sql
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS targets (
+            organization TEXT PRIMARY KEY,
+            address TEXT,
+            region TEXT,
+            phone TEXT,
+            website TEXT,
+            notes TEXT,
+            drive_radius TEXT,
+            population INTEGER,
+            households INTEGER,
+            median_income INTEGER,
+            latitude REAL,
+            longitude REAL,
+            status TEXT DEFAULT 'not contacted',
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS zip_data (
+            zip_code TEXT PRIMARY KEY,
+            geographic_area TEXT,
+            households INTEGER,
+            total_pop INTEGER,
+            median_income REAL,
+            latitude REAL,
+            longitude REAL,
+            grade TEXT,
+            cluster_a_5mi TEXT,
+            cluster_a_10mi TEXT,
+            cluster_ab_5mi TEXT,
+            cluster_ab_10mi TEXT,
+            cluster_abc_5mi TEXT,
+            cluster_abc_10mi TEXT,
+            cluster_bc_5mi TEXT,
+            cluster_bc_10mi TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            target_id TEXT NOT NULL,  -- Organization name as the target identifier
+            content TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (target_id) REFERENCES targets(organization)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS activity_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            organization TEXT,
+            old_status TEXT,
+            new_status TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (organization) REFERENCES targets(organization)
+        )
+    ''')
+
+
+def _indexes(conn):
+    # Notes of one target, newest first; activity log, newest first; the
+    # region join/filter used by grades and exports
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notes_target_timestamp ON notes (target_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_activity_log_timestamp ON activity_log (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_activity_log_organization ON activity_log (organization, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_targets_region ON targets (region)')
+
+
+def _status_key(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_xinfo(targets)')}
+    if 'status_key' not in columns:
+        conn.execute(
+            'ALTER TABLE targets ADD COLUMN status_key TEXT NOT NULL '
+            f'GENERATED ALWAYS AS ({STATUS_KEY_SQL}) VIRTUAL'
+        )
+    # Covers the per-status listings without touching the table for the key
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_targets_status_key ON targets (status_key, organization)')
+    # The dashboard totals now group on status_key; ensure_dashboard_summary()
+    # recreates these triggers and rebuilds the totals
+    for name in ('summary_targets_insert', 'summary_targets_delete', 'summary_targets_update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def _activity_status_keys(conn):
+    # Normalized forms of the logged statuses, for filtering the log by status
+    # and for the pipeline rollups (pipeline_stats.py)
+    columns = {row[1] for row in conn.execute('PRAGMA table_xinfo(activity_log)')}
+    for column in ('old_status', 'new_status'):
+        if f'{column}_key' not in columns:
+            conn.execute(
+                f'ALTER TABLE activity_log ADD COLUMN {column}_key TEXT NOT NULL '
+                f'GENERATED ALWAYS AS ({status_key_sql(column)}) VIRTUAL'
+            )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_activity_log_new_status_key ON activity_log (new_status_key, timestamp)'
+    )
+
+
+MIGRATIONS = [
+    (1, 'baseline tables', _baseline),
+    (2, 'indexes for notes, activity log and region lookups', _indexes),
+    (3, 'normalized status_key column and index', _status_key),
+    (4, 'normalized activity_log status keys and index', _activity_status_keys),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION, verbose=True):
+    # Bring the database up to `target`; returns the versions applied
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version > target:
+            break
+        if schema_version(conn) >= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have got here first
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(version)
+        if verbose:
+            print(f"Applied migration {version}: {description}")
+    return applied
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create or upgrade the targets database schema.')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    parser.add_argument('--to', type=int, default=LATEST_VERSION, help='target schema version (default: latest)')
+    parser.add_argument('--status', action='store_true', help='only print the current schema version')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        if not args.status:
+            migrate(conn, args.to)
+        print(f"Schema version {schema_version(conn)} (latest {LATEST_VERSION})")
+    finally:
+        conn.close()
@@ -0,0 +1,227 @@
+import argparse
+from collections import defaultdict
+
+from db import connect
+from migrations import status_key_sql
+
+# Pipeline rollups behind /api/dashboard/pipeline, maintained by a trigger on
+# activity_log so every logged status change (single, batch, scripts) is
+# counted once and the endpoint never reads the raw log:
+#   transition_daily  transitions per day and (old, new) status pair
+#   stage_entries     the stage each organization is in and since when
+#   stage_durations   time spent in a stage, per day it was left, status and
+#                     duration bucket (count and total seconds)
+# Statuses are normalized the same way as targets.status_key. A transition to
+# the stage an organization is already in does not restart its clock.
+PIPELINE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS transition_daily (
+        day TEXT NOT NULL,
+        old_status TEXT NOT NULL,
+        new_status TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (day, old_status, new_status)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stage_entries (
+        organization TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        entered_at TIMESTAMP NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stage_durations (
+        day TEXT NOT NULL,
+        status TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        total_seconds REAL NOT NULL,
+        PRIMARY KEY (day, status, bucket)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Upper bounds of the duration buckets, in days; the last bucket is open
+DURATION_BUCKET_DAYS = (1, 7, 30, 90)
+DURATION_BUCKET_LABELS = ['<1d', '1-7d', '7-30d', '30-90d', '>90d']
+
+_TIMESTAMP = "COALESCE(new.timestamp, CURRENT_TIMESTAMP)"
+# A timestamp SQLite cannot parse is counted under the current day
+_DAY = f"COALESCE(date({_TIMESTAMP}), date('now'))"
+_OLD_KEY = status_key_sql('new.old_status')
+_NEW_KEY = status_key_sql('new.new_status')
+_SECONDS = f"((julianday({_TIMESTAMP}) - julianday(s.entered_at)) * 86400.0)"
+_BUCKET = 'CASE ' + ' '.join(
+    f'WHEN {_SECONDS} < {days * 86400} THEN {i}' for i, days in enumerate(DURATION_BUCKET_DAYS)
+) + f' ELSE {len(DURATION_BUCKET_DAYS)} END'
+
+PIPELINE_TRIGGERS = {
+    'pipeline_activity_insert': ('AFTER INSERT ON activity_log', f'''
+        INSERT INTO transition_daily VALUES ({_DAY}, {_OLD_KEY}, {_NEW_KEY}, 1)
+        ON CONFLICT (day, old_status, new_status) DO UPDATE SET count = count + 1;
+
+        INSERT INTO stage_durations
+        SELECT {_DAY}, s.status, {_BUCKET}, 1, {_SECONDS}
+        FROM stage_entries s
+        WHERE s.organization = new.organization AND s.status <> {_NEW_KEY} AND {_SECONDS} >= 0
+        ON CONFLICT (day, status, bucket) DO UPDATE SET
+            count = count + 1,
+            total_seconds = total_seconds + excluded.total_seconds;
+
+        INSERT INTO stage_entries VALUES (new.organization, {_NEW_KEY}, {_TIMESTAMP})
+        ON CONFLICT (organization) DO UPDATE SET
+            status = excluded.status,
+            entered_at = excluded.entered_at
+        WHERE status <> excluded.status;
+    '''),
+}
+
+
+def ensure_pipeline_stats(conn):
+    built = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transition_daily'"
+    ).fetchone() is not None
+    for statement in PIPELINE_SCHEMA:
+        conn.execute(statement)
+    for name, (event, body) in PIPELINE_TRIGGERS.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+    # The log only grows, so the rollups are replayed from it just once
+    if not built:
+        rebuild_pipeline_stats(conn)
+
+
+def _bucket(seconds):
+    for i, days in enumerate(DURATION_BUCKET_DAYS):
+        if seconds < days * 86400:
+            return i
+    return len(DURATION_BUCKET_DAYS)
+
+
+def compute_pipeline_stats(conn):
+    # Replays the whole log in insertion order, exactly as the trigger does;
+    # SQLite does the date arithmetic and status keys so both agree
+    transitions = defaultdict(int)
+    entries = {}
+    durations = defaultdict(lambda: [0, 0.0])
+    for organization, old_key, new_key, timestamp, day, julian in conn.execute(f'''
+        SELECT organization, old_status_key, new_status_key, ts, {_DAY.replace(_TIMESTAMP, 'ts')}, julianday(ts)
+        FROM (SELECT *, COALESCE(timestamp, CURRENT_TIMESTAMP) AS ts FROM activity_log)
+        ORDER BY id
+    '''):
+        transitions[(day, old_key, new_key)] += 1
+        current = entries.get(organization)
+        if current is not None and current[0] != new_key:
+            if julian is not None and current[2] is not None and julian >= current[2]:
+                seconds = (julian - current[2]) * 86400.0
+                duration = durations[(day, current[0], _bucket(seconds))]
+                duration[0] += 1
+                duration[1] += seconds
+        if current is None or current[0] != new_key:
+            entries[organization] = (new_key, timestamp, julian)
+    entries = {organization: entry[:2] for organization, entry in entries.items()}
+    return dict(transitions), entries, {key: tuple(value) for key, value in durations.items()}
+
+
+def rebuild_pipeline_stats(conn):
+    transitions, entries, durations = compute_pipeline_stats(conn)
+    for table in ('transition_daily', 'stage_entries', 'stage_durations'):
+        conn.execute(f'DELETE FROM {table}')
+    conn.executemany('INSERT INTO transition_daily VALUES (?, ?, ?, ?)',
+                     [key + (count,) for key, count in transitions.items()])
+    conn.executemany('INSERT INTO stage_entries VALUES (?, ?, ?)',
+                     [(organization,) + entry for organization, entry in entries.items()])
+    conn.executemany('INSERT INTO stage_durations VALUES (?, ?, ?, ?, ?)',
+                     [key + value for key, value in durations.items()])
+
+
+def check_pipeline_stats(conn):
+    # Differences between the rollups and a replay of the log, as strings
+    transitions, entries, durations = compute_pipeline_stats(conn)
+    stored = (
+        {tuple(row[:3]): row[3] for row in conn.execute('SELECT * FROM transition_daily')},
+        {row[0]: (row[1], row[2]) for row in conn.execute('SELECT * FROM stage_entries')},
+        {tuple(row[:3]): (row[3], round(row[4])) for row in conn.execute('SELECT * FROM stage_durations')},
+    )
+    durations = {key: (count, round(seconds)) for key, (count, seconds) in durations.items()}
+    problems = []
+    for label, have, want in zip(('transition', 'stage', 'duration'), stored, (transitions, entries, durations)):
+        for key in sorted(set(have) | set(want), key=str):
+            if have.get(key) != want.get(key):
+                problems.append(f'{label} {key}: stored {have.get(key)}, replayed {want.get(key)}')
+    return problems
+
+
+def pipeline_report(conn, since, until):
+    # The /api/dashboard/pipeline payload for days since..until (inclusive)
+    transitions = conn.execute('''
+        SELECT old_status, new_status, SUM(count) AS count
+        FROM transition_daily WHERE day BETWEEN ? AND ?
+        GROUP BY old_status, new_status
+        ORDER BY count DESC, old_status, new_status
+    ''', (since, until)).fetchall()
+    daily = conn.execute('''
+        SELECT day, SUM(count) AS count
+        FROM transition_daily WHERE day BETWEEN ? AND ?
+        GROUP BY day ORDER BY day
+    ''', (since, until)).fetchall()
+
+    entered = defaultdict(int)
+    for row in transitions:
+        if row['old_status'] != row['new_status']:
+            entered[row['new_status']] += row['count']
+    current = {row[0]: row[1] for row in conn.execute('SELECT status, count FROM status_summary')}
+
+    time_in_stage = {}
+    for status, bucket, count, total_seconds in conn.execute('''
+        SELECT status, bucket, SUM(count), SUM(total_seconds)
+        FROM stage_durations WHERE day BETWEEN ? AND ?
+        GROUP BY status, bucket
+    ''', (since, until)):
+        stage = time_in_stage.setdefault(status, {
+            'count': 0, 'total_days': 0.0, 'buckets': dict.fromkeys(DURATION_BUCKET_LABELS, 0),
+        })
+        stage['count'] += count
+        stage['total_days'] += total_seconds / 86400
+        stage['buckets'][DURATION_BUCKET_LABELS[bucket]] += count
+    for stage in time_in_stage.values():
+        stage['avg_days'] = round(stage.pop('total_days') / stage['count'], 2)
+        # The bucket holding the median stay
+        running = 0
+        for label, count in stage['buckets'].items():
+            running += count
+            if running * 2 >= stage['count']:
+                stage['median_bucket'] = label
+                break
+
+    return {
+        'since': since,
+        'until': until,
+        'transitions': [dict(row) for row in transitions],
+        'daily': [dict(row) for row in daily],
+        'entered': dict(entered),
+        'current': current,
+        'time_in_stage': time_in_stage,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild or check the pipeline rollups.')
+    parser.add_argument('--check', action='store_true', help='only compare the rollups with a replay of the log')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        if args.check:
+            problems = check_pipeline_stats(conn)
+            for problem in problems:
+                print(problem)
+            print('Pipeline rollups are consistent' if not problems else f'{len(problems)} differences found')
+            raise SystemExit(1 if problems else 0)
+        ensure_pipeline_stats(conn)
+        rebuild_pipeline_stats(conn)
+        conn.commit()
+        print('Pipeline rollups rebuilt')
+    finally:
+        conn.close()
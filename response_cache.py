@@ -0,0 +1,93 @@
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, make_response, request
+
+from db import get_data_version
+
+CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_ENTRIES', 256))
+
+
+class ResponseCache:
+    # Serialized response bodies keyed by request, each tagged with the data
+    # version it was built from. Least recently used entries are evicted.
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['version'] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+def _cache_key(vary):
+    args = tuple(sorted(request.args.items(multi=True)))
+    headers = tuple(request.headers.get(name, '') for name in vary)
+    return (request.path, args, headers)
+
+
+def cached_response(view=None, vary=()):
+    # Serve GET responses from the cache while the data version is unchanged,
+    # with a strong content ETag so browsers can revalidate to a 304.
+    if view is None:
+        return functools.partial(cached_response, vary=vary)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Read the version first: anything written while the view runs bumps
+        # it again, so a body built from newer data is never served as older.
+        version = get_data_version()
+        key = _cache_key(vary)
+        entry = response_cache.get(key, version) if version else None
+
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            body = response.get_data()
+            entry = {
+                'version': version,
+                'etag': hashlib.blake2b(body, digest_size=16).hexdigest(),
+                'body': body,
+                'headers': [
+                    (name, value) for name, value in response.headers
+                    if name not in ('Content-Length', 'ETag')
+                ],
+            }
+            if version:
+                response_cache.put(key, entry)
+
+        if request.if_none_match.contains(entry['etag']):
+            response = make_response('', 304)
+        else:
+            response = current_app.response_class(entry['body'], headers=entry['headers'])
+        response.set_etag(entry['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        if vary:
+            response.vary.update(vary)
+        return response
+
+    return wrapper
@@ -1,8 +0,0 @@
--- Create notes table
-CREATE TABLE IF NOT EXISTS notes (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    target_id TEXT NOT NULL,  -- Organization name as the target identifier
-    content TEXT NOT NULL,
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (target_id) REFERENCES targets(organization)
-);
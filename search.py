@@ -0,0 +1,195 @@
+import argparse
+import html
+import re
+
+from db import connect
+
+# Full-text search over targets (organization, address, website) and notes
+# (content) with FTS5. Both indexes are external-content tables: they hold
+# only the index and read the text from targets/notes for snippets. Triggers
+# keep them in step with every writer; `prefix` adds prefix indexes so
+# typeahead queries ("west*") stay index lookups.
+SEARCH_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS targets_fts USING fts5(
+        organization, address, website,
+        content='targets', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS targets_fts_insert AFTER INSERT ON targets
+    BEGIN
+        INSERT INTO targets_fts (rowid, organization, address, website)
+        VALUES (new.rowid, new.organization, new.address, new.website);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS targets_fts_update AFTER UPDATE OF organization, address, website ON targets
+    BEGIN
+        INSERT INTO targets_fts (targets_fts, rowid, organization, address, website)
+        VALUES ('delete', old.rowid, old.organization, old.address, old.website);
+        INSERT INTO targets_fts (rowid, organization, address, website)
+        VALUES (new.rowid, new.organization, new.address, new.website);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS targets_fts_delete AFTER DELETE ON targets
+    BEGIN
+        INSERT INTO targets_fts (targets_fts, rowid, organization, address, website)
+        VALUES ('delete', old.rowid, old.organization, old.address, old.website);
+    END
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        content,
+        content='notes', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes
+    BEGIN
+        INSERT INTO notes_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF content ON notes
+    BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO notes_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes
+    BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    ''',
+]
+
+# bm25 column weights: a hit in the organization name outranks one in the
+# address, which outranks one in the website
+TARGET_RANK = 'bm25(10.0, 3.0, 1.0)'
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SNIPPET_TOKENS = 12
+
+# Snippet highlight markers; swapped for <mark> after HTML-escaping the text
+_OPEN, _CLOSE = '\x02', '\x03'
+
+TARGETS_SEARCH_QUERY = f'''
+    SELECT t.organization, t.address, t.website, t.status_key AS status,
+           t.latitude, t.longitude,
+           snippet(targets_fts, -1, '{_OPEN}', '{_CLOSE}', '…', {SNIPPET_TOKENS}) AS snippet,
+           f.rank
+    FROM targets_fts f
+    JOIN targets t ON t.rowid = f.rowid
+    WHERE targets_fts MATCH ?
+    ORDER BY f.rank
+    LIMIT ?
+'''
+NOTES_SEARCH_QUERY = f'''
+    SELECT n.id, n.target_id, n.timestamp,
+           snippet(notes_fts, 0, '{_OPEN}', '{_CLOSE}', '…', {SNIPPET_TOKENS}) AS snippet,
+           f.rank
+    FROM notes_fts f
+    JOIN notes n ON n.id = f.rowid
+    WHERE notes_fts MATCH ?
+    ORDER BY f.rank
+    LIMIT ?
+'''
+
+
+def _table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def ensure_search_index(conn):
+    targets_indexed = _table_exists(conn, 'targets_fts')
+    notes_indexed = _table_exists(conn, 'notes_fts')
+    for statement in SEARCH_SCHEMA:
+        conn.execute(statement)
+    # Each index is built once, when it is created; the triggers keep it in
+    # step from then on. targets has a TEXT primary key, so a VACUUM may
+    # renumber its rowids: run `python search.py --rebuild` after one.
+    if not targets_indexed:
+        _index_targets(conn)
+    if not notes_indexed:
+        conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+
+
+def _index_targets(conn):
+    conn.execute("INSERT INTO targets_fts (targets_fts, rank) VALUES ('rank', ?)", (TARGET_RANK,))
+    conn.execute("INSERT INTO targets_fts (targets_fts) VALUES ('rebuild')")
+
+
+def rebuild_search_index(conn):
+    _index_targets(conn)
+    conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+
+
+def match_expression(text):
+    # User text to an FTS5 query: every word must match, as a prefix once it
+    # is two characters or longer. Words are quoted, so FTS5 operators and
+    # punctuation in the input are taken literally.
+    terms = []
+    for word in text.split():
+        if not re.search(r'\w', word):
+            continue
+        quoted = '"' + word.replace('"', '""') + '"'
+        terms.append(quoted + '*' if len(word) >= 2 else quoted)
+    return ' '.join(terms)
+
+
+def _highlight(snippet):
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search(conn, text, limit=SEARCH_DEFAULT_LIMIT, kinds=('targets', 'notes')):
+    # {'targets': [...], 'notes': [...]}, best match first. Snippets are
+    # HTML-escaped with matches wrapped in <mark>.
+    expression = match_expression(text)
+    if not expression:
+        raise ValueError('Search text has no words')
+    limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+    result = {}
+    for kind, sql in (('targets', TARGETS_SEARCH_QUERY), ('notes', NOTES_SEARCH_QUERY)):
+        if kind not in kinds:
+            continue
+        rows = []
+        for row in conn.execute(sql, (expression, limit)):
+            row = dict(row)
+            row['snippet'] = _highlight(row['snippet'])
+            rows.append(row)
+        result[kind] = rows
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search targets and notes, or rebuild the search index.')
+    parser.add_argument('text', nargs='?', help='words to search for (prefix matches)')
+    parser.add_argument('--limit', type=int, default=SEARCH_DEFAULT_LIMIT)
+    parser.add_argument('--rebuild', action='store_true', help='rebuild both full-text indexes')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        ensure_search_index(conn)
+        if args.rebuild:
+            rebuild_search_index(conn)
+            print('Search index rebuilt')
+        conn.commit()
+        if args.text:
+            results = search(conn, args.text, args.limit)
+            for kind, rows in results.items():
+                print(f"{kind}: {len(rows)}")
+                for row in rows:
+                    name = row.get('organization') or row.get('target_id')
+                    print(f"  {row['rank']:8.2f}  {name}: {row['snippet']}")
+    finally:
+        conn.close()
@@ -1,19 +1,152 @@
-from flask import Flask, send_from_directory, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 import os
 import sqlite3
-import shutil
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import json
+from db import (
+    DB_PATH, ensure_data_version, get_read_connection, get_write_connection,
+    renew_data_epoch, reset_pools,
+)
+import backups
+import metrics
+from assets import asset_response, asset_store, page_response
+from changes import ensure_changes_table, get_changes
+from columnar import VARY_HEADERS, encode_rows, payload_response, wants_columnar
+from events import broker, ensure_events_table, publish
+from dashboard_summary import ensure_dashboard_summary, rebuild_summary, summary_response
+from db_query import DEFAULT_PAGE_SIZE, QueryError, run_query
+from geocode_cache import ensure_geocode_cache, geocode_cache
+from migrations import migrate, normalize_status
+from export_targets import EXPORT_FORMATS, export_filename, iter_export
+from response_cache import cached_response, response_cache
+from pipeline_stats import ensure_pipeline_stats, pipeline_report
+from search import SEARCH_DEFAULT_LIMIT, ensure_search_index, rebuild_search_index, search
+from spatial import (
+    ensure_cluster_grid, ensure_spatial_index, parse_bbox, query_clusters, query_targets_in_bbox,
+    query_within_radius, rebuild_cluster_grid, rebuild_spatial_index, snap_bbox,
+)
+from zip_clusters import MIN_CLUSTER_SIZE, MIN_NEIGHBORS, run_clustering
 
-app = Flask(__name__, static_folder='.', static_url_path='')
+# Static files and pages are served by assets.py, from a whitelist
+app = Flask(__name__, static_folder=None)
+
+NEARBY_MAX_RADIUS_MI = 100.0
+STATUS_BATCH_MAX = 5000
+# Organizations looked up per IN (...) query; stays under SQLite's variable limit
+STATUS_LOOKUP_CHUNK = 500
+ACTIVITY_LOG_DEFAULT_LIMIT = 50
+ACTIVITY_LOG_MAX_LIMIT = 500
+PIPELINE_DEFAULT_DAYS = 90
+
+TARGET_COLUMNS = '''
+    t.organization, t.address, t.phone, t.website, t.population,
+    t.median_income, t.status, t.latitude, t.longitude,
+    z.grade
+'''
+
+# Queries with a dedicated index; check_query_plans.py asserts they use it
+NOTES_QUERY = 'SELECT * FROM notes WHERE target_id = ? ORDER BY timestamp DESC'
+STATUS_DETAILS_QUERY = '''
+    SELECT 
+        t.organization,
+        t.address,
+        t.population,
+        t.median_income,
+        t.latitude,
+        t.longitude,
+        z.grade
+    FROM targets t
+    LEFT JOIN zip_data z ON t.region = z.zip_code
+    WHERE t.status_key = ?
+    ORDER BY t.organization
+'''
+
+def activity_log_query(organization=None, status=None, before=None, limit=ACTIVITY_LOG_DEFAULT_LIMIT):
+    # Newest entries first, a page at a time. `before` is the (timestamp, id)
+    # of the last entry already shown: the next page starts right after it
+    # in the index instead of skipping over an OFFSET. The organization and
+    # status filters each have an index ordered by timestamp.
+    conditions, params = [], []
+    if organization is not None:
+        conditions.append('organization = ?')
+        params.append(organization)
+    if status is not None:
+        conditions.append('new_status_key = ?')
+        params.append(normalize_status(status))
+    if before is not None:
+        conditions.append('timestamp <= ? AND (timestamp < ? OR id < ?)')
+        params.extend([before[0], before[0], before[1]])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    sql = f'''
+        SELECT id, organization, old_status, new_status, timestamp
+        FROM activity_log {where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    '''
+    return sql, params + [limit]
 
 def get_db_connection():
-    conn = sqlite3.connect('data/targets.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_write_connection()
+
+def prepare_schema(conn):
+    # Creates what is missing; derived tables are built only when they are
+    # first created, after that their triggers keep them in step
+    migrate(conn)
+    ensure_data_version(conn)
+    ensure_spatial_index(conn)
+    ensure_cluster_grid(conn)
+    ensure_changes_table(conn)
+    ensure_events_table(conn)
+    ensure_geocode_cache(conn)
+    ensure_dashboard_summary(conn)
+    ensure_pipeline_stats(conn)
+    ensure_search_index(conn)
+
+def ensure_db_schema():
+    if not os.path.exists(DB_PATH):
+        return
+    conn = get_db_connection()
+    try:
+        prepare_schema(conn)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error preparing database schema: {e}")
+    finally:
+        conn.close()
+
+def rebuild_derived_tables(conn):
+    # Recomputes the trigger-maintained tables from scratch
+    rebuild_spatial_index(conn)
+    rebuild_cluster_grid(conn)
+    rebuild_summary(conn)
+    rebuild_search_index(conn)
+
+def prepare_restored_schema(conn):
+    # Runs on the staged copy before it goes live. A backup or an uploaded
+    # file may have been VACUUMed or edited without our triggers, so its
+    # derived tables are rebuilt there, off the live database, and the new
+    # data epoch arrives together with the data
+    prepare_schema(conn)
+    rebuild_derived_tables(conn)
+    renew_data_epoch(conn)
+
+def reopen_database():
+    # The live database was swapped: retire pooled handles (in-flight ones
+    # close when their request ends) and forget cached responses
+    reset_pools()
+    response_cache.clear()
+    geocode_cache.clear()
+
+ensure_db_schema()
+metrics.init_app(app)
+asset_store.load()
 
 @app.after_request
 def after_request(response):
+    # CORS for the API only; pages and static files are same-origin
+    if not request.path.startswith('/api/'):
+        return response
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
@@ -21,49 +154,64 @@ def after_request(response):
 
 @app.route('/')
 def root():
-    return send_from_directory('.', 'index_db.html')
+    return page_response('index_db.html')
 
 @app.route('/index_db.html')
 def index_db():
-    return send_from_directory('.', 'index_db.html')
+    return page_response('index_db.html')
 
 @app.route('/kanban.html')
 def kanban():
-    return send_from_directory('.', 'kanban.html')
+    return page_response('kanban.html')
 
 @app.route('/dashboard')
 def dashboard():
-    return send_from_directory('.', 'dashboard.html')
+    return page_response('dashboard.html')
+
+@app.route('/static/<path:filename>')
+def static_file(filename):
+    return asset_response(filename)
 
 @app.route('/api/targets')
+@cached_response(vary=VARY_HEADERS)
 def get_targets():
     conn = None
     try:
+        # Optional viewport: bbox=west,south,east,north[&zoom=N]
+        try:
+            bbox = parse_bbox(request.args.get('bbox'))
+            zoom = request.args.get('zoom', type=int)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if bbox and zoom is not None:
+            bbox = snap_bbox(bbox, zoom)
+
         # First, let's check if the database file exists
-        if not os.path.exists('data/targets.db'):
+        if not os.path.exists(DB_PATH):
             print("Database file not found!")
             return jsonify({'error': 'Database file not found'}), 500
             
-        conn = get_db_connection()
+        conn = get_read_connection()
         
-        # First, let's count how many records we have
-        count = conn.execute('SELECT COUNT(*) FROM targets').fetchone()[0]
-        print(f"Total records in targets table: {count}")
+        if bbox:
+            # Only the targets inside the viewport, via the R*Tree
+            targets = query_targets_in_bbox(
+                conn, TARGET_COLUMNS, bbox,
+                join='LEFT JOIN zip_data z ON t.region = z.zip_code'
+            )
+        else:
+            targets = conn.execute(f'''
+                SELECT {TARGET_COLUMNS}
+                FROM targets t
+                LEFT JOIN zip_data z ON t.region = z.zip_code
+            ''').fetchall()
         
-        # Now get the actual data
-        targets = conn.execute('''
-            SELECT t.organization, t.address, t.phone, t.website, t.population, 
-                   t.median_income, t.status, t.latitude, t.longitude,
-                   z.grade
-            FROM targets t
-            LEFT JOIN zip_data z ON t.region = z.zip_code
-        ''').fetchall()
+        print(f"Number of targets returned: {len(targets)}")
         
-        # Convert to list for debugging
-        result = [dict(row) for row in targets]
-        print(f"Number of targets returned: {len(result)}")
-        
-        if len(result) == 0:
+        if len(targets) == 0 and not bbox:
+            count = conn.execute('SELECT COUNT(*) FROM targets').fetchone()[0]
+            print(f"Total records in targets table: {count}")
+            
             # Let's check what tables exist
             tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
             print(f"Tables in database: {[t[0] for t in tables]}")
@@ -80,7 +228,8 @@ def get_targets():
             except Exception as e:
                 print(f"Error getting sample data: {e}")
         
-        return jsonify(result)
+        # Row objects, or columns with ?format=columnar; compressed if accepted
+        return payload_response(encode_rows(targets))
     except sqlite3.Error as e:
         print(f"SQLite error: {e}")
         return jsonify({'error': f'Database error: {str(e)}'}), 500
@@ -91,9 +240,75 @@ def get_targets():
         if conn:
             conn.close()
 
+@app.route('/api/targets/changes')
+def get_target_changes():
+    # ?since=<version from the previous response>; omit it for a full load,
+    # or pass since=latest for just the current version
+    since = request.args.get('since', '')
+    limit = request.args.get('limit', 5000, type=int)
+    conn = get_read_connection()
+    try:
+        changes = get_changes(
+            conn, TARGET_COLUMNS, since, limit=max(1, min(limit, 5000)),
+            join='LEFT JOIN zip_data z ON t.region = z.zip_code',
+            columnar=wants_columnar(),
+        )
+        return payload_response(changes)
+    except Exception as e:
+        print(f"Error getting target changes: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/map_clusters')
+@cached_response
+def get_map_clusters():
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+        zoom = request.args.get('zoom', type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not bbox or zoom is None:
+        return jsonify({'error': 'bbox and zoom are required'}), 400
+
+    conn = get_read_connection()
+    try:
+        clusters = query_clusters(conn, bbox, zoom)
+        return jsonify(clusters)
+    except Exception as e:
+        print(f"Error getting map clusters: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/export/targets')
+def export_targets_route():
+    # ?format=csv|ndjson&gzip=1&status=...&region=... (status/region repeatable)
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unknown export format: {fmt}'}), 400
+    statuses = request.args.getlist('status')
+    regions = request.args.getlist('region')
+
+    def generate():
+        conn = get_read_connection()
+        try:
+            yield from iter_export(conn, fmt, compress, statuses, regions)
+        finally:
+            conn.close()
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename={export_filename(fmt, compress)}'
+    return response
+
 @app.route('/api/kanban_data')
+@cached_response
 def get_kanban_data():
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
         cursor = conn.cursor()
         cursor.execute('''
@@ -101,7 +316,7 @@ def get_kanban_data():
                 t.organization,
                 t.address,
                 t.phone,
-                COALESCE(t.status, 'not-contacted') as status,
+                t.status_key as status,
                 t.population,
                 t.median_income,
                 z.grade
@@ -127,6 +342,48 @@ def get_kanban_data():
     finally:
         conn.close()
 
+def apply_status_updates(conn, updates):
+    # Applies [(organization, status)] inside the caller's write transaction:
+    # one lookup per chunk of organizations, executemany for the updates and
+    # their activity_log rows (triggers keep the derived tables in step).
+    # Returns one result per update, in order, plus the applied
+    # (organization, old_status, new_status) transitions.
+    organizations = list(dict.fromkeys(organization for organization, _ in updates))
+    current = {}
+    for i in range(0, len(organizations), STATUS_LOOKUP_CHUNK):
+        chunk = organizations[i:i + STATUS_LOOKUP_CHUNK]
+        rows = conn.execute(f'''
+            SELECT organization, status FROM targets
+            WHERE organization IN ({','.join('?' * len(chunk))})
+        ''', chunk)
+        for row in rows:
+            current[row['organization']] = dict(row)
+
+    results = []
+    applied = []
+    for organization, new_status in updates:
+        target = current.get(organization)
+        if target is None:
+            results.append({'organization': organization, 'success': False, 'error': 'Organization not found'})
+            continue
+        # A later update of the same organization starts from this one
+        old_status = target['status']
+        target['status'] = new_status
+        applied.append((organization, old_status, new_status))
+        results.append({'organization': organization, 'success': True,
+                        'old_status': old_status, 'new_status': new_status})
+
+    conn.executemany('''
+        UPDATE targets
+        SET status = ?, last_updated = CURRENT_TIMESTAMP
+        WHERE organization = ?
+    ''', [(new_status, organization) for organization, _, new_status in applied])
+    conn.executemany('''
+        INSERT INTO activity_log (organization, old_status, new_status)
+        VALUES (?, ?, ?)
+    ''', applied)
+    return results, applied
+
 @app.route('/api/update_status', methods=['POST'])
 def update_status():
     data = request.json
@@ -138,31 +395,22 @@ def update_status():
 
     conn = get_db_connection()
     try:
-        # Get current status
-        current = conn.execute(
-            'SELECT status FROM targets WHERE organization = ?',
-            (organization,)
-        ).fetchone()
+        # Take the write lock up front so the old status we read stays current
+        conn.execute('BEGIN IMMEDIATE')
         
-        if not current:
+        results, _ = apply_status_updates(conn, [(organization, new_status)])
+        if not results[0]['success']:
+            conn.rollback()
             return jsonify({'error': 'Organization not found'}), 404
         
-        old_status = current[0]
-        
-        # Update status
-        conn.execute('''
-            UPDATE targets 
-            SET status = ?, last_updated = CURRENT_TIMESTAMP 
-            WHERE organization = ?
-        ''', (new_status, organization))
-        
-        # Log the change
-        conn.execute('''
-            INSERT INTO activity_log (organization, old_status, new_status)
-            VALUES (?, ?, ?)
-        ''', (organization, old_status, new_status))
-        
+        old_status = results[0]['old_status']
+        publish(conn, 'status', {
+            'organization': organization,
+            'old_status': old_status,
+            'new_status': new_status,
+        })
         conn.commit()
+        broker.wake()
         print(f"Updated status for {organization}: {old_status} -> {new_status}")
         return jsonify({'success': True, 'old_status': old_status, 'new_status': new_status})
     
@@ -173,9 +421,65 @@ def update_status():
     finally:
         conn.close()
 
+@app.route('/api/update_status/batch', methods=['POST'])
+def update_status_batch():
+    # {"updates": [{"organization": ..., "status": ...}, ...]} (or the bare
+    # list): all in one transaction and one commit, with one combined
+    # 'status' event. Unknown or incomplete items fail on their own.
+    data = request.get_json(silent=True)
+    items = data.get('updates') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a list of {organization, status} updates'}), 400
+    if len(items) > STATUS_BATCH_MAX:
+        return jsonify({'error': f'At most {STATUS_BATCH_MAX} updates per batch'}), 400
+
+    results = [None] * len(items)
+    positions = []
+    updates = []
+    for i, item in enumerate(items):
+        organization = item.get('organization') if isinstance(item, dict) else None
+        new_status = item.get('status') if isinstance(item, dict) else None
+        if not organization or not new_status:
+            results[i] = {'organization': organization, 'success': False,
+                          'error': 'Missing organization or status'}
+            continue
+        positions.append(i)
+        updates.append((organization, new_status))
+
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        applied_results, applied = apply_status_updates(conn, updates)
+        for i, result in zip(positions, applied_results):
+            results[i] = result
+        if applied:
+            publish(conn, 'status', {
+                'changes': [
+                    {'organization': organization, 'old_status': old_status, 'new_status': new_status}
+                    for organization, old_status, new_status in applied
+                ],
+            })
+        conn.commit()
+        if applied:
+            broker.wake()
+        print(f"Batch status update: {len(applied)} of {len(items)} applied")
+        return jsonify({
+            'success': True,
+            'updated': len(applied),
+            'failed': len(items) - len(applied),
+            'results': results,
+        })
+    except Exception as e:
+        conn.rollback()
+        print(f"Error in batch status update: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
 @app.route('/api/zips')
+@cached_response(vary=VARY_HEADERS)
 def get_zips():
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
         zips = conn.execute('''
             SELECT zip_code, geographic_area, households, total_pop,
@@ -186,17 +490,117 @@ def get_zips():
             FROM zip_data
             WHERE latitude IS NOT NULL AND longitude IS NOT NULL
         ''').fetchall()
-        print(f"Retrieved {len([dict(row) for row in zips])} ZIP codes")
-        return jsonify([dict(row) for row in zips])
+        print(f"Retrieved {len(zips)} ZIP codes")
+        return payload_response(encode_rows(zips))
     except Exception as e:
         print(f"Error getting ZIP data: {e}")
         return str(e), 500
     finally:
         conn.close()
 
+@app.route('/api/search')
+@cached_response
+def search_targets_and_notes():
+    # ?q=words&limit=N&type=targets|notes : ranked full-text matches, each
+    # word matched as a prefix, with highlighted snippets
+    text = request.args.get('q', '').strip()
+    kind = request.args.get('type', 'all')
+    if kind not in ('all', 'targets', 'notes'):
+        return jsonify({'error': 'type must be all, targets or notes'}), 400
+    kinds = ('targets', 'notes') if kind == 'all' else (kind,)
+    limit = request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int)
+
+    conn = get_read_connection()
+    try:
+        results = search(conn, text, limit, kinds)
+        return jsonify({'query': text, **results})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error searching: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/nearby')
+def get_nearby():
+    # ?lat=&lng=&radius_mi= : targets and ZIPs within the radius, with
+    # demographic totals over those ZIPs
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    radius_mi = request.args.get('radius_mi', 5.0, type=float)
+    if lat is None or lng is None or not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        return jsonify({'error': 'lat and lng are required'}), 400
+    if not 0 < radius_mi <= NEARBY_MAX_RADIUS_MI:
+        return jsonify({'error': f'radius_mi must be between 0 and {NEARBY_MAX_RADIUS_MI:g}'}), 400
+
+    conn = get_read_connection()
+    try:
+        targets = []
+        for miles, row in query_within_radius(
+            conn, 'targets',
+            't.organization, t.address, t.region, t.status, t.latitude, t.longitude, z.grade',
+            lat, lng, radius_mi, join='LEFT JOIN zip_data z ON t.region = z.zip_code'
+        ):
+            target = dict(row)
+            target['distance_mi'] = round(miles, 2)
+            targets.append(target)
+
+        zips = []
+        population = households = income_pop = income_weighted = 0
+        for miles, row in query_within_radius(
+            conn, 'zip_data',
+            'z.zip_code, z.total_pop, z.households, z.median_income, z.grade, z.latitude, z.longitude',
+            lat, lng, radius_mi
+        ):
+            zip_row = dict(row)
+            zip_row['distance_mi'] = round(miles, 2)
+            zips.append(zip_row)
+            population += row['total_pop'] or 0
+            households += row['households'] or 0
+            if row['total_pop'] and row['median_income'] is not None:
+                income_pop += row['total_pop']
+                income_weighted += row['total_pop'] * row['median_income']
+
+        return jsonify({
+            'center': {'lat': lat, 'lng': lng},
+            'radius_mi': radius_mi,
+            'targets': targets,
+            'zips': zips,
+            'totals': {
+                'targets': len(targets),
+                'zips': len(zips),
+                'population': population,
+                'households': households,
+                # Population-weighted mean of the ZIP medians
+                'median_income': round(income_weighted / income_pop) if income_pop else None,
+            },
+        })
+    except Exception as e:
+        print(f"Error getting nearby data: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/geocode')
+def get_geocodes():
+    # ?zip=02139&zip=10001 (repeatable) or ?zips=02139,10001
+    zip_codes = request.args.getlist('zip')
+    zip_codes += [z for z in request.args.get('zips', '').split(',') if z]
+    if not zip_codes:
+        return jsonify({'error': 'zip is required'}), 400
+    if len(zip_codes) > 5000:
+        return jsonify({'error': 'At most 5000 ZIPs per request'}), 400
+    try:
+        return jsonify(geocode_cache.get_many(zip_codes))
+    except Exception as e:
+        print(f"Error looking up geocodes: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/clusters/<analysis_type>')
+@cached_response
 def get_clusters(analysis_type):
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
         cluster_col = f'cluster_{analysis_type.lower()}'
         
@@ -234,12 +638,39 @@ def get_clusters(analysis_type):
     finally:
         conn.close()
 
+@app.route('/api/db/zip_clusters', methods=['POST'])
+def recompute_zip_clusters():
+    # Recompute every zip_data cluster_* column from the current grades
+    data = request.get_json(silent=True) or {}
+    params = {}
+    for name, default in (('min_neighbors', MIN_NEIGHBORS), ('min_size', MIN_CLUSTER_SIZE)):
+        value = data.get(name, default)
+        # bool is an int subclass; true/false are not counts
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            return jsonify({'error': f'{name} must be a positive integer'}), 400
+        params[name] = value
+    dry_run = data.get('dry_run', False)
+    if not isinstance(dry_run, bool):
+        return jsonify({'error': 'dry_run must be true or false'}), 400
+    conn = get_db_connection()
+    try:
+        summary, _ = run_clustering(conn, dry_run=dry_run, **params)
+        conn.commit()
+        print(f"Recomputed ZIP clusters: {summary['updated']} rows updated in {summary['total_seconds']}s")
+        return jsonify(summary)
+    except Exception as e:
+        conn.rollback()
+        print(f"Error computing ZIP clusters: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
 @app.route('/api/notes/<path:target_id>', methods=['GET'])
 def get_notes(target_id):
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM notes WHERE target_id = ? ORDER BY timestamp DESC', (target_id,))
+        cursor.execute(NOTES_QUERY, (target_id,))
         notes = []
         for row in cursor.fetchall():
             notes.append({
@@ -277,12 +708,14 @@ def add_note():
             'INSERT INTO notes (target_id, content, timestamp) VALUES (?, ?, datetime("now", "localtime"))',
             (data['target_id'], data['content'])
         )
-        conn.commit()
         note_id = cursor.lastrowid
         
         # Get the newly created note
         cursor.execute('SELECT * FROM notes WHERE id = ?', (note_id,))
         note = dict(cursor.fetchone())
+        publish(conn, 'note_added', note)
+        conn.commit()
+        broker.wake()
         return jsonify(note)
     except Exception as e:
         print(f"Error adding note: {e}")
@@ -302,7 +735,9 @@ def delete_note(note_id):
             return jsonify({'error': 'Note not found'}), 404
             
         cursor.execute('DELETE FROM notes WHERE id = ?', (note_id,))
+        publish(conn, 'note_deleted', {'id': note_id, 'target_id': note['target_id']})
         conn.commit()
+        broker.wake()
         return jsonify({'success': True})
     except Exception as e:
         print(f"Error deleting note: {e}")
@@ -310,64 +745,91 @@ def delete_note(note_id):
     finally:
         conn.close()
 
+@app.route('/api/events')
+def stream_events():
+    # Server-Sent Events: status changes and note inserts/deletes
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    response = Response(
+        stream_with_context(broker.subscribe(last_event_id)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/activity_log', methods=['GET'])
 def get_activity_log():
-    conn = get_db_connection()
+    # ?limit=&organization=&status=, and for the next page the `next` cursor
+    # of the previous one: ?before_timestamp=&before_id= (the timestamp is
+    # looked up when only the id is given)
+    limit = request.args.get('limit', ACTIVITY_LOG_DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, ACTIVITY_LOG_MAX_LIMIT))
+    before_id = request.args.get('before_id', type=int)
+    before_timestamp = request.args.get('before_timestamp')
+    conn = get_read_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM activity_log ORDER BY timestamp DESC LIMIT 50')
+        before = None
+        if before_id is not None:
+            if before_timestamp is None:
+                row = cursor.execute('SELECT timestamp FROM activity_log WHERE id = ?', (before_id,)).fetchone()
+                if row is None:
+                    return jsonify({'error': f'No activity with id {before_id}'}), 400
+                before_timestamp = row['timestamp']
+            before = (before_timestamp, before_id)
+        sql, params = activity_log_query(
+            organization=request.args.get('organization'),
+            status=request.args.get('status'),
+            before=before,
+            limit=limit + 1,
+        )
+        cursor.execute(sql, params)
         activities = [dict(row) for row in cursor.fetchall()]
-        return jsonify(activities)
+        has_more = len(activities) > limit
+        del activities[limit:]
+        last = activities[-1] if has_more else None
+        return jsonify({
+            'activities': activities,
+            'has_more': has_more,
+            'next': {'before_timestamp': last['timestamp'], 'before_id': last['id']} if last else None,
+        })
     except Exception as e:
         print(f"Error getting activity log: {e}")
         return str(e), 500
     finally:
         conn.close()
 
+@app.route('/api/dashboard/pipeline')
+def get_dashboard_pipeline():
+    # Transitions, stage entries and time in stage for ?since=&until=
+    # (YYYY-MM-DD, inclusive; the last PIPELINE_DEFAULT_DAYS by default).
+    # Read from the rollups in pipeline_stats.py, never from activity_log.
+    # activity_log timestamps are UTC (CURRENT_TIMESTAMP), and so are the days
+    today = datetime.now(timezone.utc).date()
+    try:
+        until = datetime.strptime(request.args.get('until', today.isoformat()), '%Y-%m-%d').date()
+        default_since = until - timedelta(days=PIPELINE_DEFAULT_DAYS - 1)
+        since = datetime.strptime(request.args.get('since', default_since.isoformat()), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'since and until must be dates as YYYY-MM-DD'}), 400
+    if since > until:
+        return jsonify({'error': 'since is after until'}), 400
+    conn = get_read_connection()
+    try:
+        return jsonify(pipeline_report(conn, since.isoformat(), until.isoformat()))
+    except Exception as e:
+        print(f"Error getting pipeline stats: {e}")
+        return str(e), 500
+    finally:
+        conn.close()
+
 @app.route('/api/dashboard/summary')
+@cached_response
 def get_dashboard_summary():
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
-        cursor = conn.cursor()
-        
-        # Get status counts
-        cursor.execute('''
-            SELECT 
-                COALESCE(status, 'not-contacted') as status,
-                COUNT(*) as count,
-                SUM(population) as total_population,
-                AVG(median_income) as avg_income
-            FROM targets
-            GROUP BY COALESCE(status, 'not-contacted')
-        ''')
-        
-        status_summary = {}
-        for row in cursor.fetchall():
-            status_summary[row[0]] = {
-                'count': row[1],
-                'total_population': row[2],
-                'avg_income': row[3]
-            }
-            
-        # Get grade distribution
-        cursor.execute('''
-            SELECT 
-                z.grade,
-                COUNT(*) as count
-            FROM targets t
-            LEFT JOIN zip_data z ON t.region = z.zip_code
-            GROUP BY z.grade
-        ''')
-        
-        grade_summary = {}
-        for row in cursor.fetchall():
-            if row[0]:  # Only include non-null grades
-                grade_summary[row[0]] = row[1]
-        
-        return jsonify({
-            'status_summary': status_summary,
-            'grade_summary': grade_summary
-        })
+        # Maintained by triggers, see dashboard_summary.py
+        return jsonify(summary_response(conn))
     except Exception as e:
         print(f"Error getting dashboard summary: {e}")
         return jsonify({'error': str(e)}), 500
@@ -376,22 +838,10 @@ def get_dashboard_summary():
 
 @app.route('/api/dashboard/status/<status>')
 def get_status_details(status):
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT 
-                t.organization,
-                t.address,
-                t.population,
-                t.median_income,
-                t.latitude,
-                t.longitude,
-                z.grade
-            FROM targets t
-            LEFT JOIN zip_data z ON t.region = z.zip_code
-            WHERE COALESCE(t.status, 'not-contacted') = ?
-        ''', (status,))
+        cursor.execute(STATUS_DETAILS_QUERY, (normalize_status(status),))
         
         targets = []
         for row in cursor.fetchall():
@@ -412,48 +862,45 @@ def get_status_details(status):
     finally:
         conn.close()
 
+@app.route('/metrics')
+def get_metrics():
+    # Prometheus text exposition of this worker's request and SQL metrics
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/slow_requests')
+def get_slow_requests():
+    # Sampled stack profiles of recent slow requests (TARGETS_PROFILE_SLOW_MS)
+    if metrics.profiler is None:
+        return jsonify({'error': 'Slow request profiling is off; set TARGETS_PROFILE_SLOW_MS'}), 404
+    return jsonify(list(metrics.profiler.profiles))
+
 @app.route('/dbmanager')
 def dbmanager():
-    return send_from_directory('.', 'dbmanager.html')
+    return page_response('dbmanager.html')
 
 @app.route('/api/db/query', methods=['POST'])
 def execute_query():
-    data = request.get_json()
-    query = data.get('query', '').strip().lower()
+    data = request.get_json() or {}
+    query = data.get('query', '').strip()
     
-    # Prevent dangerous operations
-    dangerous_keywords = ['drop', 'truncate', 'delete', 'update', 'insert', 'alter', 'create']
-    if any(keyword in query for keyword in dangerous_keywords):
-        return jsonify({'error': 'This type of query is not allowed in the web interface'}), 400
-    
-    conn = get_db_connection()
+    # Runs on a private read-only connection with a time limit, one page at a time
     try:
-        cursor = conn.cursor()
-        cursor.execute(query)
-        
-        # If it's a SELECT query, fetch results
-        if query.startswith('select'):
-            rows = cursor.fetchall()
-            # Convert rows to list of dicts
-            columns = [description[0] for description in cursor.description]
-            results = []
-            for row in rows:
-                row_dict = {}
-                for i, value in enumerate(row):
-                    row_dict[columns[i]] = value
-                results.append(row_dict)
-            return jsonify({'rows': results})
-        
-        conn.commit()
-        return jsonify({'success': True})
+        result = run_query(
+            query,
+            page_size=data.get('page_size', DEFAULT_PAGE_SIZE),
+            offset=data.get('offset', 0),
+            key=data.get('key'),
+            after=data.get('after'),
+        )
+        return jsonify(result)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/db/schema')
 def get_schema():
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
         cursor = conn.cursor()
         
@@ -469,33 +916,20 @@ def get_schema():
 
 @app.route('/api/db/backups')
 def list_backups():
-    backup_dir = 'data/backups'
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    
-    backups = []
-    for filename in os.listdir(backup_dir):
-        if filename.endswith('.db'):
-            timestamp = datetime.fromtimestamp(os.path.getctime(os.path.join(backup_dir, filename)))
-            backups.append({
-                'filename': filename,
-                'timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S')
-            })
-    
-    return jsonify(sorted(backups, key=lambda x: x['timestamp'], reverse=True))
+    # Sizes and checksums come straight from the backup manifest
+    return jsonify(backups.list_backups())
 
 @app.route('/api/db/backup', methods=['POST'])
 def create_backup():
-    backup_dir = 'data/backups'
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_path = os.path.join(backup_dir, f'targets_{timestamp}.db')
-    
     try:
-        shutil.copy2('data/targets.db', backup_path)
-        return jsonify({'success': True, 'filename': os.path.basename(backup_path)})
+        entry = backups.create_backup()
+        return jsonify({
+            'success': True,
+            'filename': entry['filename'],
+            'size': entry['size'],
+            'stored_bytes': entry['stored_bytes'],
+            'sha256': entry['sha256'],
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -507,16 +941,32 @@ def delete_backup():
     if not filename or '..' in filename:  # Prevent directory traversal
         return jsonify({'error': 'Invalid filename'}), 400
     
-    backup_path = os.path.join('data/backups', filename)
-    
     try:
-        if os.path.exists(backup_path):
-            os.remove(backup_path)
+        if backups.delete_backup(filename):
             return jsonify({'success': True})
         return jsonify({'error': 'Backup not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def restore_database_file(source_path):
+    # Keep a pre-restore backup, then validate and swap the file in
+    backups.validate_database(source_path)
+    backups.create_backup('pre_restore')
+    try:
+        counts = backups.hot_swap(source_path, prepare_restored_schema, DB_PATH)
+    finally:
+        reopen_database()
+    
+    # Verify the restored database
+    conn = get_read_connection()
+    try:
+        # Check if we can read from the database
+        count = conn.execute('SELECT COUNT(*) FROM targets').fetchone()[0]
+        print(f"Restored database has {count} targets")
+        return count, counts
+    finally:
+        conn.close()
+
 @app.route('/api/db/restore', methods=['POST'])
 def restore_backup():
     data = request.get_json()
@@ -525,60 +975,37 @@ def restore_backup():
     if not filename or '..' in filename:  # Prevent directory traversal
         return jsonify({'error': 'Invalid filename'}), 400
     
-    backup_path = os.path.join('data/backups', filename)
-    db_path = 'data/targets.db'
+    entry = backups.get_backup(filename)
+    if not entry:
+        return jsonify({'error': 'Backup not found'}), 404
     
+    # One restore at a time; a second one is turned away rather than left
+    # waiting on the lock
+    if not backups.restore_lock.acquire(blocking=False):
+        return jsonify({'error': 'Another restore is in progress'}), 409
+    candidate = backups.temp_file('restore_')
     try:
-        if not os.path.exists(backup_path):
-            return jsonify({'error': 'Backup not found'}), 404
-        
-        # Create a backup of current state before restoring
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        pre_restore_backup = os.path.join('data/backups', f'pre_restore_{timestamp}.db')
-        
-        # Close any existing connections
-        try:
-            conn = get_db_connection()
-            conn.close()
-        except:
-            pass  # Ignore if no connection exists
-        
-        # Make backup of current state
-        if os.path.exists(db_path):
-            shutil.copy2(db_path, pre_restore_backup)
-        
-        # Restore the selected backup
-        shutil.copy2(backup_path, db_path)
-        
-        # Verify the restored database
-        conn = get_db_connection()
-        try:
-            # Check if we can read from the database
-            count = conn.execute('SELECT COUNT(*) FROM targets').fetchone()[0]
-            print(f"Restored database has {count} targets")
-            return jsonify({'success': True, 'count': count})
-        finally:
-            conn.close()
-            
+        backups.materialize(entry, candidate)
+        count, counts = restore_database_file(candidate)
+        return jsonify({'success': True, 'count': count, 'counts': counts})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error restoring backup: {e}")
-        # Try to restore from pre-restore backup if it exists
-        if os.path.exists(pre_restore_backup):
-            try:
-                shutil.copy2(pre_restore_backup, db_path)
-                print("Restored from pre-restore backup after error")
-            except Exception as e2:
-                print(f"Error restoring from pre-restore backup: {e2}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        backups.remove_file(candidate)
+        backups.restore_lock.release()
 
 @app.route('/api/download_backup/<filename>')
 def download_backup(filename):
-    backup_dir = 'data/backups'
-    try:
-        return send_from_directory(backup_dir, filename, as_attachment=True)
-    except Exception as e:
-        print(f"Error downloading backup: {e}")
-        return str(e), 500
+    entry = backups.get_backup(filename)
+    if not entry:
+        return jsonify({'error': 'Backup not found'}), 404
+    response = Response(backups.iter_backup(entry), mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.headers['Content-Length'] = str(entry['size'])
+    return response
 
 @app.route('/api/upload_backup', methods=['POST'])
 def upload_backup():
@@ -591,60 +1018,28 @@ def upload_backup():
     if not file.filename.endswith('.db'):
         return jsonify({'error': 'Invalid file type. Must be a .db file'}), 400
 
-    backup_dir = 'data/backups'
-    db_path = 'data/targets.db'
+    if not backups.restore_lock.acquire(blocking=False):
+        return jsonify({'error': 'Another restore is in progress'}), 409
+    upload_path = backups.temp_file('upload_')
     try:
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-        
-        # Save with timestamp to avoid conflicts
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'uploaded_{timestamp}_{file.filename}'
-        file_path = os.path.join(backup_dir, filename)
-        
-        # First save the uploaded file
-        file.save(file_path)
-        
-        # Create a backup of current state before restoring
-        pre_restore_backup = os.path.join(backup_dir, f'pre_restore_{timestamp}.db')
-        
-        # Close any existing connections
-        try:
-            conn = get_db_connection()
-            conn.close()
-        except:
-            pass  # Ignore if no connection exists
-        
-        # Make backup of current state
-        if os.path.exists(db_path):
-            shutil.copy2(db_path, pre_restore_backup)
-        
-        # Restore the uploaded file
-        shutil.copy2(file_path, db_path)
-        
-        # Verify the restored database
-        conn = get_db_connection()
-        try:
-            # Check if we can read from the database
-            count = conn.execute('SELECT COUNT(*) FROM targets').fetchone()[0]
-            print(f"Restored database has {count} targets")
-            return jsonify({'success': True, 'filename': filename, 'count': count})
-        finally:
-            conn.close()
-            
+        file.save(upload_path)
+        backups.validate_database(upload_path)
+        entry = backups.add_file(upload_path, f'uploaded_{timestamp}_{os.path.basename(file.filename)}')
+        count, counts = restore_database_file(upload_path)
+        return jsonify({'success': True, 'filename': entry['filename'], 'count': count, 'counts': counts})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error uploading/restoring backup: {e}")
-        # Try to restore from pre-restore backup if it exists
-        if os.path.exists(pre_restore_backup):
-            try:
-                shutil.copy2(pre_restore_backup, db_path)
-                print("Restored from pre-restore backup after error")
-            except Exception as e2:
-                print(f"Error restoring from pre-restore backup: {e2}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        backups.remove_file(upload_path)
+        backups.restore_lock.release()
 
 if __name__ == '__main__':
     print("Starting test server...")
+    print("Development only; run production with gunicorn (see gunicorn.conf.py)")
     print(f"Current directory: {os.getcwd()}")
     print(f"index_db.html exists: {os.path.exists('index_db.html')}")
     print(f"kanban.html exists: {os.path.exists('kanban.html')}")
@@ -0,0 +1,393 @@
+import argparse
+import math
+
+from db import connect
+from geo import EARTH_RADIUS_MI, chord_for_miles, miles_for_chord, to_unit
+
+# R*Trees over targets and zip_data latitude/longitude, keyed by rowid.
+# Triggers keep them in step with every insert/update/delete.
+SPATIAL_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS targets_rtree USING rtree(
+        id, min_lat, max_lat, min_lng, max_lng
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS targets_rtree_insert AFTER INSERT ON targets
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO targets_rtree VALUES (
+            new.rowid, new.latitude, new.latitude, new.longitude, new.longitude
+        );
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS targets_rtree_update AFTER UPDATE OF latitude, longitude ON targets
+    BEGIN
+        DELETE FROM targets_rtree WHERE id = old.rowid;
+        INSERT INTO targets_rtree
+        SELECT new.rowid, new.latitude, new.latitude, new.longitude, new.longitude
+        WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS targets_rtree_delete AFTER DELETE ON targets
+    BEGIN
+        DELETE FROM targets_rtree WHERE id = old.rowid;
+    END
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS zip_rtree USING rtree(
+        id, min_lat, max_lat, min_lng, max_lng
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS zip_rtree_insert AFTER INSERT ON zip_data
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO zip_rtree VALUES (
+            new.rowid, new.latitude, new.latitude, new.longitude, new.longitude
+        );
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS zip_rtree_update AFTER UPDATE OF latitude, longitude ON zip_data
+    BEGIN
+        DELETE FROM zip_rtree WHERE id = old.rowid;
+        INSERT INTO zip_rtree
+        SELECT new.rowid, new.latitude, new.latitude, new.longitude, new.longitude
+        WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS zip_rtree_delete AFTER DELETE ON zip_data
+    BEGIN
+        DELETE FROM zip_rtree WHERE id = old.rowid;
+    END
+    ''',
+]
+
+
+def ensure_spatial_index(conn):
+    built = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'targets_rtree'"
+    ).fetchone() is not None
+    # Plain execute() rather than executescript(), which would commit the
+    # caller's open transaction
+    for statement in SPATIAL_SCHEMA:
+        conn.execute(statement)
+    # The triggers keep it in step from here on
+    if not built:
+        rebuild_spatial_index(conn)
+
+
+def rebuild_spatial_index(conn):
+    # targets has a TEXT primary key, so VACUUM is free to renumber rowids:
+    # run this (python spatial.py) after a VACUUM. Restores do it for you.
+    conn.execute('DELETE FROM targets_rtree')
+    conn.execute('''
+        INSERT INTO targets_rtree (id, min_lat, max_lat, min_lng, max_lng)
+        SELECT rowid, latitude, latitude, longitude, longitude
+        FROM targets
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+    conn.execute('DELETE FROM zip_rtree')
+    conn.execute('''
+        INSERT INTO zip_rtree (id, min_lat, max_lat, min_lng, max_lng)
+        SELECT rowid, latitude, latitude, longitude, longitude
+        FROM zip_data
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+
+
+def _wrap_lng(lng):
+    if -180.0 <= lng <= 180.0:
+        return lng
+    return (lng + 180.0) % 360.0 - 180.0
+
+
+def parse_bbox(value):
+    # Leaflet's toBBoxString() order: west,south,east,north
+    if not value:
+        return None
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError('bbox must be west,south,east,north')
+    west, south, east, north = (float(p) for p in parts)
+    if south > north:
+        raise ValueError('bbox south must not exceed north')
+    south = max(south, -90.0)
+    north = min(north, 90.0)
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west = _wrap_lng(west)
+        east = _wrap_lng(east)
+    return west, south, east, north
+
+
+def _tile_x(lng, zoom):
+    return (lng + 180.0) / 360.0 * (1 << zoom)
+
+
+def _tile_y(lat, zoom):
+    lat = max(min(lat, 85.0511), -85.0511)
+    rad = math.radians(lat)
+    return (1.0 - math.log(math.tan(rad) + 1.0 / math.cos(rad)) / math.pi) / 2.0 * (1 << zoom)
+
+
+def _tile_lng(x, zoom):
+    return x / (1 << zoom) * 360.0 - 180.0
+
+
+def _tile_lat(y, zoom):
+    n = math.pi - 2.0 * math.pi * y / (1 << zoom)
+    return math.degrees(math.atan(math.sinh(n)))
+
+
+def snap_bbox(bbox, zoom):
+    # Grow the bbox out to whole web-mercator tiles at `zoom` so that nearby
+    # viewports produce identical queries (and cacheable responses).
+    west, south, east, north = bbox
+    if west > east:
+        return bbox
+    zoom = max(0, min(int(zoom), 22))
+    n = 1 << zoom
+    x0 = max(math.floor(_tile_x(west, zoom)), 0)
+    x1 = min(math.ceil(_tile_x(east, zoom)), n)
+    y0 = max(math.floor(_tile_y(north, zoom)), 0)
+    y1 = min(math.ceil(_tile_y(south, zoom)), n)
+    return (
+        _tile_lng(x0, zoom),
+        -90.0 if y1 == n else _tile_lat(y1, zoom),
+        _tile_lng(x1, zoom),
+        90.0 if y0 == 0 else _tile_lat(y0, zoom),
+    )
+
+
+def bbox_ranges(bbox):
+    # A bbox crossing the antimeridian becomes two longitude ranges
+    west, south, east, north = bbox
+    if west <= east:
+        return [(west, south, east, north)]
+    return [(west, south, 180.0, north), (-180.0, south, east, north)]
+
+
+def query_targets_in_bbox(conn, columns, bbox, join=''):
+    sql = f'''
+        SELECT {columns}
+        FROM targets_rtree r
+        JOIN targets t ON t.rowid = r.id
+        {join}
+        WHERE r.max_lat >= ? AND r.min_lat <= ?
+          AND r.max_lng >= ? AND r.min_lng <= ?
+    '''
+    rows = []
+    for west, south, east, north in bbox_ranges(bbox):
+        rows.extend(conn.execute(sql, (south, north, west, east)).fetchall())
+    return rows
+
+
+def radius_bbox(lat, lng, radius_mi):
+    # Smallest lat/lng box holding the circle; whole longitude band near a pole
+    dlat = math.degrees(radius_mi / EARTH_RADIUS_MI)
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    cos_lat = min(math.cos(math.radians(south)), math.cos(math.radians(north)))
+    if cos_lat <= 0 or radius_mi / EARTH_RADIUS_MI >= cos_lat * math.pi:
+        return -180.0, south, 180.0, north
+    dlng = math.degrees(radius_mi / (EARTH_RADIUS_MI * cos_lat))
+    return _wrap_lng(lng - dlng), south, _wrap_lng(lng + dlng), north
+
+
+def query_within_radius(conn, table, columns, lat, lng, radius_mi, join=''):
+    # R*Tree box lookup, then an exact great-circle filter. `table` is
+    # 'targets' (alias t) or 'zip_data' (alias z); `columns` must include
+    # latitude and longitude. Returns (miles, row) pairs, nearest first.
+    alias, rtree = {'targets': ('t', 'targets_rtree'), 'zip_data': ('z', 'zip_rtree')}[table]
+    sql = f'''
+        SELECT {columns}
+        FROM {rtree} r
+        JOIN {table} {alias} ON {alias}.rowid = r.id
+        {join}
+        WHERE r.max_lat >= ? AND r.min_lat <= ?
+          AND r.max_lng >= ? AND r.min_lng <= ?
+    '''
+    x, y, z = to_unit(lat, lng)
+    chord = chord_for_miles(radius_mi)
+    limit = chord * chord
+    found = []
+    for west, south, east, north in bbox_ranges(radius_bbox(lat, lng, radius_mi)):
+        for row in conn.execute(sql, (south, north, west, east)):
+            px, py, pz = to_unit(row['latitude'], row['longitude'])
+            d = (px - x) * (px - x) + (py - y) * (py - y) + (pz - z) * (pz - z)
+            if d <= limit:
+                found.append((d, row))
+    found.sort(key=lambda item: item[0])
+    return [(miles_for_chord(math.sqrt(d)), row) for d, row in found]
+
+
+# Per-zoom grid of target counts by status, so the map can draw clusters
+# without shipping every target to the browser. A cell is 2**GRID_CELL_BITS
+# cells per map tile side (128px at GRID_CELL_BITS=1). Triggers on targets
+# keep it exact for every writer, like the dashboard totals; the cell math
+# is SQL (SQLite's math functions) so the triggers and rebuild_cluster_grid()
+# agree to the last bit. After changing the GRID_* settings, drop the
+# cluster_grid_* triggers and run ensure_cluster_grid() again.
+GRID_MIN_ZOOM = 3
+GRID_MAX_ZOOM = 15
+GRID_CELL_BITS = 1
+
+CLUSTER_GRID_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS cluster_grid (
+        zoom INTEGER NOT NULL,
+        cell_x INTEGER NOT NULL,
+        cell_y INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        sum_lat REAL NOT NULL,
+        sum_lng REAL NOT NULL,
+        PRIMARY KEY (zoom, cell_x, cell_y, status)
+    ) WITHOUT ROWID
+    ''',
+    # One row per grid zoom, for the triggers to fan a target out over
+    'CREATE TABLE IF NOT EXISTS cluster_grid_zooms (zoom INTEGER PRIMARY KEY)',
+]
+
+
+def _grid_cell_sql(row):
+    # cell_x, cell_y of {row}'s position at cluster_grid_zooms.zoom: the
+    # normalised mercator position of _tile_x/_tile_y, times the cells per side
+    n = f'(1 << (g.zoom + {GRID_CELL_BITS}))'
+    lat = f'radians(max(min({row}.latitude, 85.0511), -85.0511))'
+    x = f'({row}.longitude + 180.0) / 360.0'
+    y = f'(1.0 - ln(tan({lat}) + 1.0 / cos({lat})) / pi()) / 2.0'
+    return f'min(CAST({x} * {n} AS INTEGER), {n} - 1) AS cell_x, min(CAST({y} * {n} AS INTEGER), {n} - 1) AS cell_y'
+
+
+def _grid_cells_sql(row):
+    return f'''
+        SELECT g.zoom, {_grid_cell_sql(row)} FROM cluster_grid_zooms g
+        WHERE {row}.latitude IS NOT NULL AND {row}.longitude IS NOT NULL
+    '''
+
+
+def _grid_add(row):
+    return f'''
+    INSERT INTO cluster_grid
+    SELECT g.zoom, {_grid_cell_sql(row)}, {row}.status_key, 1, {row}.latitude, {row}.longitude
+    FROM cluster_grid_zooms g
+    WHERE {row}.latitude IS NOT NULL AND {row}.longitude IS NOT NULL
+    ON CONFLICT (zoom, cell_x, cell_y, status) DO UPDATE SET
+        count = count + 1,
+        sum_lat = sum_lat + excluded.sum_lat,
+        sum_lng = sum_lng + excluded.sum_lng;
+    '''
+
+
+def _grid_remove(row):
+    return f'''
+    UPDATE cluster_grid SET
+        count = count - 1,
+        sum_lat = sum_lat - {row}.latitude,
+        sum_lng = sum_lng - {row}.longitude
+    WHERE status = {row}.status_key AND (zoom, cell_x, cell_y) IN ({_grid_cells_sql(row)});
+    DELETE FROM cluster_grid
+    WHERE status = {row}.status_key AND count <= 0 AND (zoom, cell_x, cell_y) IN ({_grid_cells_sql(row)});
+    '''
+
+
+CLUSTER_GRID_TRIGGERS = {
+    'cluster_grid_targets_insert': ('AFTER INSERT ON targets', _grid_add('new')),
+    'cluster_grid_targets_delete': ('AFTER DELETE ON targets', _grid_remove('old')),
+    'cluster_grid_targets_update': ('AFTER UPDATE OF status, latitude, longitude ON targets',
+                                    _grid_remove('old') + _grid_add('new')),
+}
+
+
+def ensure_cluster_grid(conn):
+    built = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'cluster_grid_targets_update'"
+    ).fetchone() is not None
+    for statement in CLUSTER_GRID_SCHEMA:
+        conn.execute(statement)
+    for name, (event, body) in CLUSTER_GRID_TRIGGERS.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+    # The triggers keep it in step from here on
+    if not built:
+        rebuild_cluster_grid(conn)
+
+
+def rebuild_cluster_grid(conn):
+    conn.execute('DELETE FROM cluster_grid_zooms')
+    conn.executemany('INSERT INTO cluster_grid_zooms VALUES (?)',
+                     [(zoom,) for zoom in range(GRID_MIN_ZOOM, GRID_MAX_ZOOM + 1)])
+    conn.execute('DELETE FROM cluster_grid')
+    conn.execute(f'''
+        INSERT INTO cluster_grid
+        SELECT zoom, cell_x, cell_y, status, COUNT(*), SUM(latitude), SUM(longitude)
+        FROM (
+            SELECT g.zoom, {_grid_cell_sql('t')}, t.status_key AS status, t.latitude, t.longitude
+            FROM targets t, cluster_grid_zooms g
+            WHERE t.latitude IS NOT NULL AND t.longitude IS NOT NULL
+        )
+        GROUP BY zoom, cell_x, cell_y, status
+    ''')
+
+
+def query_clusters(conn, bbox, zoom):
+    zoom = max(GRID_MIN_ZOOM, min(int(zoom), GRID_MAX_ZOOM))
+    n = 1 << (zoom + GRID_CELL_BITS)
+    sql = '''
+        SELECT cell_x, cell_y, status, count, sum_lat, sum_lng
+        FROM cluster_grid
+        WHERE zoom = ? AND cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?
+    '''
+    clusters = {}
+    for west, south, east, north in bbox_ranges(bbox):
+        x0 = max(int(_tile_x(west, 0) * n), 0)
+        x1 = min(int(_tile_x(east, 0) * n), n - 1)
+        y0 = max(int(_tile_y(north, 0) * n), 0)
+        y1 = min(int(_tile_y(south, 0) * n), n - 1)
+        for cx, cy, status, count, sum_lat, sum_lng in conn.execute(sql, (zoom, x0, x1, y0, y1)):
+            cluster = clusters.get((cx, cy))
+            if cluster is None:
+                cluster = clusters[(cx, cy)] = {
+                    'count': 0, 'sum_lat': 0.0, 'sum_lng': 0.0, 'statuses': {},
+                    'bounds': [
+                        [_tile_lat(cy + 1, zoom + GRID_CELL_BITS), _tile_lng(cx, zoom + GRID_CELL_BITS)],
+                        [_tile_lat(cy, zoom + GRID_CELL_BITS), _tile_lng(cx + 1, zoom + GRID_CELL_BITS)],
+                    ],
+                }
+            cluster['count'] += count
+            cluster['sum_lat'] += sum_lat
+            cluster['sum_lng'] += sum_lng
+            cluster['statuses'][status] = count
+
+    result = []
+    for cluster in clusters.values():
+        count = cluster.pop('count')
+        result.append({
+            'lat': cluster.pop('sum_lat') / count,
+            'lng': cluster.pop('sum_lng') / count,
+            'count': count,
+            **cluster,
+        })
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild the map's R*Tree indexes and cluster grid.")
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        ensure_spatial_index(conn)
+        ensure_cluster_grid(conn)
+        rebuild_spatial_index(conn)
+        rebuild_cluster_grid(conn)
+        conn.commit()
+        print('Spatial index and cluster grid rebuilt')
+    finally:
+        conn.close()
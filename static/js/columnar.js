@@ -0,0 +1,29 @@
+// Decoder for the columnar payload format (see columnar.py): one array per
+// column, with dictionary-encoded columns holding indexes into
+// payload.dictionaries. Plain arrays of row objects pass through unchanged.
+function decodeRows(payload) {
+    if (Array.isArray(payload)) return payload;
+
+    const names = Object.keys(payload.columns);
+    const columns = names.map(name => {
+        const values = payload.columns[name];
+        const dictionary = payload.dictionaries[name];
+        return dictionary ? values.map(index => dictionary[index]) : values;
+    });
+
+    const rows = new Array(payload.count);
+    for (let i = 0; i < payload.count; i++) {
+        const row = {};
+        for (let c = 0; c < names.length; c++) {
+            row[names[c]] = columns[c][i];
+        }
+        rows[i] = row;
+    }
+    return rows;
+}
+
+// A change feed page with its upserts decoded
+function decodeChanges(changes) {
+    changes.upserts = decodeRows(changes.upserts);
+    return changes;
+}
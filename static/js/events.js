@@ -0,0 +1,19 @@
+// One /api/events stream per browser tab. The map and the kanban board embed
+// each other in an iframe; the embedded page reuses the stream of the page
+// around it instead of opening a second one (each open stream holds a
+// server connection). Null without EventSource support.
+function sharedEventSource() {
+    if (!window.EventSource) return null;
+    try {
+        if (window !== window.parent && typeof window.parent.sharedEventSource === 'function') {
+            return window.parent.sharedEventSource();
+        }
+    } catch (error) {
+        // Parent from another origin: open our own
+    }
+    if (!window.targetEvents) {
+        const base = window.location.protocol === 'file:' ? 'http://localhost:5000' : '';
+        window.targetEvents = new EventSource(`${base}/api/events`);
+    }
+    return window.targetEvents;
+}
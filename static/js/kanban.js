@@ -7,6 +7,8 @@ let draggedCard = null;
 let originalContainer = null;
 let autoScrollInterval = null;
 let isSubmittingNote = false; // Flag to prevent duplicate submissions
+let syncVersion = ''; // Position in /api/targets/changes after the last load or sync
+let eventSource = null; // Live updates from /api/events
 
 // Function to create card content
 function createCardContent(target) {
@@ -85,19 +87,32 @@ function dragend(event) {
     });
 }
 
+async function fetchTargetChanges(since) {
+    const response = await fetch(`${API_BASE}/api/targets/changes?since=${encodeURIComponent(since)}&format=columnar`);
+    if (!response.ok) {
+        const error = await response.text();
+        console.error('Server error:', error);
+        throw new Error(`Server returned ${response.status}: ${error}`);
+    }
+    return decodeChanges(await response.json());
+}
+
 async function loadTargets() {
     try {
-        const response = await fetch(`${API_BASE}/api/targets`);
-        if (!response.ok) {
-            const error = await response.text();
-            console.error('Server error:', error);
-            throw new Error(`Server returned ${response.status}: ${error}`);
-        }
-        const data = await response.json();
-        if (!Array.isArray(data)) {
-            console.error('Invalid data format:', data);
-            throw new Error('Server returned invalid data format');
-        }
+        // A sync from nothing pages through every target
+        let data = [];
+        let since = '';
+        let changes;
+        do {
+            changes = await fetchTargetChanges(since);
+            if (!Array.isArray(changes.upserts)) {
+                console.error('Invalid data format:', changes);
+                throw new Error('Server returned invalid data format');
+            }
+            data = data.concat(changes.upserts);
+            since = changes.version;
+        } while (changes.has_more);
+        syncVersion = since;
         console.log(`Loaded ${data.length} targets`);
         renderTargets(data);
     } catch (e) {
@@ -114,6 +129,90 @@ async function loadTargets() {
     }
 }
 
+function createCard(target, status) {
+    const card = document.createElement('div');
+    card.className = 'card';
+    card.draggable = true;
+    card.id = cardIdFor(target.organization);
+    card.dataset.target = JSON.stringify(target);
+    card.dataset.status = status;
+    card.innerHTML = createCardContent(target);
+
+    // Add drag handlers
+    card.addEventListener('dragstart', drag);
+    card.addEventListener('dragend', dragend);
+
+    // Add click handler for expansion
+    card.addEventListener('click', function(event) {
+        // Don't expand if clicking on a button
+        if (event.target.tagName === 'BUTTON') {
+            return;
+        }
+        const details = this.querySelector('.card-details');
+        if (details) {
+            const isExpanded = details.style.display !== 'none';
+            details.style.display = isExpanded ? 'none' : 'block';
+        }
+    });
+    return card;
+}
+
+function cardIdFor(organization) {
+    return `card-${organization.replace(/[^a-zA-Z0-9]/g, '-')}`;
+}
+
+function removeCard(organization) {
+    const card = document.getElementById(cardIdFor(organization));
+    if (card && card !== draggedCard) {
+        card.remove();
+    }
+}
+
+function upsertCard(target) {
+    const status = target.status || 'not-contacted';
+    const column = document.getElementById(status.toLowerCase().replace(/ /g, '-'));
+    const cardContainer = column && column.querySelector('.cards-container');
+    const existing = document.getElementById(cardIdFor(target.organization));
+    if (existing && existing === draggedCard) {
+        return; // Leave the card the user is dragging alone
+    }
+    if (existing) {
+        existing.remove();
+    }
+    if (cardContainer) {
+        cardContainer.appendChild(createCard(target, status));
+    }
+}
+
+// Apply only what changed since the last load or sync
+async function syncTargets() {
+    if (!syncVersion) return;
+    try {
+        let changes;
+        do {
+            changes = await fetchTargetChanges(syncVersion);
+            if (changes.reset) {
+                // The database was replaced (e.g. restored); start over
+                await loadTargets();
+                return;
+            }
+            changes.deletes.forEach(removeCard);
+            changes.upserts.forEach(upsertCard);
+            syncVersion = changes.version;
+        } while (changes.has_more);
+
+        // Keep an active search applied to replaced cards
+        const searchInput = document.getElementById('searchInput');
+        if (searchInput && searchInput.value) {
+            searchCards(searchInput.value);
+        } else {
+            updateColumnCounts();
+        }
+    } catch (e) {
+        console.error('Error syncing targets:', e);
+    }
+}
+
 function renderTargets(targets) {
     // Clear all existing cards first
     document.querySelectorAll('.cards-container').forEach(container => {
@@ -138,31 +237,7 @@ function renderTargets(targets) {
             const cardContainer = column.querySelector('.cards-container');
             if (cardContainer) {
                 targetsByStatus[status].forEach(target => {
-                    const card = document.createElement('div');
-                    card.className = 'card';
-                    card.draggable = true;
-                    card.id = `card-${target.organization.replace(/[^a-zA-Z0-9]/g, '-')}`;
-                    card.dataset.target = JSON.stringify(target);
-                    card.dataset.status = status;
-                    card.innerHTML = createCardContent(target);
-                    cardContainer.appendChild(card);
-
-                    // Add drag handlers
-                    card.addEventListener('dragstart', drag);
-                    card.addEventListener('dragend', dragend);
-
-                    // Add click handler for expansion
-                    card.addEventListener('click', function(event) {
-                        // Don't expand if clicking on a button
-                        if (event.target.tagName === 'BUTTON') {
-                            return;
-                        }
-                        const details = this.querySelector('.card-details');
-                        if (details) {
-                            const isExpanded = details.style.display !== 'none';
-                            details.style.display = isExpanded ? 'none' : 'block';
-                        }
-                    });
+                    cardContainer.appendChild(createCard(target, status));
                 });
             }
         }
@@ -656,8 +731,32 @@ function locateOnMap(event, lat, lng, name) {
     }, '*');
 }
 
+// Other users' drags and notes arrive as server-sent events
+function subscribeToEvents() {
+    eventSource = sharedEventSource();
+    if (!eventSource) return;
+    const onNote = event => {
+        const note = JSON.parse(event.data);
+        if (currentNoteTarget && note.target_id === currentNoteTarget) {
+            loadNotes(currentNoteTarget);
+        }
+    };
+    const listeners = {
+        status: () => syncTargets(),
+        reset: () => loadTargets(),
+        note_added: onNote,
+        note_deleted: onNote,
+    };
+    Object.entries(listeners).forEach(([type, listener]) => eventSource.addEventListener(type, listener));
+    // The stream may belong to the page around this frame and outlive it
+    window.addEventListener('pagehide', () => {
+        Object.entries(listeners).forEach(([type, listener]) => eventSource.removeEventListener(type, listener));
+    });
+}
+
 async function onload() {
     await loadTargets();
+    subscribeToEvents();
     
     // Set up event listeners
     setupEventListeners();
@@ -679,9 +778,9 @@ window.addEventListener('message', function(event) {
     }
 });
 
-// Check connection and process updates periodically
+// Fall back to polling for changes while the event stream is down
 setInterval(() => {
-    if (navigator.onLine) {
-        // Removed processPendingUpdates call
+    if (navigator.onLine && (!eventSource || eventSource.readyState !== EventSource.OPEN)) {
+        syncTargets();
     }
 }, 30000); // Every 30 seconds
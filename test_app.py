@@ -0,0 +1,293 @@
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+# serve_map_data prepares the database at DB_PATH when it is imported, so the
+# app under test gets a scratch database and backup store before that
+SCRATCH_DIR = tempfile.mkdtemp()
+SCRATCH_DB = os.path.join(SCRATCH_DIR, 'targets.db')
+os.environ['TARGETS_DB'] = SCRATCH_DB
+os.environ['TARGETS_BACKUP_DIR'] = os.path.join(SCRATCH_DIR, 'backups')
+
+import backups
+import db
+import db_query
+from dashboard_summary import check_summary
+from db import connect, get_data_version, get_write_connection, reset_pools
+from migrations import migrate
+from pipeline_stats import check_pipeline_stats
+
+# Modules another test imported first read the environment before it was set
+db.DB_PATH = backups.DB_PATH = db_query.DB_PATH = SCRATCH_DB
+backups.BACKUP_DIR = os.environ['TARGETS_BACKUP_DIR']
+
+_conn = connect(SCRATCH_DB)
+migrate(_conn, verbose=False)
+_conn.commit()
+_conn.close()
+
+import serve_map_data
+
+# Run with: python -m unittest test_app (or pytest)
+TARGETS = [
+    ('Alpha', 'not-contacted', 40.70, -74.00),
+    ('Bravo', 'not-contacted', 40.71, -74.01),
+    ('Charlie', 'in-discussion', 41.88, -87.63),
+    ('Delta', 'not-contacted', 34.05, -118.24),
+]
+
+
+def tearDownModule():
+    reset_pools()
+    shutil.rmtree(SCRATCH_DIR)
+
+
+class AppTest(unittest.TestCase):
+    # Every test starts from TARGETS with their listed statuses. Logged rows
+    # (activity_log, events) are kept, so tests look at what they added.
+    def setUp(self):
+        conn = get_write_connection()
+        try:
+            conn.executemany('''
+                INSERT INTO targets (organization, status, latitude, longitude) VALUES (?, ?, ?, ?)
+                ON CONFLICT(organization) DO UPDATE SET status = excluded.status
+            ''', TARGETS)
+            conn.commit()
+        finally:
+            conn.close()
+        serve_map_data.reopen_database()
+        self.client = serve_map_data.app.test_client()
+
+    def query(self, sql, params=()):
+        conn = get_write_connection()
+        try:
+            return [tuple(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def execute(self, sql):
+        conn = get_write_connection()
+        try:
+            conn.execute(sql)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def last_id(self, table):
+        return self.query(f'SELECT COALESCE(MAX(id), 0) FROM {table}')[0][0]
+
+    def statuses(self):
+        return dict(self.query('SELECT organization, status FROM targets'))
+
+
+class ResponseCacheTest(AppTest):
+    def summary(self, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get('/api/dashboard/summary', headers=headers)
+
+    def in_discussion(self, response):
+        return response.get_json()['status_summary']['in-discussion']['count']
+
+    def test_revalidates_until_the_data_changes(self):
+        first = self.summary()
+        etag = first.headers['ETag']
+        self.assertEqual(first.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(self.summary(etag).status_code, 304)
+        self.assertEqual(self.summary().get_data(), first.get_data())
+
+        self.client.post('/api/update_status', json={'organization': 'Alpha', 'status': 'in-discussion'})
+        second = self.summary(etag)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(self.in_discussion(second), self.in_discussion(first) + 1)
+        self.assertNotEqual(second.headers['ETag'], etag)
+
+    def test_writes_outside_the_app_invalidate(self):
+        # Imports and scripts write straight to the database; the triggers on
+        # the tables bump the data version for them
+        first = self.summary()
+        self.execute("UPDATE targets SET status = 'In Discussion' WHERE organization = 'Bravo'")
+        second = self.summary(first.headers['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(self.in_discussion(second), self.in_discussion(first) + 1)
+
+
+class BatchUpdateTest(AppTest):
+    def batch(self, *updates):
+        return self.client.post('/api/update_status/batch', json={'updates': list(updates)})
+
+    def test_results_in_order_with_one_event(self):
+        activity, event = self.last_id('activity_log'), self.last_id('events')
+        response = self.batch(
+            {'organization': 'Alpha', 'status': 'in-discussion'},
+            {'organization': 'Nobody', 'status': 'in-discussion'},
+            {'organization': 'Bravo'},
+            {'organization': 'Alpha', 'status': 'partnership-agreed'},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual((data['updated'], data['failed']), (2, 2))
+        self.assertEqual([result['success'] for result in data['results']], [True, False, False, True])
+        # The second update of Alpha starts from the first one
+        self.assertEqual(data['results'][3]['old_status'], 'in-discussion')
+
+        self.assertEqual(self.statuses()['Alpha'], 'partnership-agreed')
+        self.assertEqual(self.query(
+            'SELECT organization, old_status, new_status FROM activity_log WHERE id > ? ORDER BY id',
+            (activity,)
+        ), [
+            ('Alpha', 'not-contacted', 'in-discussion'),
+            ('Alpha', 'in-discussion', 'partnership-agreed'),
+        ])
+        events = self.query('SELECT type, payload FROM events WHERE id > ?', (event,))
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0][0], 'status')
+        self.assertEqual(len(json.loads(events[0][1])['changes']), 2)
+
+    def test_failure_rolls_back_the_whole_batch(self):
+        activity, event = self.last_id('activity_log'), self.last_id('events')
+        self.execute('''
+            CREATE TRIGGER test_reject BEFORE INSERT ON activity_log
+            WHEN new.new_status = 'rejected' BEGIN SELECT RAISE(ABORT, 'rejected'); END
+        ''')
+        try:
+            response = self.batch(
+                {'organization': 'Alpha', 'status': 'in-discussion'},
+                {'organization': 'Bravo', 'status': 'rejected'},
+            )
+        finally:
+            self.execute('DROP TRIGGER test_reject')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.statuses(), {organization: status for organization, status, _, _ in TARGETS})
+        self.assertEqual(self.last_id('activity_log'), activity)
+        self.assertEqual(self.last_id('events'), event)
+
+    def test_rejects_empty_and_oversized_batches(self):
+        self.assertEqual(self.client.post('/api/update_status/batch', json={'updates': []}).status_code, 400)
+        updates = [{'organization': 'Alpha', 'status': 'in-discussion'}] * (serve_map_data.STATUS_BATCH_MAX + 1)
+        self.assertEqual(self.batch(*updates).status_code, 400)
+
+
+class ActivityLogTest(AppTest):
+    def pages(self, limit, **filters):
+        ids, params = [], dict(filters, limit=limit)
+        while True:
+            data = self.client.get('/api/activity_log', query_string=params).get_json()
+            self.assertLessEqual(len(data['activities']), limit)
+            ids += [activity['id'] for activity in data['activities']]
+            if not data['has_more']:
+                return ids
+            params = dict(filters, limit=limit, **data['next'])
+
+    def test_pages_cover_the_log_once(self):
+        # One batch logs every change with the same timestamp, so pages have
+        # to be split on the id within it
+        statuses = ['initial-contact', 'in-discussion', 'low-priority', 'In Discussion'] * 2
+        response = self.client.post('/api/update_status/batch', json={'updates': [
+            {'organization': 'Delta', 'status': status} for status in statuses
+        ]})
+        self.assertEqual(response.get_json()['updated'], len(statuses))
+
+        expected = [row[0] for row in self.query(
+            "SELECT id FROM activity_log WHERE organization = 'Delta' ORDER BY timestamp DESC, id DESC"
+        )]
+        self.assertGreaterEqual(len(expected), len(statuses))
+        self.assertEqual(self.pages(3, organization='Delta'), expected)
+
+        # The status filter matches every spelling
+        in_discussion = [row[0] for row in self.query(
+            "SELECT id FROM activity_log WHERE new_status_key = 'in-discussion' ORDER BY timestamp DESC, id DESC"
+        )]
+        self.assertEqual(self.pages(2, status='IN DISCUSSION'), in_discussion)
+        self.assertEqual(self.pages(500), self.pages(7))
+
+    def test_rollups_follow_the_log(self):
+        self.client.post('/api/update_status', json={'organization': 'Charlie', 'status': 'partnership-agreed'})
+        self.client.post('/api/update_status/batch', json={'updates': [
+            {'organization': 'Alpha', 'status': 'initial-contact'},
+            {'organization': 'Bravo', 'status': 'Not Interested'},
+            {'organization': 'Alpha', 'status': 'in-discussion'},
+        ]})
+        conn = get_write_connection()
+        try:
+            self.assertEqual(check_pipeline_stats(conn), [])
+        finally:
+            conn.close()
+
+
+class RestoreTest(AppTest):
+    def backup(self):
+        response = self.client.post('/api/db/backup')
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['filename']
+
+    def set_status(self, organization, status):
+        response = self.client.post('/api/update_status', json={'organization': organization, 'status': status})
+        self.assertEqual(response.status_code, 200)
+
+    def summary_problems(self):
+        conn = get_write_connection()
+        try:
+            return check_summary(conn)
+        finally:
+            conn.close()
+
+    def test_restore_swaps_in_the_backup(self):
+        filename = self.backup()
+        self.set_status('Alpha', 'in-discussion')
+        version = get_data_version()
+
+        response = self.client.post('/api/db/restore', json={'filename': filename})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['count'], len(TARGETS))
+        self.assertEqual(self.statuses()['Alpha'], 'not-contacted')
+        # A new epoch, so no client keeps a delta cursor or cached copy from before
+        self.assertNotEqual(get_data_version().split('-')[0], version.split('-')[0])
+        self.assertEqual(self.summary_problems(), [])
+        # The data just replaced was kept as a backup of its own
+        names = [entry['filename'] for entry in self.client.get('/api/db/backups').get_json()]
+        self.assertTrue(any(name.startswith('pre_restore_') for name in names))
+
+    def test_upload_rebuilds_derived_tables(self):
+        # A file edited without our triggers: its stored totals are wrong
+        path = os.path.join(SCRATCH_DIR, 'edited.db')
+        backups.materialize(backups.get_backup(self.backup()), path)
+        conn = sqlite3.connect(path)
+        conn.execute('DELETE FROM status_summary')
+        conn.commit()
+        conn.close()
+        with open(path, 'rb') as f:
+            data = {'file': (io.BytesIO(f.read()), 'edited.db')}
+        backups.remove_file(path)
+
+        response = self.client.post('/api/upload_backup', data=data, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.summary_problems(), [])
+
+    def test_second_restore_is_turned_away(self):
+        filename = self.backup()
+        held, done = threading.Event(), threading.Event()
+
+        def hold():
+            with backups.restore_lock:
+                held.set()
+                done.wait(10)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            held.wait(10)
+            response = self.client.post('/api/db/restore', json={'filename': filename})
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.post('/api/db/restore', json={'filename': filename}).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from changes import ensure_changes_table, get_changes
+from db import connect, ensure_data_version, renew_data_epoch
+from migrations import migrate
+
+# The /api/targets/changes feed: a client holding a sync token gets every
+# target whose delta row changed since, including through its ZIP's grade,
+# and a token from another database file asks for a full reload.
+COLUMNS = 't.organization, t.status, z.grade'
+JOIN = 'LEFT JOIN zip_data z ON t.region = z.zip_code'
+
+
+class ChangesFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conn = connect(os.path.join(self.dir, 'targets.db'))
+        migrate(self.conn, verbose=False)
+        ensure_data_version(self.conn)
+        self.conn.executemany("INSERT INTO zip_data (zip_code, grade) VALUES (?, ?)",
+                              [('02139', 'A'), ('10001', 'B')])
+        self.conn.executemany("INSERT INTO targets (organization, region, status) VALUES (?, ?, 'new')",
+                              [('Alpha', '02139'), ('Bravo', '02139'), ('Charlie', '10001')])
+        ensure_changes_table(self.conn)
+        self.conn.commit()
+        self.token = get_changes(self.conn, COLUMNS, 'latest', join=JOIN)['version']
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def changes(self, since=None):
+        return get_changes(self.conn, COLUMNS, since or self.token, join=JOIN)
+
+    def test_first_sync_returns_every_target(self):
+        feed = get_changes(self.conn, COLUMNS, None, join=JOIN)
+        self.assertTrue(feed['reset'])
+        self.assertEqual(sorted(row['organization'] for row in feed['upserts']), ['Alpha', 'Bravo', 'Charlie'])
+
+    def test_target_writes_show_up_once(self):
+        self.conn.execute("UPDATE targets SET status = 'won' WHERE organization = 'Alpha'")
+        self.conn.execute("UPDATE targets SET status = 'lost' WHERE organization = 'Alpha'")
+        self.conn.execute("DELETE FROM targets WHERE organization = 'Charlie'")
+        feed = self.changes()
+        self.assertFalse(feed['reset'])
+        self.assertEqual([(row['organization'], row['status']) for row in feed['upserts']], [('Alpha', 'lost')])
+        self.assertEqual(feed['deletes'], ['Charlie'])
+        self.assertEqual(self.changes(feed['version'])['upserts'], [])
+
+    def test_regrading_a_zip_resends_its_targets(self):
+        self.conn.execute("UPDATE zip_data SET grade = 'C' WHERE zip_code = '02139'")
+        self.conn.execute("UPDATE zip_data SET grade = 'B' WHERE zip_code = '10001'")  # unchanged
+        feed = self.changes()
+        self.assertEqual(sorted((row['organization'], row['grade']) for row in feed['upserts']),
+                         [('Alpha', 'C'), ('Bravo', 'C')])
+        self.conn.execute("DELETE FROM zip_data WHERE zip_code = '10001'")
+        feed = self.changes(feed['version'])
+        self.assertEqual([(row['organization'], row['grade']) for row in feed['upserts']], [('Charlie', None)])
+
+    def test_token_from_another_epoch_resets(self):
+        renew_data_epoch(self.conn)
+        feed = self.changes()
+        self.assertTrue(feed['reset'])
+        self.assertEqual(feed['deletes'], [])
+        self.assertEqual(len(feed['upserts']), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
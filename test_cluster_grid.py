@@ -0,0 +1,66 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from db import connect
+from migrations import migrate
+from spatial import ensure_cluster_grid, query_clusters, rebuild_cluster_grid
+
+# cluster_grid is kept up to date by triggers on targets: whatever a writer
+# does to a target, the grid must match a rebuild from scratch.
+STATUSES = ['not contacted', 'In Discussion', 'partnership-agreed', None]
+WORLD = (-180.0, -85.0, 180.0, 85.0)
+
+
+class ClusterGridTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conn = connect(os.path.join(self.dir, 'targets.db'))
+        migrate(self.conn, verbose=False)
+        rng = random.Random(7)
+        self.conn.executemany(
+            'INSERT INTO targets (organization, status, latitude, longitude) VALUES (?, ?, ?, ?)',
+            [(f'Org {i}', rng.choice(STATUSES), rng.uniform(25, 49), rng.uniform(-124, -67))
+             for i in range(200)]
+        )
+        ensure_cluster_grid(self.conn)
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def grid(self):
+        return {tuple(row[:5]): (round(row[5], 6), round(row[6], 6)) for row in self.conn.execute(
+            'SELECT zoom, cell_x, cell_y, status, count, sum_lat, sum_lng FROM cluster_grid')}
+
+    def assertGridMatchesRebuild(self):
+        kept = self.grid()
+        rebuild_cluster_grid(self.conn)
+        self.assertEqual(kept, self.grid())
+
+    def total(self, zoom):
+        return sum(cluster['count'] for cluster in query_clusters(self.conn, WORLD, zoom))
+
+    def test_delete_removes_targets_from_every_zoom(self):
+        self.conn.execute("DELETE FROM targets WHERE organization IN ('Org 1', 'Org 2', 'Org 3', 'Org 4', 'Org 5')")
+        targets = self.conn.execute('SELECT COUNT(*) FROM targets').fetchone()[0]
+        self.assertEqual(targets, 195)
+        for zoom in (3, 5, 15):
+            self.assertEqual(self.total(zoom), 195)
+        self.assertGridMatchesRebuild()
+
+    def test_insert_move_and_status_change(self):
+        self.conn.execute(
+            "INSERT INTO targets (organization, status, latitude, longitude) VALUES ('New', 'Qualified', 40.7, -74.0)")
+        self.conn.execute("UPDATE targets SET latitude = 34.05, longitude = -118.25 WHERE organization = 'Org 10'")
+        self.conn.execute("UPDATE targets SET latitude = NULL WHERE organization = 'Org 11'")
+        self.conn.execute("UPDATE targets SET status = 'qualified' WHERE organization IN ('Org 12', 'Org 13')")
+        self.assertEqual(self.total(5), 200)
+        self.assertGridMatchesRebuild()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from dashboard_summary import check_summary, ensure_dashboard_summary, read_summary
+from db import connect
+from migrations import migrate
+
+# The dashboard totals are kept by triggers on targets and zip_data: after
+# any writes they must equal a full recount.
+# Run with: python -m unittest test_dashboard_summary (or pytest)
+ZIPS = [('10001', 'A'), ('10002', 'B'), ('10003', None)]
+TARGETS = [
+    ('Alpha', 'Not Contacted', 1000, 50000, '10001'),
+    ('Bravo', 'not-contacted', None, 60000, '10001'),
+    ('Charlie', 'In Discussion', 2500, None, '10002'),
+    ('Delta', None, 400, 30000, '10003'),
+    ('Echo', 'partnership-agreed', 800, 45000, None),
+]
+
+
+class DashboardSummaryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conn = connect(os.path.join(self.dir, 'targets.db'))
+        migrate(self.conn, verbose=False)
+        self.conn.executemany('INSERT INTO zip_data (zip_code, grade) VALUES (?, ?)', ZIPS)
+        self.conn.executemany(
+            'INSERT INTO targets (organization, status, population, median_income, region) VALUES (?, ?, ?, ?, ?)',
+            TARGETS
+        )
+        ensure_dashboard_summary(self.conn)
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def test_built_from_existing_rows(self):
+        statuses, grades = read_summary(self.conn)
+        self.assertEqual(statuses['not-contacted'], (3, 1400, 2, 140000, 3))
+        self.assertEqual(grades, {'A': 2, 'B': 1})
+        self.assertEqual(check_summary(self.conn), [])
+
+    def test_target_writes(self):
+        self.conn.execute("UPDATE targets SET status = 'in-discussion' WHERE organization = 'Alpha'")
+        self.conn.execute("UPDATE targets SET population = 900, median_income = NULL WHERE organization = 'Bravo'")
+        self.conn.execute("UPDATE targets SET region = '10002' WHERE organization = 'Bravo'")
+        self.conn.execute("UPDATE targets SET region = '10001' WHERE organization = 'Echo'")
+        self.conn.execute("DELETE FROM targets WHERE organization = 'Charlie'")
+        self.conn.execute(
+            "INSERT INTO targets (organization, status, population, region) VALUES ('Foxtrot', 'Low Priority', 10, '10003')")
+        self.assertEqual(check_summary(self.conn), [])
+        self.assertEqual(read_summary(self.conn)[1], {'A': 2, 'B': 1})
+
+    def test_zip_writes(self):
+        self.conn.execute("UPDATE zip_data SET grade = 'C' WHERE zip_code = '10001'")
+        self.conn.execute("UPDATE zip_data SET grade = 'A' WHERE zip_code = '10003'")
+        self.conn.execute("DELETE FROM zip_data WHERE zip_code = '10002'")
+        self.conn.execute("INSERT INTO zip_data (zip_code, grade) VALUES ('10004', 'B')")
+        self.conn.execute("UPDATE targets SET region = '10004' WHERE organization = 'Echo'")
+        self.assertEqual(check_summary(self.conn), [])
+        self.assertEqual(read_summary(self.conn)[1], {'C': 2, 'A': 1, 'B': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
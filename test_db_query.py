@@ -0,0 +1,65 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import db_query
+from db_query import QueryError, run_query
+
+# DB manager paging: keyset pages on a unique key, offset pages otherwise,
+# and every row is returned exactly once either way.
+
+
+class RunQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'targets.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, grp INTEGER)')
+        conn.executemany('INSERT INTO t VALUES (?, ?)', [(i, i // 4) for i in range(1, 26)])
+        conn.commit()
+        conn.close()
+        self.saved_path, db_query.DB_PATH = db_query.DB_PATH, path
+
+    def tearDown(self):
+        db_query.DB_PATH = self.saved_path
+        shutil.rmtree(self.dir)
+
+    def pages(self, query, key=None):
+        rows, page = [], run_query(query, page_size=10, key=key)
+        while True:
+            rows += page['rows']
+            if not page['next']:
+                return rows, page
+            page = run_query(query, page_size=10, **page['next'])
+
+    def test_keyset_pages_cover_every_row(self):
+        first = run_query('SELECT id, grp FROM t', page_size=10, key='id')
+        self.assertEqual(first['next'], {'key': 'id', 'after': 10})
+        rows, _ = self.pages('SELECT id, grp FROM t', key='id')
+        self.assertEqual([row[0] for row in rows], list(range(1, 26)))
+
+    def test_non_unique_key_falls_back_to_offsets(self):
+        first = run_query('SELECT id, grp FROM t', page_size=10, key='grp')
+        self.assertEqual(first['next'], {'offset': 10})
+        rows, _ = self.pages('SELECT id, grp FROM t', key='grp')
+        self.assertEqual(sorted(row[0] for row in rows), list(range(1, 26)))
+
+    def test_trailing_comment(self):
+        rows, _ = self.pages('SELECT id FROM t -- every row', key='id')
+        self.assertEqual(len(rows), 25)
+
+    def test_bad_parameters(self):
+        with self.assertRaises(QueryError):
+            run_query('SELECT id FROM t', page_size='ten')
+        with self.assertRaises(QueryError):
+            run_query('SELECT id FROM t', offset=None)
+        with self.assertRaises(QueryError):
+            run_query('SELECT id FROM t', key='nope')
+        with self.assertRaises(QueryError):
+            run_query('DELETE FROM t')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import db
+from db import connect, reset_pools
+from events import EventBroker, ensure_events_table, publish
+
+# /api/events resumes from Last-Event-ID, and tells clients to reload with a
+# 'reset' event when the log they are following is gone (a restored file).
+# Run with: python -m unittest test_events (or pytest)
+
+
+class EventBrokerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'targets.db')
+        conn = connect(path)
+        ensure_events_table(conn)
+        conn.commit()
+        conn.close()
+        self.saved_path, db.DB_PATH = db.DB_PATH, path
+        self.publish(3)
+        self.broker = EventBroker()
+        # Started by hand, without the poller thread: the tests poll
+        self.broker._pid = os.getpid()
+        self.broker._last_id = self.broker._max_id()
+
+    def tearDown(self):
+        reset_pools()
+        db.DB_PATH = self.saved_path
+        shutil.rmtree(self.dir)
+
+    def publish(self, count):
+        conn = connect(db.DB_PATH)
+        for i in range(count):
+            publish(conn, 'status', {'n': i})
+        conn.commit()
+        conn.close()
+
+    def frames(self, stream, count):
+        return [next(stream) for _ in range(count)]
+
+    def test_resume_replays_missed_events(self):
+        stream = self.broker.subscribe(last_event_id=1)
+        self.assertEqual(self.frames(stream, 3), [
+            'id: 2\nevent: status\ndata: {"n": 1}\n\n',
+            'id: 3\nevent: status\ndata: {"n": 2}\n\n',
+            ': connected\n\n',
+        ])
+        self.publish(1)
+        self.broker._poll()
+        self.assertEqual(next(stream), 'id: 4\nevent: status\ndata: {"n": 0}\n\n')
+        stream.close()
+        self.assertEqual(self.broker.subscribers, 0)
+
+    def test_resume_from_a_log_that_is_gone(self):
+        stream = self.broker.subscribe(last_event_id=50)
+        self.assertEqual(self.frames(stream, 2), [
+            'id: 3\nevent: reset\ndata: {}\n\n',
+            ': connected\n\n',
+        ])
+        stream.close()
+
+    def test_swapped_database_resets_open_streams(self):
+        stream = self.broker.subscribe()
+        self.assertEqual(next(stream), ': connected\n\n')
+        # The restored file's log ends before the one being followed
+        conn = connect(db.DB_PATH)
+        conn.execute('DELETE FROM events WHERE id > 1')
+        conn.commit()
+        conn.close()
+        self.broker._poll()
+        self.assertEqual(next(stream), 'id: 1\nevent: reset\ndata: {}\n\n')
+        # and then it follows the new log
+        self.publish(1)
+        self.broker._poll()
+        self.assertEqual(next(stream), 'id: 4\nevent: status\ndata: {"n": 0}\n\n')
+        stream.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from db import connect, ensure_data_version
+from geocode_cache import GeocodeCache, ensure_geocode_cache
+from migrations import migrate
+
+# The geocode LRU must follow writes to geocode_cache (directly or through the
+# zip_data triggers) from any connection, and nothing else.
+
+
+class GeocodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'targets.db')
+        self.conn = connect(self.path)
+        migrate(self.conn, verbose=False)
+        ensure_data_version(self.conn)
+        self.conn.execute("INSERT INTO zip_data (zip_code, latitude, longitude) VALUES ('02139', 42.36, -71.10)")
+        ensure_geocode_cache(self.conn)
+        self.conn.commit()
+        self.cache = GeocodeCache()
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def lookup(self, *zip_codes):
+        return self.cache.get_many(zip_codes, self.conn)
+
+    def test_zip_data_changes_reach_the_cache(self):
+        self.assertEqual(self.lookup('02139')['02139']['latitude'], 42.36)
+        self.conn.execute("UPDATE zip_data SET latitude = 42.37 WHERE zip_code = '02139'")
+        self.conn.execute("INSERT INTO zip_data (zip_code, latitude, longitude) VALUES ('10001', 40.75, -73.99)")
+        self.conn.commit()
+        found = self.lookup('02139', '10001')
+        self.assertEqual(found['02139']['latitude'], 42.37)
+        self.assertEqual(found['10001']['source'], 'zip_data')
+        self.conn.execute("DELETE FROM zip_data WHERE zip_code = '10001'")
+        self.conn.commit()
+        self.assertNotIn('10001', self.lookup('10001'))
+
+    def test_other_tables_keep_the_lru(self):
+        self.lookup('02139')
+        self.conn.execute("INSERT INTO targets (organization, status) VALUES ('Alpha', 'In Discussion')")
+        self.conn.execute("INSERT INTO notes (target_id, content) VALUES ('Alpha', 'called')")
+        self.conn.commit()
+        self.assertEqual(len(self.cache._entries), 1)
+
+    def test_writes_from_another_connection_empty_the_lru(self):
+        self.lookup('02139')
+        other = connect(self.path)
+        try:
+            GeocodeCache().put('02139', 1.0, 2.0, other, source='manual')
+            other.commit()
+        finally:
+            other.close()
+        self.assertEqual(self.lookup('02139')['02139']['latitude'], 1.0)
+
+    def test_misses_are_not_cached(self):
+        self.assertEqual(self.lookup('99999'), {})
+        self.assertNotIn('99999', self.cache._entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from db import connect
+from migrations import migrate
+from pipeline_stats import check_pipeline_stats, ensure_pipeline_stats, rebuild_pipeline_stats
+
+# The pipeline rollups are kept by a trigger on activity_log; after any mix of
+# logged changes they must equal a replay of the whole log.
+# Run with: python -m unittest test_pipeline_stats (or pytest)
+LOG = [
+    ('Alpha', 'Not Contacted', 'initial-contact', '2025-01-01 09:00:00'),
+    ('Alpha', 'initial-contact', 'In Discussion', '2025-01-03 12:00:00'),
+    ('Bravo', None, 'initial-contact', '2025-01-03 13:00:00'),
+    # Same stage, new spelling: the clock keeps running
+    ('Alpha', 'In Discussion', 'in-discussion', '2025-01-10 08:00:00'),
+    ('Alpha', 'in-discussion', 'partnership-agreed', '2025-02-20 08:00:00'),
+    # Logged out of order, and without a usable timestamp
+    ('Bravo', 'initial-contact', 'not-interested', '2025-01-02 00:00:00'),
+    ('Charlie', 'not-contacted', 'low-priority', 'yesterday'),
+]
+
+
+class PipelineStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conn = connect(os.path.join(self.dir, 'targets.db'))
+        migrate(self.conn, verbose=False)
+        ensure_pipeline_stats(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def log(self, rows):
+        self.conn.executemany(
+            'INSERT INTO activity_log (organization, old_status, new_status, timestamp) VALUES (?, ?, ?, ?)', rows
+        )
+
+    def rollups(self):
+        return [
+            sorted(tuple(row) for row in self.conn.execute(f'SELECT * FROM {table}'))
+            for table in ('transition_daily', 'stage_entries', 'stage_durations')
+        ]
+
+    def test_trigger_matches_a_replay(self):
+        self.log(LOG)
+        self.conn.execute(
+            "INSERT INTO activity_log (organization, old_status, new_status) VALUES ('Bravo', 'not-interested', 'in-discussion')"
+        )
+        self.assertEqual(check_pipeline_stats(self.conn), [])
+        kept = self.rollups()
+        rebuild_pipeline_stats(self.conn)
+        self.assertEqual(self.rollups(), kept)
+
+    def test_durations(self):
+        self.log(LOG[:5])
+        durations = {
+            (day, status, bucket): count
+            for day, status, bucket, count, _ in self.conn.execute('SELECT * FROM stage_durations')
+        }
+        self.assertEqual(durations, {
+            ('2025-01-03', 'initial-contact', 1): 1,   # 2.1 days
+            ('2025-02-20', 'in-discussion', 3): 1,     # 48 days, from the first entry
+        })
+
+    def test_check_reports_drift(self):
+        self.log(LOG[:2])
+        self.conn.execute('DELETE FROM stage_entries')
+        self.assertEqual(len(check_pipeline_stats(self.conn)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
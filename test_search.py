@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from db import connect
+from migrations import migrate
+from search import ensure_search_index, search
+
+# targets_fts and notes_fts read their text from targets and notes and are
+# kept in step by triggers: after any writes, searches find the current text
+# only and FTS5's own integrity check passes.
+# Run with: python -m unittest test_search (or pytest)
+TARGETS = [
+    ('Westside Library', '12 Main St', 'westside.org'),
+    ('Eastside Café', '40 Main St', None),
+    ('Harbor <Clinic>', '9 Dock Rd', 'harbor.example'),
+]
+NOTES = [
+    ('Westside Library', 'Met the director, follow up in March'),
+    ('Harbor <Clinic>', 'Prefers email OR phone'),
+]
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conn = connect(os.path.join(self.dir, 'targets.db'))
+        migrate(self.conn, verbose=False)
+        self.conn.executemany('INSERT INTO targets (organization, address, website) VALUES (?, ?, ?)', TARGETS)
+        self.conn.executemany('INSERT INTO notes (target_id, content) VALUES (?, ?)', NOTES)
+        ensure_search_index(self.conn)
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def found(self, text, kind='targets'):
+        # Organizations of matching targets, ids of matching notes
+        key = 'organization' if kind == 'targets' else 'id'
+        return sorted(row[key] for row in search(self.conn, text, kinds=(kind,))[kind])
+
+    def assertIndexesIntact(self):
+        # Raises when an index disagrees with its content table
+        for table in ('targets_fts', 'notes_fts'):
+            self.conn.execute(f"INSERT INTO {table} ({table}, rank) VALUES ('integrity-check', 1)")
+
+    def test_built_from_existing_rows(self):
+        self.assertEqual(self.found('main'), ['Eastside Café', 'Westside Library'])
+        # Prefixes, and accents folded
+        self.assertEqual(self.found('west lib'), ['Westside Library'])
+        self.assertEqual(self.found('cafe'), ['Eastside Café'])
+        self.assertIndexesIntact()
+
+    def test_target_writes(self):
+        self.conn.execute(
+            "UPDATE targets SET organization = 'Northside Library', website = 'northside.org' "
+            "WHERE organization = 'Westside Library'")
+        self.conn.execute("UPDATE targets SET address = '1 Pier Ave' WHERE organization = 'Harbor <Clinic>'")
+        self.conn.execute("DELETE FROM targets WHERE organization = 'Eastside Café'")
+        self.conn.execute("INSERT INTO targets (organization, address) VALUES ('Main Street Market', '3 Elm St')")
+        self.assertEqual(self.found('westside'), [])
+        self.assertEqual(self.found('library'), ['Northside Library'])
+        self.assertEqual(self.found('main'), ['Main Street Market', 'Northside Library'])
+        self.assertEqual(self.found('pier'), ['Harbor <Clinic>'])
+        self.assertEqual(self.found('dock'), [])
+        self.assertIndexesIntact()
+
+    def test_note_writes(self):
+        first, second = [row[0] for row in self.conn.execute('SELECT id FROM notes ORDER BY id')]
+        self.conn.execute("UPDATE notes SET content = 'Director moved to April' WHERE id = ?", (first,))
+        self.conn.execute('DELETE FROM notes WHERE id = ?', (second,))
+        new = self.conn.execute(
+            "INSERT INTO notes (target_id, content) VALUES ('Eastside Café', 'Call the director')").lastrowid
+        self.assertEqual(self.found('march', 'notes'), [])
+        self.assertEqual(self.found('director', 'notes'), [first, new])
+        self.assertEqual(self.found('email', 'notes'), [])
+        self.assertIndexesIntact()
+
+    def test_input_is_taken_literally(self):
+        # FTS5 operators and markup in the text are words, not syntax
+        self.assertEqual(self.found('email OR', 'notes'), [2])
+        self.assertEqual(self.found('"clinic'), ['Harbor <Clinic>'])
+        row, = search(self.conn, 'clinic', kinds=('targets',))['targets']
+        self.assertEqual(row['snippet'], 'Harbor &lt;<mark>Clinic</mark>&gt;')
+        with self.assertRaises(ValueError):
+            search(self.conn, ' -- ')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from db import connect
+from geo import EARTH_RADIUS_MI
+from migrations import migrate
+from spatial import ensure_spatial_index, query_targets_in_bbox, query_within_radius, rebuild_spatial_index
+
+# targets_rtree is kept up to date by triggers on targets: bbox and radius
+# lookups must find exactly what a scan of the table finds, after any writes.
+# Run with: python -m unittest test_spatial (or pytest)
+NEW_YORK = (40.71, -74.01)
+
+
+def great_circle_miles(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MI * math.asin(math.sqrt(a))
+
+
+class SpatialIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conn = connect(os.path.join(self.dir, 'targets.db'))
+        migrate(self.conn, verbose=False)
+        rng = random.Random(11)
+        self.conn.executemany(
+            'INSERT INTO targets (organization, latitude, longitude) VALUES (?, ?, ?)',
+            [(f'Org {i}', NEW_YORK[0] + rng.uniform(-1, 1), NEW_YORK[1] + rng.uniform(-1, 1))
+             for i in range(300)]
+        )
+        self.conn.executemany('INSERT INTO targets (organization, latitude, longitude) VALUES (?, ?, ?)', [
+            ('Fiji', -17.7, 178.9), ('Samoa', -13.8, -172.1), ('Nowhere', None, None),
+        ])
+        ensure_spatial_index(self.conn)
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def in_bbox(self, bbox):
+        return sorted(row[0] for row in query_targets_in_bbox(self.conn, 't.organization', bbox))
+
+    def scan(self, bbox):
+        west, south, east, north = bbox
+        lng = 'longitude BETWEEN ? AND ?' if west <= east else '(longitude >= ? OR longitude <= ?)'
+        return sorted(row[0] for row in self.conn.execute(
+            f'SELECT organization FROM targets WHERE latitude BETWEEN ? AND ? AND {lng}',
+            (south, north, west, east)))
+
+    def write(self):
+        self.conn.execute("DELETE FROM targets WHERE organization IN ('Org 1', 'Org 2')")
+        self.conn.execute("UPDATE targets SET latitude = 40.2, longitude = -73.5 WHERE organization = 'Org 3'")
+        self.conn.execute("UPDATE targets SET latitude = NULL WHERE organization = 'Org 4'")
+        self.conn.execute("UPDATE targets SET latitude = 40.9, longitude = -74.2 WHERE organization = 'Nowhere'")
+        self.conn.execute("INSERT INTO targets (organization, latitude, longitude) VALUES ('New', 40.5, -74.5)")
+        # Not a coordinate: must leave the index alone
+        self.conn.execute("UPDATE targets SET status = 'in-discussion' WHERE organization = 'Org 5'")
+
+    def test_bbox_matches_a_scan_after_writes(self):
+        self.write()
+        for bbox in [(-74.3, 40.5, -73.7, 40.9), (-75.5, 39.5, -72.5, 42.0), (170.0, -20.0, -170.0, -10.0)]:
+            self.assertEqual(self.in_bbox(bbox), self.scan(bbox))
+        # Across the antimeridian
+        self.assertEqual(self.in_bbox((170.0, -20.0, -170.0, -10.0)), ['Fiji', 'Samoa'])
+
+    def test_radius_matches_great_circle_distance(self):
+        self.write()
+        found = query_within_radius(self.conn, 'targets', 't.organization, t.latitude, t.longitude',
+                                    *NEW_YORK, 25)
+        miles = [distance for distance, _ in found]
+        self.assertEqual(miles, sorted(miles))
+        expected = sorted(
+            row[0] for row in self.conn.execute(
+                'SELECT organization, latitude, longitude FROM targets WHERE latitude IS NOT NULL')
+            if great_circle_miles(*NEW_YORK, row[1], row[2]) <= 25
+        )
+        self.assertEqual(sorted(row['organization'] for _, row in found), expected)
+
+    def test_index_matches_rebuild(self):
+        self.write()
+        index = 'SELECT * FROM targets_rtree ORDER BY id'
+        kept = self.conn.execute(index).fetchall()
+        rebuild_spatial_index(self.conn)
+        self.assertEqual([tuple(row) for row in kept],
+                         [tuple(row) for row in self.conn.execute(index)])
+
+
+if __name__ == '__main__':
+    unittest.main()
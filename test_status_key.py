@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from db import connect
+from export_targets import iter_export_batches
+from migrations import migrate
+from spatial import ensure_cluster_grid, query_clusters
+
+# Targets whose status is spelled several ways must land in one status
+# everywhere status_key is used: export filters and the map's cluster grid.
+# Run with: python -m unittest test_status_key (or pytest)
+TARGETS = [
+    ('Alpha', 'In Discussion'),
+    ('Bravo', 'in discussion'),
+    ('Charlie', ' in-discussion '),
+    ('Delta', 'Not Contacted'),
+    ('Echo', None),
+    ('Foxtrot', ''),
+    ('Golf', 'Partnership Agreed'),
+]
+LAT, LNG = 40.7, -74.0
+BBOX = (-75.0, 40.0, -73.0, 41.0)
+
+
+class StatusKeyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conn = connect(os.path.join(self.dir, 'targets.db'))
+        migrate(self.conn, verbose=False)
+        self.conn.executemany(
+            'INSERT INTO targets (organization, status, latitude, longitude) VALUES (?, ?, ?, ?)',
+            [(organization, status, LAT, LNG) for organization, status in TARGETS]
+        )
+        ensure_cluster_grid(self.conn)
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def exported(self, statuses):
+        batches = iter_export_batches(self.conn, statuses=statuses)
+        columns = next(batches)
+        index = columns.index('organization')
+        return [row[index] for batch in batches for row in batch]
+
+    def statuses(self):
+        clusters = query_clusters(self.conn, BBOX, 10)
+        self.assertEqual(len(clusters), 1)
+        return clusters[0]['statuses']
+
+    def test_export_matches_every_spelling(self):
+        self.assertEqual(self.exported(['in discussion']), ['Alpha', 'Bravo', 'Charlie'])
+        self.assertEqual(self.exported(['IN-DISCUSSION', 'not contacted']),
+                         ['Alpha', 'Bravo', 'Charlie', 'Delta', 'Echo', 'Foxtrot'])
+
+    def test_cluster_grid_buckets_by_status_key(self):
+        self.assertEqual(self.statuses(), {
+            'in-discussion': 3, 'not-contacted': 3, 'partnership-agreed': 1,
+        })
+
+    def test_status_changes_keep_one_bucket(self):
+        self.conn.executemany('UPDATE targets SET status = ? WHERE organization = ?', [
+            ('in-discussion', 'Alpha'),  # same status, new spelling
+            ('Not Interested', 'Bravo'),
+            ('not contacted', 'Echo'),
+        ])
+        self.assertEqual(self.statuses(), {
+            'in-discussion': 2, 'not-contacted': 3, 'partnership-agreed': 1, 'not-interested': 1,
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
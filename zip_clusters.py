@@ -0,0 +1,167 @@
+import argparse
+import os
+import time
+
+from db import connect
+from geo import PointGrid
+
+# Fills the zip_data.cluster_* columns. For each grade set and radius, ZIPs of
+# those grades are clustered by density: a ZIP with at least MIN_NEIGHBORS
+# same-set ZIPs within the radius (itself included) is a core ZIP, and core
+# ZIPs within the radius of each other, plus the ZIPs they reach, form one
+# cluster. Clusters smaller than MIN_CLUSTER_SIZE are dropped. Labels look like
+# 'A,B_5mi_C3', numbered in ZIP code order.
+GRADE_SETS = {
+    'a': ('A',),
+    'ab': ('A', 'B'),
+    'abc': ('A', 'B', 'C'),
+    'bc': ('B', 'C'),
+}
+RADII_MI = (5, 10)
+MIN_NEIGHBORS = 3
+MIN_CLUSTER_SIZE = 3
+
+
+def analysis_columns():
+    return [
+        (f'cluster_{key}_{radius}mi', grades, radius)
+        for key, grades in GRADE_SETS.items()
+        for radius in RADII_MI
+    ]
+
+
+def cluster_points(neighbors, min_neighbors=MIN_NEIGHBORS, min_size=MIN_CLUSTER_SIZE):
+    # neighbors[i]: ids within the radius of point i. Returns a cluster number
+    # (1, 2, ...) or None per point.
+    labels = [None] * len(neighbors)
+    clusters = []
+    for start in range(len(neighbors)):
+        if labels[start] is not None or len(neighbors[start]) < min_neighbors:
+            continue
+        cluster = len(clusters)
+        labels[start] = cluster
+        members = [start]
+        stack = [start]
+        while stack:
+            point = stack.pop()
+            if len(neighbors[point]) < min_neighbors:
+                continue  # border ZIP: part of the cluster, does not extend it
+            for other in neighbors[point]:
+                if labels[other] is None:
+                    labels[other] = cluster
+                    members.append(other)
+                    stack.append(other)
+        clusters.append(members)
+
+    # Drop small clusters and renumber the rest without gaps
+    numbers = {}
+    for cluster, members in enumerate(clusters):
+        if len(members) >= min_size:
+            numbers[cluster] = len(numbers) + 1
+    return [numbers.get(label) if label is not None else None for label in labels]
+
+
+def compute_clusters(conn, min_neighbors=MIN_NEIGHBORS, min_size=MIN_CLUSTER_SIZE):
+    # {zip_code: {column: label or None}} for every ZIP with a location
+    rows = conn.execute('''
+        SELECT zip_code, latitude, longitude, grade FROM zip_data
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        ORDER BY zip_code
+    ''').fetchall()
+    results = {row[0]: {} for row in rows}
+    for column, grades, radius in analysis_columns():
+        members = [row for row in rows if row[3] in grades]
+        grid = PointGrid(((row[1], row[2]) for row in members), cell_miles=radius)
+        labels = cluster_points(grid.neighbor_lists(radius), min_neighbors, min_size)
+        prefix = f"{','.join(grades)}_{radius}mi_C"
+        for row in rows:
+            results[row[0]][column] = None
+        for row, label in zip(members, labels):
+            if label is not None:
+                results[row[0]][column] = f'{prefix}{label}'
+    return results
+
+
+def write_clusters(conn, results):
+    # Bulk write-back; only rows whose labels changed are touched
+    columns = [column for column, _, _ in analysis_columns()]
+    current = {
+        row[0]: tuple(row[1:])
+        for row in conn.execute(f"SELECT zip_code, {', '.join(columns)} FROM zip_data")
+    }
+    updates = []
+    for zip_code, labels in results.items():
+        values = tuple(labels[column] for column in columns)
+        if current.get(zip_code) != values:
+            updates.append(values + (zip_code,))
+    # ZIPs without a location cannot be in any cluster
+    for zip_code, values in current.items():
+        if zip_code not in results and any(values):
+            updates.append((None,) * len(columns) + (zip_code,))
+    conn.executemany(
+        f"UPDATE zip_data SET {', '.join(f'{column} = ?' for column in columns)} WHERE zip_code = ?",
+        updates
+    )
+    return len(updates)
+
+
+def write_cluster_lists(results, directory):
+    # data/cluster_<grades>_<radius>mi.txt: one clustered ZIP per line
+    for column, grades, radius in analysis_columns():
+        path = os.path.join(directory, f"cluster_{''.join(grades)}_{radius}mi.txt")
+        with open(path, 'w') as f:
+            for zip_code, labels in results.items():
+                if labels[column]:
+                    f.write(zip_code + '\n')
+
+
+def summarize(results):
+    summary = {}
+    for column, _, _ in analysis_columns():
+        labels = [labels[column] for labels in results.values() if labels[column]]
+        summary[column] = {'clusters': len(set(labels)), 'zips': len(labels)}
+    return summary
+
+
+def run_clustering(conn, min_neighbors=MIN_NEIGHBORS, min_size=MIN_CLUSTER_SIZE, dry_run=False):
+    # Compute and store every cluster column; the caller commits
+    started = time.perf_counter()
+    results = compute_clusters(conn, min_neighbors, min_size)
+    computed = time.perf_counter() - started
+    updated = 0 if dry_run else write_clusters(conn, results)
+    return {
+        'zips': len(results),
+        'updated': updated,
+        'compute_seconds': round(computed, 3),
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'analyses': summarize(results),
+    }, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the zip_data cluster_* columns from ZIP grades.')
+    parser.add_argument('--db', help='database path (default: data/targets.db)')
+    parser.add_argument('--min-neighbors', type=int, default=MIN_NEIGHBORS,
+                        help=f'ZIPs within the radius, itself included, to seed a cluster (default: {MIN_NEIGHBORS})')
+    parser.add_argument('--min-size', type=int, default=MIN_CLUSTER_SIZE,
+                        help=f'smallest cluster kept (default: {MIN_CLUSTER_SIZE})')
+    parser.add_argument('--write-lists', metavar='DIR',
+                        help='also write cluster_<grades>_<radius>mi.txt ZIP lists into DIR')
+    parser.add_argument('--dry-run', action='store_true', help='compute and report without writing')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        summary, results = run_clustering(conn, args.min_neighbors, args.min_size, args.dry_run)
+        conn.commit()
+    finally:
+        conn.close()
+    if args.write_lists:
+        write_cluster_lists(results, args.write_lists)
+
+    for column, counts in summary['analyses'].items():
+        print(f"{column}: {counts['clusters']} clusters, {counts['zips']} ZIPs")
+    print(
+        f"Clustered {summary['zips']} ZIPs in {summary['compute_seconds']}s, "
+        f"updated {summary['updated']} rows in {summary['total_seconds']}s"
+    )